@@ -1,10 +1,20 @@
+import argparse
 import csv
+import hashlib
+import json
 import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date
+from functools import partial
 
 import requests
 from bs4 import BeautifulSoup
 from requests import Response
+from sharding import in_shard, parse_shard
 
 """
 Script for checking the health of permalinks & whether they can be rendered.
@@ -37,8 +47,42 @@ with the following headers:
 permalink_id, response_time
 ```
 
+Each permalink is added to 'checked-permalinks.csv' once its results are written, and the permalinks already in it are
+skipped, so an interrupted check can be resumed by running it again.
+
+To check the permalinks again later, e.g. for a nightly health check, use the cache option:
+`pipenv run python scripts/permalink_snapshots/check_permalinks.py --cache`
+
+Each permalink's ETag and Last-Modified headers, body hash and classification (i.e. the invalid permalinks row written
+for it, if any) are recorded in 'permalink-cache.csv'. Later checks send conditional requests, and reuse the cached
+classification if the permalink hasn't been modified or its body is unchanged, rather than parsing the page again.
+
+If the server doesn't support conditional requests, use the changed since option to only check the permalinks
+created on or after a date, e.g. the date of the last check: `--changed-since 2024-01-01`.
+
+To split the checks between several machines, e.g. CI agents, give each of them a different shard of the permalinks,
+e.g. `--shard 0/4` to `--shard 3/4`. Permalinks are assigned to shards by a hash of their Id, so every machine can use
+the same 'prod-permalinks.csv' and no permalink is checked twice. The invalid permalinks files of the shards can then be
+concatenated.
+
+By default permalinks are checked one at a time, with a backoff between them. To check several at once, use the
+concurrency option, e.g. `--concurrency 8 --max-rate 4`. The workers share a pool of keep-alive connections and
+classify the pages they fetch, while a single writer thread writes all of the csv files in the same schemas as a
+sequential check, so rows are never interleaved. The max rate caps the number of requests per second across all of
+the workers, so that production isn't overloaded.
+
+To check the permalinks against another environment, e.g. a stand-in server replaying recorded responses with
+injected faults (see 'useful-scripts/stand_in_server'), use the public URL option: `--public-url http://localhost:3000`.
+
 """
 
+PROD_PUBLIC_URL = "https://explore-education-statistics.service.gov.uk"
+
+# requests per second across all workers when checking permalinks concurrently
+DEFAULT_MAX_RATE = 4.0
+
+CACHE_HEADERS = ["permalink_id", "etag", "last_modified", "content_hash", "invalid_row"]
+
 
 class PermalinkType:
     id = str
@@ -52,13 +96,47 @@ class PermalinkType:
 requests.sessions.HTTPAdapter(pool_connections=100, pool_maxsize=100, max_retries=3)
 
 
+class RateLimiter:
+    """
+    Spaces out the requests of any number of threads so that no more than max_rate are started per second.
+    """
+
+    def __init__(self, max_rate: float):
+        self.interval = 1 / max_rate
+        self.next_request_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            request_time = max(now, self.next_request_time)
+            self.next_request_time = request_time + self.interval
+
+        time.sleep(request_time - now)
+
+
 class PermalinkChecker:
-    def __init__(self):
+    def __init__(
+        self,
+        use_cache: bool = False,
+        changed_since: date | None = None,
+        shard: tuple[int, int] | None = None,
+        public_url: str = PROD_PUBLIC_URL,
+        concurrency: int = 1,
+        max_rate: float = DEFAULT_MAX_RATE,
+    ):
         # change 'expected_row_length' to the number of rows in the 'prod-permalinks.csv' file
         self.expected_row_length = 23310
         self.backoff = 1.75
         self.request_timeout = 15
         self.session = requests.Session()
+        self.concurrency = concurrency
+        self.max_rate = max_rate
+        # the connections of the session are shared by the workers when checking permalinks concurrently
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        # set when checking permalinks concurrently, see '_write'
+        self.write_queue: queue.Queue | None = None
         self.prod_permalinks_csv = os.path.join(os.getcwd() + "/scripts/permalink_snapshots", "prod-permalinks.csv")
         self.invalid_permalinks_csv = os.path.join(
             os.getcwd() + "/scripts/permalink_snapshots", "invalid-permalinks.csv"
@@ -66,7 +144,14 @@ class PermalinkChecker:
         self.checked_permalinks_csv = os.path.join(
             os.getcwd() + "/scripts/permalink_snapshots", "checked-permalinks.csv"
         )
-        self.public_url = "https://explore-education-statistics.service.gov.uk"
+        self.cache_csv = os.path.join(os.getcwd() + "/scripts/permalink_snapshots", "permalink-cache.csv")
+        self.use_cache = use_cache
+        self.cache: dict[str, dict] = {}
+        # the permalinks in 'prod-permalinks.csv' by Id, loaded once per run
+        self.permalinks: dict[str, PermalinkType] = {}
+        self.changed_since = changed_since
+        self.shard = shard
+        self.public_url = public_url.rstrip("/")
         self.permalink_base_url = f"{self.public_url}/data-tables/permalink/"
 
         assert os.path.basename(os.getcwd()) == "robot-tests", "Must run from the robot-tests directory"
@@ -99,10 +184,108 @@ class PermalinkChecker:
 
     def _build_permalink_urls(self):
         permalinks = self._get_permalinks_from_csv()
+        self.permalinks = {permalink["id"]: permalink for permalink in permalinks}
+
+        if self.shard:
+            permalinks = [permalink for permalink in permalinks if in_shard(permalink["id"], self.shard)]
+            print(f"Checking the {len(permalinks)} permalinks in shard {self.shard[0]}/{self.shard[1]}")
+
+        if self.changed_since:
+            # the created column is a SQL Server datetime, e.g. 2023-04-11 10:22:33.1234567
+            permalinks = [
+                permalink
+                for permalink in permalinks
+                if date.fromisoformat(permalink["created"][:10]) >= self.changed_since
+            ]
+            print(f"Checking {len(permalinks)} permalinks created on or after {self.changed_since}")
 
         return [f"{self.permalink_base_url}{permalink['id']}" for permalink in permalinks]
 
-    def _write_status_to_csv(self, response: Response, permalink_id: str):
+    def _load_checked_permalink_ids(self) -> set[str]:
+        with open(self.checked_permalinks_csv, "r", newline="") as csvfile:
+            # the header row may be missing, e.g. from a file created by hand, in which case its first row is an Id
+            return {row[0] for row in csv.reader(csvfile, delimiter=",") if row and row[0].strip() != "permalink_id"}
+
+    def _open_csv_writers(self, stack: ExitStack):
+        # the output files are opened once per run and appended to, rather than reopened for every permalink
+        self.invalid_permalinks_file = stack.enter_context(open(self.invalid_permalinks_csv, "a", newline=""))
+        self.checked_permalinks_file = stack.enter_context(open(self.checked_permalinks_csv, "a", newline=""))
+        self.invalid_permalinks_writer = csv.writer(self.invalid_permalinks_file, delimiter=",")
+        self.checked_permalinks_writer = csv.writer(self.checked_permalinks_file, delimiter=",")
+
+        if self.use_cache:
+            self.cache_file = stack.enter_context(open(self.cache_csv, "a", newline=""))
+            self.cache_writer = csv.writer(self.cache_file, delimiter=",")
+
+    def _load_cache(self) -> dict[str, dict]:
+        if not os.path.exists(self.cache_csv):
+            with open(self.cache_csv, "w", newline="") as csvfile:
+                csv.writer(csvfile, delimiter=",").writerow(CACHE_HEADERS)
+            return {}
+
+        with open(self.cache_csv, "r", newline="") as csvfile:
+            # a permalink which has been checked again appears twice, the latest entry wins
+            return {
+                row["permalink_id"]: {
+                    "etag": row["etag"],
+                    "last_modified": row["last_modified"],
+                    "content_hash": row["content_hash"],
+                    "invalid_row": json.loads(row["invalid_row"]) if row["invalid_row"] else None,
+                }
+                for row in csv.DictReader(csvfile)
+            }
+
+    def _write_to_cache(self, permalink_id: str, response: Response, invalid_row: list | None):
+        entry = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+            "content_hash": hashlib.sha256(response.content).hexdigest(),
+            "invalid_row": invalid_row,
+        }
+        self.cache[permalink_id] = entry
+
+        self._write(
+            self.cache_writer.writerow,
+            [
+                permalink_id,
+                entry["etag"],
+                entry["last_modified"],
+                entry["content_hash"],
+                json.dumps(invalid_row) if invalid_row else "",
+            ],
+        )
+
+    def _get_conditional_headers(self, permalink_id: str) -> dict[str, str]:
+        entry = self.cache.get(permalink_id)
+        headers = {}
+
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def _is_unchanged(self, response: Response, permalink_id: str) -> bool:
+        entry = self.cache.get(permalink_id)
+
+        if entry is None:
+            return False
+
+        return response.status_code == 304 or hashlib.sha256(response.content).hexdigest() == entry["content_hash"]
+
+    def _write_cached_status_to_csv(self, permalink_id: str, response_time: float):
+        invalid_row = self.cache[permalink_id]["invalid_row"]
+
+        if invalid_row is None:
+            print(f"Not writing permalink {permalink_id} to csv as it is unchanged and had no errors")
+            return
+
+        print(f"Writing permalink {permalink_id} to csv as it is unchanged and had an error")
+        # the response time is the last column, which is the only one to have changed
+        self._write(self.invalid_permalinks_writer.writerow, invalid_row[:-1] + [response_time])
+
+    def _write_status_to_csv(self, response: Response, permalink_id: str) -> list | None:
         if not isinstance(response, Response):
             # if the response is not a Response object (we set the response variable to a string initially),
             # then we assume that the maximum timeout has been reached and we couldn't load the permalink
@@ -112,30 +295,24 @@ class PermalinkChecker:
             has_table = False
             permalink_warning_message = " "
             response_time = " "
-            all_permalinks = self._get_permalinks_from_csv()
-
-            for permalink in all_permalinks:
-                if permalink["id"] == permalink_id:
-                    created_date = permalink["created"]
+            created_date = self.permalinks[permalink_id]["created"]
 
             print(f"Request timed out for permalink {permalink_id}. Writing to invalid permalinks file")
 
-            with open(self.invalid_permalinks_csv, "a", newline="") as csvfile:
-                writer = csv.writer(csvfile, delimiter=",")
-                writer.writerow(
-                    [
-                        permalink_id,
-                        subject_name if subject_name else " ",
-                        publication_name if publication_name else " ",
-                        response.status_code if isinstance(response, Response) else " ",
-                        has_table,
-                        created_date,
-                        permalink_error,
-                        permalink_warning_message,
-                        response_time if isinstance(response, Response) else " ",
-                    ]
-                )
-                csvfile.close()
+            self._write(
+                self.invalid_permalinks_writer.writerow,
+                [
+                    permalink_id,
+                    subject_name if subject_name else " ",
+                    publication_name if publication_name else " ",
+                    response.status_code if isinstance(response, Response) else " ",
+                    has_table,
+                    created_date,
+                    permalink_error,
+                    permalink_warning_message,
+                    response_time if isinstance(response, Response) else " ",
+                ],
+            )
 
         else:
             # if the response is a Response object, then we know that the permalink loaded successfully
@@ -147,12 +324,9 @@ class PermalinkChecker:
             permalink_out_of_date = False
             has_table = False
             has_permalink_error = False
-            all_permalinks = self._get_permalinks_from_csv()
+            has_permalink_warning_message = False
             response_time = response.elapsed.total_seconds()
-
-            for permalink in all_permalinks:
-                if permalink["id"] == permalink_id:
-                    created_date = permalink["created"]
+            created_date = self.permalinks[permalink_id]["created"]
 
             soup = BeautifulSoup(response.text, "html.parser")
 
@@ -204,90 +378,224 @@ class PermalinkChecker:
                 )
                 print("Permalink has an error. Writing to invalid permalinks file")
 
-            with open(self.invalid_permalinks_csv, "a", newline="") as csvfile:
-                writer = csv.writer(csvfile, delimiter=",")
-
-                if has_table and not permalink_error:
-                    print(f"Not writing permalink {permalink_id} to csv as it has no errors")
-
-                elif has_table and not page_title:
-                    # should never happen as all permalinks should have a page title
-                    # could be due to a massive data table in the permalink so add it to the csv
-                    # so we can check manually
-                    print(f"Writing permalink {permalink_id} to csv as it has no page title")
-                    writer.writerow(
-                        [
-                            permalink_id,
-                            subject_name if subject_name else " ",
-                            publication_name if publication_name else " ",
-                            response.status_code,
-                            has_table,
-                            created_date,
-                            permalink_out_of_date if permalink_out_of_date else False,
-                            permalink_error_message if has_permalink_error else " ",
-                            permalink_warning_message if has_permalink_warning_message else " ",
-                            response_time,
-                        ]
-                    )
-                else:
-                    # permalink has an error or rendering issues
-                    print(f"Writing permalink {permalink_id} to csv as it has an error")
-                    writer.writerow(
-                        [
-                            permalink_id,
-                            subject_name if subject_name else " ",
-                            publication_name if publication_name else " ",
-                            response.status_code,
-                            has_table,
-                            created_date,
-                            permalink_out_of_date if permalink_out_of_date else False,
-                            permalink_error_message if has_permalink_error else " ",
-                            permalink_warning_message if has_permalink_warning_message else " ",
-                            response_time,
-                        ],
-                    )
-                csvfile.close()
-
-    def _write_permalink_id_to_checked_permalinks_file(self, permalink_id: str, response_time: float):
-        with open(self.checked_permalinks_csv, "a", newline="") as csvfile:
-            writer = csv.writer(csvfile, delimiter=",")
-            writer.writerow([permalink_id, response_time])
-            csvfile.close()
+            row = None
+
+            if has_table and not permalink_error:
+                print(f"Not writing permalink {permalink_id} to csv as it has no errors")
+
+            elif has_table and not page_title:
+                # should never happen as all permalinks should have a page title
+                # could be due to a massive data table in the permalink so add it to the csv
+                # so we can check manually
+                print(f"Writing permalink {permalink_id} to csv as it has no page title")
+                row = [
+                    permalink_id,
+                    subject_name if subject_name else " ",
+                    publication_name if publication_name else " ",
+                    response.status_code,
+                    has_table,
+                    created_date,
+                    permalink_out_of_date if permalink_out_of_date else False,
+                    permalink_error_message if has_permalink_error else " ",
+                    permalink_warning_message if has_permalink_warning_message else " ",
+                    response_time,
+                ]
+            else:
+                # permalink has an error or rendering issues
+                print(f"Writing permalink {permalink_id} to csv as it has an error")
+                row = [
+                    permalink_id,
+                    subject_name if subject_name else " ",
+                    publication_name if publication_name else " ",
+                    response.status_code,
+                    has_table,
+                    created_date,
+                    permalink_out_of_date if permalink_out_of_date else False,
+                    permalink_error_message if has_permalink_error else " ",
+                    permalink_warning_message if has_permalink_warning_message else " ",
+                    response_time,
+                ]
+
+            if row:
+                self._write(self.invalid_permalinks_writer.writerow, row)
+
+            return row
+
+    def _write(self, write, *args):
+        if self.write_queue is None:
+            write(*args)
+        else:
+            # only the writer thread writes to the csv files, so that rows of concurrent checks are never interleaved
+            self.write_queue.put(partial(write, *args))
 
-    def check_permalinks(self):
-        permalink_urls = self._build_permalink_urls()
+    def _run_writer(self):
+        while (write := self.write_queue.get()) is not None:
+            write()
 
-        start = time.time()
+    def _write_permalink_id_to_checked_permalinks_file(self, permalink_id: str, response_time: float):
+        self._write(self._write_checked_row, permalink_id, response_time)
+
+    def _write_checked_row(self, permalink_id: str, response_time: float):
+        self.checked_permalinks_writer.writerow([permalink_id, response_time])
+
+        # the checked permalinks file is flushed last, so that a permalink is only skipped when resuming a run if
+        # its results were written
+        self.invalid_permalinks_file.flush()
+        if self.use_cache:
+            self.cache_file.flush()
+        self.checked_permalinks_file.flush()
+
+    def _check_permalink(self, url: str, permalink_id: str):
+        response = ""
+        response_time = ""
+
+        try:
+            response = self.session.get(
+                url, timeout=self.request_timeout, headers=self._get_conditional_headers(permalink_id)
+            )
+            response_time = response.elapsed.total_seconds()
+            print(f"Took {response_time} seconds to load permalink {permalink_id}")
 
+            if self.use_cache and self._is_unchanged(response, permalink_id):
+                self._write_cached_status_to_csv(permalink_id, response_time)
+            else:
+                invalid_row = self._write_status_to_csv(response, permalink_id)
+                if self.use_cache:
+                    self._write_to_cache(permalink_id, response, invalid_row)
+            self._write_permalink_id_to_checked_permalinks_file(permalink_id, response_time)
+        except requests.exceptions.Timeout:
+            self._write_status_to_csv(response, permalink_id)
+            self._write_permalink_id_to_checked_permalinks_file(permalink_id, response_time)
+
+    def _check_permalinks_sequentially(self, permalink_urls: list[str], checked_permalink_ids: set[str]):
         for url in permalink_urls:
             permalink_id = url.split("/")[-1]
-            if permalink_id not in open(self.checked_permalinks_csv).read():
+            if permalink_id not in checked_permalink_ids:
                 print("-----------------------------------")
                 print(f"Checking permalink {permalink_id}")
                 print("-----------------------------------")
 
-                response = ""
-                response_time = ""
-
-                try:
-                    response = self.session.get(url, timeout=self.request_timeout)
-                    response_time = response.elapsed.total_seconds()
-                    print(f"Took {response_time} seconds to load permalink")
-                    self._write_status_to_csv(response, permalink_id)
-                    self._write_permalink_id_to_checked_permalinks_file(permalink_id, response_time)
-                except requests.exceptions.Timeout:
-                    self._write_status_to_csv(response, permalink_id)
-                    self._write_permalink_id_to_checked_permalinks_file(permalink_id, response_time)
+                self._check_permalink(url, permalink_id)
+                checked_permalink_ids.add(permalink_id)
 
                 time.sleep(self.backoff)
             else:
                 print(f"Skipping permalink {permalink_id} as it has already been checked")
 
+    def _check_permalinks_concurrently(self, permalink_urls: list[str], checked_permalink_ids: set[str]):
+        rate_limiter = RateLimiter(self.max_rate)
+
+        def check(url: str, permalink_id: str):
+            rate_limiter.wait()
+            print(f"Checking permalink {permalink_id}")
+            self._check_permalink(url, permalink_id)
+
+        self.write_queue = queue.Queue()
+        writer = threading.Thread(target=self._run_writer, name="csv-writer")
+        writer.start()
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = []
+            for url in permalink_urls:
+                permalink_id = url.split("/")[-1]
+                if permalink_id not in checked_permalink_ids:
+                    futures.append(executor.submit(check, url, permalink_id))
+                    checked_permalink_ids.add(permalink_id)
+                else:
+                    print(f"Skipping permalink {permalink_id} as it has already been checked")
+
+            for future in futures:
+                future.result()
+        finally:
+            # stop at the first unexpected error, as when checking sequentially, but write what has been checked
+            executor.shutdown(cancel_futures=True)
+            self.write_queue.put(None)
+            writer.join()
+            self.write_queue = None
+
+    def check_permalinks(self):
+        permalink_urls = self._build_permalink_urls()
+        checked_permalink_ids = self._load_checked_permalink_ids()
+
+        if self.use_cache:
+            self.cache = self._load_cache()
+
+        start = time.time()
+
+        with ExitStack() as stack:
+            self._open_csv_writers(stack)
+
+            if self.concurrency > 1:
+                self._check_permalinks_concurrently(permalink_urls, checked_permalink_ids)
+            else:
+                self._check_permalinks_sequentially(permalink_urls, checked_permalink_ids)
+
         end = time.time()
 
         print(f"Checked {len(permalink_urls)} permalinks in {round((end - start) / 3600, 2)} hours")
 
 
 if __name__ == "__main__":
-    permalink_checker = PermalinkChecker()
+    ap = argparse.ArgumentParser(
+        prog=f"pipenv run python scripts/permalink_snapshots/{os.path.basename(__file__)}",
+        description="Check the health of permalinks and record those which can't be rendered.",
+    )
+    ap.add_argument(
+        "--cache",
+        dest="use_cache",
+        default=False,
+        help="Make conditional requests and reuse the results of unchanged permalinks from 'permalink-cache.csv'",
+        action=argparse.BooleanOptionalAction,
+    )
+    ap.add_argument(
+        "--changed-since",
+        dest="changed_since",
+        default=None,
+        help="Only check permalinks created on or after this date (YYYY-MM-DD)",
+        type=date.fromisoformat,
+        required=False,
+    )
+    ap.add_argument(
+        "--shard",
+        dest="shard",
+        default=None,
+        help="Only check the permalinks in shard i of N, e.g. 0/4, to split the checks between machines",
+        type=parse_shard,
+        required=False,
+    )
+    ap.add_argument(
+        "--public-url",
+        dest="public_url",
+        default=PROD_PUBLIC_URL,
+        help="URL of the public frontend to check the permalinks on",
+        type=str,
+        required=False,
+    )
+    ap.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        default=1,
+        help="Number of permalinks to check at once, rather than one at a time with a backoff between them",
+        type=int,
+        required=False,
+    )
+    ap.add_argument(
+        "--max-rate",
+        dest="max_rate",
+        default=DEFAULT_MAX_RATE,
+        help="Maximum number of requests per second across all workers when checking permalinks concurrently",
+        type=float,
+        required=False,
+    )
+    args = ap.parse_args()
+
+    permalink_checker = PermalinkChecker(
+        use_cache=args.use_cache,
+        changed_since=args.changed_since,
+        shard=args.shard,
+        public_url=args.public_url,
+        concurrency=args.concurrency,
+        max_rate=args.max_rate,
+    )
     permalink_checker.check_permalinks()
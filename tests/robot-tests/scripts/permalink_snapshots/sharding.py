@@ -0,0 +1,32 @@
+import argparse
+import hashlib
+
+"""
+Splitting a check of the permalinks between several machines, e.g. CI agents, each of which is given a shard in the
+form i/N.
+
+This is a copy of `useful-scripts/timing_utils/sharding.py`, so that the robot tests don't depend on the layout of the
+useful scripts. Keep the two in step, so that the same shard covers the same permalinks when checking them here and
+fetching them with fetch_permalinks.py.
+
+Ids are assigned to shards by a stable hash of the lower cased Id, so every machine can be given the same csv of
+permalinks and each permalink is only in one shard, whatever the case of its GUID.
+"""
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be in the form i/N, e.g. 0/4, got {value}")
+
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be from 0 to {count - 1}, got {value}")
+
+    return index, count
+
+
+def in_shard(key: str, shard: tuple[int, int]) -> bool:
+    # a stable hash rather than hash(), which is salted differently in each process
+    index, count = shard
+    return int(hashlib.sha256(key.lower().encode("utf-8")).hexdigest(), 16) % count == index
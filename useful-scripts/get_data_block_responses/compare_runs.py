@@ -0,0 +1,257 @@
+import argparse
+import functools
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+# allow the timing utilities shared with the other useful scripts to be imported when running this script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.jsonl_results import STORE_FILENAME, JsonlResultReader  # noqa: E402
+
+"""
+Semantic comparison of the responses of two runs of get_data_block_responses.py, e.g. of dev against prod.
+
+Unlike a line-based diff of the response files, the responses are compared as JSON:
+
+- volatile fields such as traceId are ignored
+- the rows of a table's results are matched by their filters, geographic level, location and time period rather than
+  by their position, and only their measures are compared. The row's id is ignored, as the ids of observations are
+  generated afresh each time a release's data is imported
+- the items of any other list are compared regardless of their order
+
+so that only real differences in each block's response are reported. Both runs may have been written either as files
+or with --output jsonl, and the blocks are compared in parallel across processes.
+
+Example usage of script:
+python compare_runs.py results_dev_table_20240101_090000 results_prod_table_20240101_090000 [--json differences.json]
+"""
+
+VOLATILE_FIELDS = frozenset({"traceId"})
+
+# the fields of a row of table results which identify it, rather than being values of it
+RESULT_IDENTITY_FIELDS = ["filters", "geographicLevel", "locationId", "location", "timePeriod"]
+
+# the fields of a row of table results which differ between imports of the same data
+RESULT_VOLATILE_FIELDS = frozenset({"id"})
+
+
+def _block_keys(results_dir: str) -> list[str]:
+    """
+    The keys of the blocks in a run, i.e. the block Id, or the block Id and stage of a run of several stages.
+    """
+    if os.path.exists(os.path.join(results_dir, STORE_FILENAME)):
+        return list(_jsonl_reader(results_dir).index())
+
+    responses_dir = os.path.join(results_dir, "responses")
+    keys = []
+
+    for dirpath, _, filenames in os.walk(responses_dir):
+        stage = os.path.relpath(dirpath, responses_dir)
+        for filename in filenames:
+            block_id = filename.removeprefix("block_").removesuffix("_response")
+            keys.append(block_id if stage == "." else f"{block_id}:{stage}")
+
+    return keys
+
+
+@functools.lru_cache(maxsize=None)
+def _jsonl_reader(results_dir: str) -> JsonlResultReader:
+    return JsonlResultReader(results_dir)
+
+
+def _read_response(results_dir: str, key: str) -> tuple[int, dict | str | None]:
+    if os.path.exists(os.path.join(results_dir, STORE_FILENAME)):
+        reader = _jsonl_reader(results_dir)
+        record = reader.get(key)
+        return record["status_code"], reader.body(record)
+
+    block_id, _, stage = key.partition(":")
+    stage_dir = os.path.join("responses", stage) if stage else "responses"
+
+    response_path = os.path.join(results_dir, stage_dir, f"block_{block_id}_response")
+    with open(response_path, "r", encoding="utf-8", errors="replace") as response_file:
+        header, _, response = response_file.read().partition("response:\n")
+
+    status_code = next(
+        int(line.removeprefix("response status: "))
+        for line in header.splitlines()
+        if line.startswith("response status")
+    )
+
+    try:
+        return status_code, json.loads(response)
+    except ValueError:
+        # a streamed response is written as it was received, so may not be JSON, e.g. an html error page
+        return status_code, response
+
+
+def _strip_volatile_fields(value, volatile_fields: frozenset[str]):
+    if isinstance(value, dict):
+        return {
+            key: _strip_volatile_fields(item, volatile_fields)
+            for key, item in value.items()
+            if key not in volatile_fields
+        }
+
+    if isinstance(value, list):
+        return [_strip_volatile_fields(item, volatile_fields) for item in value]
+
+    return value
+
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True)
+
+
+def _result_identity(result: dict) -> str:
+    identity = {field: result.get(field) for field in RESULT_IDENTITY_FIELDS if field in result}
+    if isinstance(identity.get("filters"), list):
+        identity["filters"] = sorted(identity["filters"])
+
+    return _canonical(identity)
+
+
+def _result_values(result: dict) -> dict:
+    return {
+        key: value
+        for key, value in result.items()
+        if key not in RESULT_IDENTITY_FIELDS and key not in RESULT_VOLATILE_FIELDS
+    }
+
+
+def _diff_results(path: str, results_a: list, results_b: list, differences: list[str]) -> None:
+    # results are a multiset of rows, so group the rows with the same identity together
+    rows_a = defaultdict(list)
+    rows_b = defaultdict(list)
+    for result in results_a:
+        rows_a[_result_identity(result)].append(result)
+    for result in results_b:
+        rows_b[_result_identity(result)].append(result)
+
+    for identity in sorted(rows_a.keys() | rows_b.keys()):
+        matched_a = sorted(map(_result_values, rows_a.get(identity, [])), key=_canonical)
+        matched_b = sorted(map(_result_values, rows_b.get(identity, [])), key=_canonical)
+
+        if len(matched_a) > len(matched_b):
+            differences.append(f"{path}: {len(matched_a) - len(matched_b)} row(s) removed with {identity}")
+        elif len(matched_b) > len(matched_a):
+            differences.append(f"{path}: {len(matched_b) - len(matched_a)} row(s) added with {identity}")
+
+        for values_a, values_b in zip(matched_a, matched_b):
+            _diff(f"{path}[{identity}]", values_a, values_b, differences)
+
+
+def _diff(path: str, value_a, value_b, differences: list[str]) -> None:
+    if isinstance(value_a, dict) and isinstance(value_b, dict):
+        for key in sorted(value_a.keys() | value_b.keys()):
+            key_path = f"{path}.{key}" if path else key
+            if key not in value_b:
+                differences.append(f"{key_path}: removed")
+            elif key not in value_a:
+                differences.append(f"{key_path}: added")
+            else:
+                _diff(key_path, value_a[key], value_b[key], differences)
+
+    elif isinstance(value_a, list) and isinstance(value_b, list) and path.endswith("results"):
+        _diff_results(path, value_a, value_b, differences)
+
+    elif isinstance(value_a, list) and isinstance(value_b, list):
+        # the order of other lists isn't significant, so only report items which are in one list but not the other
+        items_a = Counter(_canonical(item) for item in value_a)
+        items_b = Counter(_canonical(item) for item in value_b)
+        if items_a != items_b:
+            removed = (items_a - items_b).total()
+            added = (items_b - items_a).total()
+            differences.append(f"{path}: {removed} item(s) removed, {added} item(s) added")
+
+    elif value_a != value_b:
+        differences.append(f"{path}: {json.dumps(value_a)} -> {json.dumps(value_b)}")
+
+
+def compare_block(
+    results_dir_a: str, results_dir_b: str, volatile_fields: frozenset[str], key: str
+) -> tuple[str, list[str]]:
+    status_code_a, response_a = _read_response(results_dir_a, key)
+    status_code_b, response_b = _read_response(results_dir_b, key)
+
+    differences = []
+    if status_code_a != status_code_b:
+        differences.append(f"response status: {status_code_a} -> {status_code_b}")
+
+    _diff(
+        "",
+        _strip_volatile_fields(response_a, volatile_fields),
+        _strip_volatile_fields(response_b, volatile_fields),
+        differences,
+    )
+
+    return key, differences
+
+
+def compare_runs(
+    results_dir_a: str, results_dir_b: str, processes: int | None = None, ignore_fields: list[str] | None = None
+) -> dict:
+    keys_a = set(_block_keys(results_dir_a))
+    keys_b = set(_block_keys(results_dir_b))
+    keys = sorted(keys_a & keys_b)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        block_differences = executor.map(
+            functools.partial(compare_block, results_dir_a, results_dir_b, VOLATILE_FIELDS | set(ignore_fields or [])),
+            keys,
+            chunksize=max(len(keys) // ((processes or os.cpu_count() or 1) * 4), 1),
+        )
+        changed = {key: differences for key, differences in block_differences if differences}
+
+    return {
+        "compared": len(keys),
+        "only_in_a": sorted(keys_a - keys_b),
+        "only_in_b": sorted(keys_b - keys_a),
+        "changed": changed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python compare_runs.py",
+        description="Compare the responses of two runs of get_data_block_responses.py, ignoring insignificant "
+        "differences",
+    )
+    parser.add_argument("results_dir_a", help="the results directory of the first run", type=str)
+    parser.add_argument("results_dir_b", help="the results directory of the second run", type=str)
+    parser.add_argument(
+        "--processes",
+        dest="processes",
+        default=None,
+        help="number of processes to compare blocks with, defaults to the number of CPUs",
+        type=int,
+    )
+    parser.add_argument(
+        "--ignore",
+        dest="ignore",
+        default=[],
+        action="append",
+        help="another volatile field to ignore, may be given more than once",
+    )
+    parser.add_argument(
+        "--json", dest="json_file", default=None, help="also write the differences to this JSON file", type=str
+    )
+    args = parser.parse_args()
+
+    comparison = compare_runs(args.results_dir_a, args.results_dir_b, args.processes, args.ignore)
+
+    for block_key, block_differences in comparison["changed"].items():
+        print(f"block {block_key}:")
+        for difference in block_differences:
+            print(f"  {difference}")
+
+    print(f"{comparison['compared']} blocks compared, {len(comparison['changed'])} with differences")
+    print(f"{len(comparison['only_in_a'])} blocks only in {args.results_dir_a}")
+    print(f"{len(comparison['only_in_b'])} blocks only in {args.results_dir_b}")
+
+    if args.json_file:
+        with open(args.json_file, "w") as json_file:
+            json.dump(comparison, json_file, indent=2)
@@ -1,12 +1,30 @@
 import argparse
+import asyncio
 import csv
 import datetime
+import hashlib
+import itertools
 import json
 import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
 import requests
 
+# allow the timing utilities shared with the other useful scripts to be imported when running this script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.columnar_results import ColumnarResultWriter  # noqa: E402
+from timing_utils.jsonl_results import JsonlResultWriter  # noqa: E402
+from timing_utils.latency_report import LatencyHistogram, LatencyReport, content_length_bucket  # noqa: E402
+from timing_utils.repeat_timing import RepeatTimings  # noqa: E402
+
 """
 To generate datablocks.csv, use this SQL query against the Content DB:
 
@@ -47,198 +65,1008 @@ Place it in the same directory as this script.
 Example usage of script:
 python get_data_block_responses.py --env dev --stage filters --file dev-datablocks.csv --sleep 1
 
+Requests are made over a pool of keep-alive connections, so only the first request on each connection pays for the
+TCP and TLS handshake. Use --concurrency to time several data blocks at once, e.g. --concurrency 8 --sleep 0.
+Each worker sleeps after each of its requests.
+
+The benchmark can also be driven from other scripts:
+
+    from get_data_block_responses import DataBlockBenchmark
+
+    DataBlockBenchmark(env="dev", stages=["table"], datablocks_csv="dev-datablocks.csv", sleep=0, concurrency=8).main()
+
 Find blocks that took over 10 seconds to respond:
 grep -r "time for response: [0-9][0-9][0-9]*" * | awk '{split($0,a,":"); print a[1];}' | zip -@ test.zip
 
+Use --output jsonl to append the request and response of every block to one results.jsonl file in the results
+directory, indexed by block Id, instead of writing two files for each block. Add --compress to gzip it, and
+--separate-bodies to keep the response bodies in their own compressed file. Query it with ../timing_utils/jsonl_results.py
+rather than grep, e.g. to find blocks that took over 10 seconds to respond or didn't respond with a 200:
+python ../timing_utils/jsonl_results.py slower-than results_dev_table_20240101_090000 10
+python ../timing_utils/jsonl_results.py non-200 results_dev_table_20240101_090000
+
+A summary of the response time percentiles is output at the end of the run, and a fuller report broken down by
+HTTP status and response size is written to latency_report.json in the results directory.
+
+Use --columnar to also write each block's status, response time and response size as typed columns in the columns
+directory of the results directory, for analysis with ../timing_utils/analyse_runs.py, e.g. response times by release:
+python ../timing_utils/analyse_runs.py by results_dev_table_20240101_090000 release_id
+
+To find the blocks that are slow for the size of their query, and to predict how slow new blocks will be, fit the table
+response times of a run with query_complexity.py:
+python query_complexity.py fit dev-datablocks.csv results_dev_table_20240101_090000
+
+To profile all the stages of the table tool in one run, use --stages instead of --stage, e.g.
+python get_data_block_responses.py --env dev --stages table,filters,time_periods --file dev-datablocks.csv --sleep 0 -c 8
+
+Each query is parsed once and the request for each stage is derived from it. All the requests go through the same
+pool, and the requests and responses of each stage are written to a subdirectory of the requests and responses
+directories named after the stage. The response times of each stage are written side by side for each block to
+stage_timings.csv in the results directory, along with the slowest stage of each block.
+
+Many data blocks share the same query, e.g. a block reused as a key statistic and a featured table. Only one request is
+sent for each distinct url and query, with the keys of the query and its filter and location lists in a canonical
+order, and its response is written for every block sharing it. The response time percentiles only count the requests
+that were sent. Use --no-dedupe to send a request for every block.
+
+To measure how the Data API copes with concurrent load, use --load-rps to replay the queries at a series of increasing
+request rates, e.g. 2, 5, 10 and 20 requests per second for a minute each:
+python get_data_block_responses.py --env local --stage table --file datablocks.csv -c 64 --load-rps 2,5,10,20 --step-duration 60
+
+Requests arrive at random (Poisson) intervals averaging the target rate, whether or not earlier requests have been
+responded to, and --concurrency sets how many may be in flight at once. The response time of each request is measured
+from when it was due to be sent rather than when a worker was free to send it, so that an overloaded API can't hide
+its queueing delay by slowing down the requests. For the same reason, a request which times out or fails is counted in
+its step's percentiles at the time it took to fail, rather than being left out, which would leave out the slowest
+requests of an overloaded step. The response time percentiles and achieved rate of each step are written to
+load_steps.csv in a load_ results directory. The knee of the run is the first step whose p99 response
+time is more than --knee-ratio times that of the first step, and the step before it is the highest rate the API
+sustained. Use --seed to replay the same arrivals in another run.
+
+For the largest blocks, use --stream to keep memory use bounded. Each response body is streamed to disk in chunks as it
+arrives and hashed on the way, rather than being parsed and pretty-printed in memory, so the response files hold the
+body exactly as it was sent along with its size and SHA-256. The body is only parsed when it's needed, e.g. by
+compare_runs.py or `jsonl_results.py show`. With --output jsonl, streamed bodies are always kept in the separate bodies
+file, so that a body which isn't JSON, e.g. the html error page of a load balancer, is kept out of results.jsonl.
+
+To see how much of a block's response time the caches in front of the Data API absorb, use --repeat to send each
+request several times, e.g. --repeat 5 --repeat-gap 2 sends each request 5 times, 2 seconds apart. Only the first
+response is written. The response time of every attempt is written to repeat_attempts.csv, and the cold (first), warm
+(second) and steady state (median of the rest) response times of each block to repeat_summary.csv, along with how many
+times faster the cache makes it. See ../timing_utils/repeat_timing.py.
+
 Compare two result directories for differences, but ignoring response time (and any responses that are both Not Found
 responses, as they contain unique traceIds):
 diff -I"Run info - .*" -I "Not Found" -r results_dev1/responses results_dev2/responses
+
+Or compare the responses as JSON, ignoring traceIds and the order of results, with compare_runs.py, which works with
+either kind of --output:
+python compare_runs.py results_dev1 results_dev2
 """
 
-parser = argparse.ArgumentParser(
-    prog="python get_data_block_responses.py",
-    description="Used to get and time data block responses from " "an environment",
-)
-parser.add_argument(
-    "-e",
-    "--env",
-    dest="env",
-    default="dev",
-    choices=["local", "dev", "test", "preprod", "prod"],
-    help="the environment to run again",
-)
-parser.add_argument(
-    "--stage",
-    dest="stage",
-    default="table",
-    choices=["table", "filters", "time_periods"],
-    help="the stage of the table tool to wish to get the response for",
-)
-parser.add_argument(
-    "-f",
-    "--file",
-    dest="datablocks_csv",
-    default="datablocks.csv",
-    help="CSV of data blocks (see comment in this script)",
-)
-parser.add_argument(
-    "-s", "--sleep", dest="sleep_duration", default=1, help="duration to sleep between requests", type=int
-)
-args = parser.parse_args()
-
-data_api_urls = {
-    "local": "http://localhost:5000/api",
-    "dev": "https://data.dev.explore-education-statistics.service.gov.uk/api",
-    "test": "https://data.test.explore-education-statistics.service.gov.uk/api",
-    "preprod": "https://data.pre-production.explore-education-statistics.service.gov.uk/api",
-    "prod": "https://data.explore-education-statistics.service.gov.uk/api",
-}
-
-data_api_url = data_api_urls[args.env]
-
-date = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-results_dir = f"results_{args.env}_{args.stage}_{date}"
-requests_dir = f"{results_dir}/requests"
-responses_dir = f"{results_dir}/responses"
-
-if not os.path.exists(requests_dir):
-    os.makedirs(requests_dir)
-
-if not os.path.exists(responses_dir):
-    os.makedirs(responses_dir)
-
-with open(f"{results_dir}/console_output", "w") as output_file:
-    output_file.write("Console output:\n\n")
-
-output_file = open(f"{results_dir}/console_output", "a")
-
-
-def print_to_console(text):
-    output_file.write(text + "\n")
-    print(text)
-
-
-def write_block_to_file(
-    url, block_guid, release_guid, subject_guid, request_dict, status_code, response_time, response_dict
-):
-    try:
-        with open(f"{requests_dir}/block_{block_guid}_request", "w") as block_request_file:
-            block_request_file.write(
-                f"block: {block_guid}\n"
-                f"release: {release_guid}\n"
-                f"subject: {subject_guid}\n"
-                f"url: {url}\n"
-                f"request:\n{json.dumps(request_dict, sort_keys=True, indent=2)}"
+
+STAGES = ["table", "filters", "time_periods"]
+
+# the order of the Ids in these lists of a query doesn't change its response
+UNORDERED_QUERY_LISTS = ["Filters", "LocationIds"]
+
+
+@dataclass
+class DataBlock:
+    block_id: str
+    release_id: str
+    subject_id: str
+    query: dict
+
+
+@dataclass
+class DataBlockResult:
+    block_id: str
+    release_id: str
+    subject_id: str
+    stage: str
+    url: str
+    request_dict: dict
+    status_code: int = -1
+    response_time: float = -1
+    response_dict: dict | str | None = None
+    content_length: int | None = None
+    failure: str | None = None
+    # with --stream, the file the response body was streamed to, and the SHA-256 of the body
+    body_path: str | None = None
+    content_hash: str | None = None
+    # with --repeat, the response time of each attempt at the request
+    repeat_times: list[float | None] | None = None
+    # the block whose request was sent, when the block shares its query with other blocks
+    request_block_id: str | None = None
+
+
+# the fields of a result that come from its response, and so are shared by blocks with the same query
+RESPONSE_FIELDS = [
+    "status_code",
+    "response_time",
+    "response_dict",
+    "content_length",
+    "failure",
+    "body_path",
+    "content_hash",
+    "repeat_times",
+]
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def canonical_query_hash(query_dict: dict) -> str:
+    canonical_query = dict(query_dict)
+
+    for key in UNORDERED_QUERY_LISTS:
+        if isinstance(canonical_query.get(key), list):
+            canonical_query[key] = sorted(canonical_query[key])
+
+    # older queries have a list of location codes for each geographic level
+    if isinstance(canonical_query.get("Locations"), dict):
+        canonical_query["Locations"] = {
+            level: sorted(codes) if isinstance(codes, list) else codes
+            for level, codes in canonical_query["Locations"].items()
+        }
+
+    return hashlib.sha256(json.dumps(canonical_query, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+@dataclass
+class LoadStep:
+    rps: float
+    sent: int = 0
+    non_200: int = 0
+    failures: int = 0
+    duration: float = 0.0
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+    CSV_HEADERS = ["rps", "sent", "completed", "non_200", "failures", "achieved_rps", "p50", "p90", "p95", "p99", "max"]
+
+    def completed(self) -> int:
+        # failed requests are in the histogram too, at the time they took to fail
+        return self.histogram.count - self.failures
+
+    def achieved_rps(self) -> float:
+        return self.completed() / self.duration if self.duration else 0.0
+
+    def to_row(self) -> list:
+        summary = self.histogram.to_dict()
+        return [
+            f"{self.rps:g}",
+            self.sent,
+            self.completed(),
+            self.non_200,
+            self.failures,
+            round(self.achieved_rps(), 2),
+        ] + [round(summary[name], 3) if summary[name] is not None else "" for name in self.CSV_HEADERS[6:]]
+
+
+def find_knee(steps: list[LoadStep], knee_ratio: float) -> LoadStep | None:
+    """
+    Return the first step whose p99 response time is more than knee_ratio times the p99 of the first step.
+    """
+    measured_steps = [step for step in steps if step.histogram.count]
+    if not measured_steps:
+        return None
+
+    baseline_p99 = measured_steps[0].histogram.percentile(99)
+    return next(
+        (step for step in measured_steps[1:] if step.histogram.percentile(99) > knee_ratio * baseline_p99), None
+    )
+
+
+class DataBlockBenchmark:
+    DATA_API_URLS = {
+        "local": "http://localhost:5000/api",
+        "dev": "https://data.dev.explore-education-statistics.service.gov.uk/api",
+        "test": "https://data.test.explore-education-statistics.service.gov.uk/api",
+        "preprod": "https://data.pre-production.explore-education-statistics.service.gov.uk/api",
+        "prod": "https://data.explore-education-statistics.service.gov.uk/api",
+    }
+
+    def __init__(
+        self,
+        env: str,
+        stages: list[str],
+        datablocks_csv: str,
+        sleep: float,
+        concurrency: int = 1,
+        columnar: bool = False,
+        timeout: float = 60,
+        dedupe: bool = True,
+        output: str = "files",
+        compress: bool = False,
+        separate_bodies: bool = False,
+        stream: bool = False,
+        repeat: int = 1,
+        repeat_gap: float = 0,
+    ):
+        self.env = env
+        self.stages = stages
+        self.datablocks_csv = datablocks_csv
+        self.sleep = sleep
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.dedupe = dedupe
+        self.data_api_url = DataBlockBenchmark.DATA_API_URLS[env]
+
+        # share one pool of keep-alive connections between all workers, sized so that no worker waits for a connection
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        date = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.results_dir = f"results_{env}_{'-'.join(stages)}_{date}"
+        self.load_results_dir = f"load_{env}_{'-'.join(stages)}_{date}"
+        self.requests_dir = f"{self.results_dir}/requests"
+        self.responses_dir = f"{self.results_dir}/responses"
+
+        self.columnar = columnar
+        self.columnar_writer: ColumnarResultWriter | None = None
+        self.output = output
+        self.compress = compress
+        self.separate_bodies = separate_bodies
+        self.jsonl_writer: JsonlResultWriter | None = None
+        self.stream = stream
+        self.repeat = repeat
+        self.repeat_gap = repeat_gap
+        self.repeat_timings = RepeatTimings()
+        self.latency_report = LatencyReport()
+        # the result of each stage of each block, for comparing the stages side by side
+        self.stage_results: dict[str, dict[str, DataBlockResult]] = {}
+        self.processed = 0
+        self.processed_successfully = 0
+        self._output_file = None
+        self._output_lock = threading.Lock()
+
+    def _open_console_output(self, results_dir: str) -> None:
+        with open(f"{results_dir}/console_output", "w") as output_file:
+            output_file.write("Console output:\n\n")
+
+        self._output_file = open(f"{results_dir}/console_output", "a")
+
+    def print_to_console(self, text: str) -> None:
+        # blocks are timed on several threads at once, so keep each message on its own line of the console output
+        with self._output_lock:
+            self._output_file.write(text + "\n")
+            print(text)
+
+    def _read_datablocks(self) -> list[DataBlock]:
+        datablocks = []
+        with open(self.datablocks_csv, "r") as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter=",")
+            for row in csv_reader:
+                if row[0] == "ContentBlockId":
+                    continue
+
+                block_id = row[0]
+                release_id = row[1]
+                subject_id = row[2]
+                try:
+                    query_dict = json.loads(row[3])
+                except Exception as e:
+                    self.processed += 1
+                    self.print_to_console(f"Invalid JSON with block {block_id} subject {subject_id}, {e}")
+                    continue
+
+                datablocks.append(DataBlock(block_id, release_id, subject_id, query_dict))
+
+        return datablocks
+
+    def _build_request(self, stage: str, release_id: str, query_dict: dict) -> str:
+        if stage == "table":
+            return f"{self.data_api_url}/tablebuilder/release/{release_id}"
+
+        if stage == "filters":
+            query_dict.pop("Filters")
+            query_dict.pop("Indicators")
+            return f"{self.data_api_url}/meta/subject"
+
+        if stage == "time_periods":
+            query_dict.pop("Filters")
+            query_dict.pop("Indicators")
+            query_dict.pop("TimePeriod")
+            return f"{self.data_api_url}/meta/subject"
+
+    def _stage_dir(self, directory: str, stage: str) -> str:
+        # only separate the files of each stage when there is more than one
+        return directory if len(self.stages) == 1 else f"{directory}/{stage}"
+
+    def _write_block_to_file(self, result: DataBlockResult) -> None:
+        if self.jsonl_writer:
+            self.jsonl_writer.append(
+                {
+                    "block_id": result.block_id,
+                    "release_id": result.release_id,
+                    "subject_id": result.subject_id,
+                    "stage": result.stage,
+                    "block_stage": f"{result.block_id}:{result.stage}",
+                    "request_block_id": result.request_block_id,
+                    "url": result.url,
+                    "request": result.request_dict,
+                    "status_code": result.status_code,
+                    "response_time": result.response_time,
+                    "content_length": result.content_length,
+                    "failure": result.failure,
+                    "content_hash": result.content_hash,
+                    "response": result.response_dict,
+                },
+                body_path=result.body_path,
+            )
+            return
+
+        requests_dir = self._stage_dir(self.requests_dir, result.stage)
+        responses_dir = self._stage_dir(self.responses_dir, result.stage)
+
+        try:
+            with open(f"{requests_dir}/block_{result.block_id}_request", "w") as block_request_file:
+                block_request_file.write(
+                    f"block: {result.block_id}\n"
+                    f"release: {result.release_id}\n"
+                    f"subject: {result.subject_id}\n"
+                    f"url: {result.url}\n"
+                    f"request:\n{json.dumps(result.request_dict, sort_keys=True, indent=2)}"
+                )
+
+            if result.body_path:
+                self._write_streamed_response(result, f"{responses_dir}/block_{result.block_id}_response")
+            else:
+                with open(f"{responses_dir}/block_{result.block_id}_response", "w") as block_response_file:
+                    block_response_file.write(
+                        f"block: {result.block_id}\n"
+                        f"release: {result.release_id}\n"
+                        f"subject: {result.subject_id}\n"
+                        f"stage: {result.stage}\n"
+                        f"response status: {result.status_code}\n"
+                        f"time for response: {result.response_time}\n"
+                        f"response:\n{json.dumps(result.response_dict, sort_keys=True, indent=2)}"
+                    )
+        except Exception as exception:
+            self.print_to_console(
+                f"block_file.write failed with block {result.block_id} subject {result.subject_id}\n"
+                f"Response: {json.dumps(result.response_dict)}\n Exception: {exception}"
             )
 
-        with open(f"{responses_dir}/block_{block_guid}_response", "w") as block_response_file:
+    def _write_streamed_response(self, result: DataBlockResult, response_path: str) -> None:
+        with open(response_path, "wb") as block_response_file:
             block_response_file.write(
-                f"block: {block_guid}\n"
-                f"release: {release_guid}\n"
-                f"subject: {subject_guid}\n"
-                f"response status: {status_code}\n"
-                f"time for response: {response_time}\n"
-                f"response:\n{json.dumps(response_dict, sort_keys=True, indent=2)}"
-            )
-    except Exception as exception:
-        print_to_console(
-            f"block_file.write failed with block {block_guid} subject {subject_guid}\n"
-            f"Response: {json.dumps(response_dict)}\n Exception: {exception}"
-        )
+                (
+                    f"block: {result.block_id}\n"
+                    f"release: {result.release_id}\n"
+                    f"subject: {result.subject_id}\n"
+                    f"stage: {result.stage}\n"
+                    f"response status: {result.status_code}\n"
+                    f"time for response: {result.response_time}\n"
+                    f"response size: {result.content_length}\n"
+                    f"response sha256: {result.content_hash}\n"
+                    f"response:\n"
+                ).encode("utf-8")
+            )
 
+            # copied a chunk at a time, as the body is written exactly as it was received rather than pretty-printed
+            with open(result.body_path, "rb") as body_file:
+                shutil.copyfileobj(body_file, block_response_file, STREAM_CHUNK_SIZE)
 
-processed = 0
-processed_successfully = 0
-datablocks = []
-with open(args.datablocks_csv, "r") as csv_file:
-    csv_reader = csv.reader(csv_file, delimiter=",")
-    for row in csv_reader:
-        if row[0] == "ContentBlockId":
-            continue
-        datablocks.append(row)
-
-start_time = time.perf_counter()
-for datablock in datablocks:
-    processed += 1
-    time.sleep(args.sleep_duration)
-
-    block_id = datablock[0]
-    release_id = datablock[1]
-    subject_id = datablock[2]
-    try:
-        query_dict = json.loads(datablock[3])
-    except Exception as e:
-        print_to_console(f"Invalid JSON with block {block_id} subject {subject_id}, {e}")
-        continue
-
-    if args.stage == "table":
-        url = f"{data_api_url}/tablebuilder/release/{release_id}"
-
-    if args.stage == "filters":
-        url = f"{data_api_url}/meta/subject"
-        query_dict.pop("Filters")
-        query_dict.pop("Indicators")
-
-    if args.stage == "time_periods":
-        url = f"{data_api_url}/meta/subject"
-        query_dict.pop("Filters")
-        query_dict.pop("Indicators")
-        query_dict.pop("TimePeriod")
-
-    def write_this_block(status_code, response_time, response_dict):
-        write_block_to_file(
-            url=url,
-            block_guid=block_id,
-            release_guid=release_id,
-            subject_guid=subject_id,
-            request_dict=query_dict,
-            status_code=status_code,
-            response_time=response_time,
-            response_dict=response_dict,
+            if not result.content_length:
+                block_response_file.write(b'""')
+
+    def _build_requests(self, datablocks: list[DataBlock]) -> list[list[DataBlockResult]]:
+        """
+        Build the request of each stage of each block, grouped so that blocks with the same request share one.
+        """
+        requests_by_query: dict[tuple[str, str, str], list[DataBlockResult]] = {}
+
+        # keep the stages of each block together, so that they are timed under similar load
+        for index, datablock in enumerate(datablocks):
+            for stage in self.stages:
+                # each stage removes different parts of the query, so give each its own copy
+                query_dict = dict(datablock.query)
+                url = self._build_request(stage, datablock.release_id, query_dict)
+                result = DataBlockResult(
+                    datablock.block_id, datablock.release_id, datablock.subject_id, stage, url, query_dict
+                )
+
+                if self.dedupe:
+                    key = (stage, url, canonical_query_hash(query_dict))
+                else:
+                    key = (stage, url, str(index))
+
+                shared_request = requests_by_query.setdefault(key, [])
+                result.request_block_id = shared_request[0].block_id if shared_request else datablock.block_id
+                shared_request.append(result)
+
+        return list(requests_by_query.values())
+
+    def _time_request(self, results: list[DataBlockResult]) -> list[DataBlockResult]:
+        """
+        Send the request shared by the results' blocks once, and record its response in each result.
+        """
+        self._send_request(results[0])
+
+        if self.repeat > 1 and not results[0].failure:
+            results[0].repeat_times = [results[0].response_time] + [
+                self._time_repeat(results[0]) for _ in range(self.repeat - 1)
+            ]
+
+        for shared_result in results[1:]:
+            for response_field in RESPONSE_FIELDS:
+                setattr(shared_result, response_field, getattr(results[0], response_field))
+
+            self.print_to_console(
+                f"Reused the response to block {results[0].block_id} for block {shared_result.block_id}"
+                f"{self._stage_description(shared_result.stage)} subject {shared_result.subject_id}"
+            )
+
+        try:
+            for result in results:
+                self._write_block_to_file(result)
+        finally:
+            if results[0].body_path:
+                os.remove(results[0].body_path)
+
+        return results
+
+    def _stage_description(self, stage: str) -> str:
+        # only mention the stage when there is more than one
+        return f" {stage} stage" if len(self.stages) > 1 else ""
+
+    def _send_request(self, result: DataBlockResult) -> None:
+        block_id = result.block_id
+        subject_id = result.subject_id
+        url = result.url
+        query_dict = result.request_dict
+
+        block_time_start = time.perf_counter()
+        try:
+            resp = self.session.post(
+                url=url,
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(query_dict),
+                timeout=self.timeout,
+                stream=self.stream,
+            )
+
+            if self.stream:
+                self._stream_body(resp, result)
+        except requests.Timeout as e:
+            self.print_to_console(f"request timeout with block {block_id} subject {subject_id}, {e}")
+            result.failure = "timeout"
+            result.response_dict = {"error": f"request timeout, {e}"}
+            return
+        except Exception as e:
+            self.print_to_console(f"request exception with block {block_id} subject {subject_id}, {e}")
+            result.failure = "exception"
+            result.response_dict = {"error": f"request exception thrown, {e}"}
+            return
+
+        block_time_end = time.perf_counter()
+
+        result.status_code = resp.status_code
+        result.response_time = block_time_end - block_time_start
+
+        # a streamed body has already been written to disk, and is only parsed when it's needed
+        if not self.stream:
+            result.content_length = len(resp.content)
+
+            if resp.text is None or resp.text == "":
+                result.response_dict = ""
+            else:
+                result.response_dict = json.loads(resp.text)
+
+        stage_description = self._stage_description(result.stage)
+
+        if resp.status_code == 200:
+            self.print_to_console(
+                f"Successfully processed block {block_id}{stage_description} for subject {subject_id}!"
+            )
+        else:
+            self.print_to_console(
+                f"{resp.status_code} response received for block {block_id}{stage_description} subject {subject_id}"
+            )
+
+    def _time_repeat(self, result: DataBlockResult) -> float | None:
+        time.sleep(self.repeat_gap)
+
+        block_time_start = time.perf_counter()
+        try:
+            # only the time is needed, so the body is read and discarded a chunk at a time
+            with self.session.post(
+                url=result.url,
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(result.request_dict),
+                timeout=self.timeout,
+                stream=True,
+            ) as resp:
+                for _ in resp.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    pass
+        except Exception as e:
+            self.print_to_console(f"repeat request exception with block {result.block_id}, {e}")
+            return None
+
+        return time.perf_counter() - block_time_start
+
+    def _stream_body(self, resp: requests.Response, result: DataBlockResult) -> None:
+        content_hash = hashlib.sha256()
+        content_length = 0
+
+        with tempfile.NamedTemporaryFile("wb", dir=self.results_dir, suffix=".part", delete=False) as body_file:
+            try:
+                for chunk in resp.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    body_file.write(chunk)
+                    content_hash.update(chunk)
+                    content_length += len(chunk)
+            except Exception:
+                # don't leave a partial body behind if the connection fails part way through the response
+                body_file.close()
+                os.remove(body_file.name)
+                raise
+
+        result.body_path = body_file.name
+        result.content_length = content_length
+        result.content_hash = content_hash.hexdigest()
+
+    def _record_result(self, result: DataBlockResult) -> None:
+        self.processed += 1
+        self.stage_results.setdefault(result.block_id, {})[result.stage] = result
+
+        # a shared response is only counted once in the response times, as only one request was sent for it
+        sent_request = result.request_block_id == result.block_id
+
+        if sent_request and result.failure:
+            self.latency_report.record_failure(result.failure)
+        elif sent_request:
+            self.latency_report.record(
+                result.response_time,
+                by_stage=result.stage,
+                by_status=result.status_code,
+                by_content_length=content_length_bucket(result.content_length),
+            )
+
+        if result.status_code == 200:
+            self.processed_successfully += 1
+
+        if sent_request and result.repeat_times:
+            key = result.block_id if len(self.stages) == 1 else f"{result.block_id}:{result.stage}"
+            self.repeat_timings.record(key, result.repeat_times)
+
+        if self.columnar_writer:
+            self.columnar_writer.append(
+                {
+                    "block_id": result.block_id,
+                    "release_id": result.release_id,
+                    "subject_id": result.subject_id,
+                    "stage": result.stage,
+                    "block_stage": f"{result.block_id}:{result.stage}",
+                    "request_block_id": result.request_block_id,
+                    "status_code": result.status_code if result.status_code != -1 else None,
+                    "response_time": result.response_time if result.response_time != -1 else None,
+                    "content_length": result.content_length,
+                }
+            )
+
+    def _write_stage_timings(self) -> None:
+        with open(f"{self.results_dir}/stage_timings.csv", "w", newline="") as stage_timings_file:
+            writer = csv.writer(stage_timings_file)
+            writer.writerow(
+                ["block_id", "release_id", "subject_id"]
+                + [f"{stage}_{column}" for stage in self.stages for column in ["status_code", "response_time"]]
+                + ["slowest_stage"]
+            )
+
+            slowest_stage_counts = {stage: 0 for stage in self.stages}
+
+            for results in self.stage_results.values():
+                result = next(iter(results.values()))
+                row = [result.block_id, result.release_id, result.subject_id]
+
+                for stage in self.stages:
+                    stage_result = results.get(stage)
+                    row += [stage_result.status_code, stage_result.response_time] if stage_result else ["", ""]
+
+                timed_stages = [stage for stage, stage_result in results.items() if not stage_result.failure]
+                slowest_stage = max(timed_stages, key=lambda stage: results[stage].response_time, default="")
+                if slowest_stage:
+                    slowest_stage_counts[slowest_stage] += 1
+
+                writer.writerow(row + [slowest_stage])
+
+        for stage in self.stages:
+            stage_histogram = self.latency_report.groups["by_stage"][stage].to_dict()
+            percentiles = (
+                f"p50: {stage_histogram['p50']:.2f}s, p95: {stage_histogram['p95']:.2f}s"
+                if stage_histogram["count"]
+                else "no response times recorded"
+            )
+            self.print_to_console(
+                f"Run info - {stage} stage - {percentiles}, slowest stage for {slowest_stage_counts[stage]} blocks"
+            )
+
+    async def _time_blocks_concurrently(self, block_requests: list[list[DataBlockResult]]) -> None:
+        queue: asyncio.Queue[list[DataBlockResult]] = asyncio.Queue()
+        for block_request in block_requests:
+            queue.put_nowait(block_request)
+
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            async def worker() -> None:
+                while not queue.empty():
+                    block_request = queue.get_nowait()
+                    results = await loop.run_in_executor(executor, self._time_request, block_request)
+
+                    # results are only ever recorded from the event loop, so no locking is needed
+                    for result in results:
+                        self._record_result(result)
+
+                    await asyncio.sleep(self.sleep)
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def _time_load_request(self, result: DataBlockResult, scheduled_time: float) -> tuple[int, float, str | None]:
+        try:
+            resp = self.session.post(
+                url=result.url,
+                headers={"Content-Type": "application/json"},
+                data=json.dumps(result.request_dict),
+                timeout=self.timeout,
+            )
+        except requests.Timeout:
+            return -1, time.perf_counter() - scheduled_time, "timeout"
+        except Exception:
+            return -1, time.perf_counter() - scheduled_time, "exception"
+
+        # measured from when the request was due, so that time spent waiting for a free worker is included
+        return resp.status_code, time.perf_counter() - scheduled_time, None
+
+    async def _run_load_step(
+        self,
+        step: LoadStep,
+        step_duration: float,
+        load_requests: itertools.cycle,
+        rng: random.Random,
+        executor: ThreadPoolExecutor,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        pending = []
+
+        step_start = time.perf_counter()
+        scheduled_time = step_start
+
+        while True:
+            # Poisson arrivals, i.e. exponentially distributed intervals between requests
+            scheduled_time += rng.expovariate(step.rps)
+            if scheduled_time - step_start >= step_duration:
+                break
+
+            delay = scheduled_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            pending.append(loop.run_in_executor(executor, self._time_load_request, next(load_requests), scheduled_time))
+
+        step.sent = len(pending)
+
+        for status_code, response_time, failure in await asyncio.gather(*pending):
+            # a failed request still counts towards the step's percentiles, or an overloaded step timing out its
+            # slowest requests would look faster than it was
+            step.histogram.record(response_time)
+
+            if failure:
+                step.failures += 1
+                self.latency_report.record_failure(failure)
+                continue
+
+            if status_code != 200:
+                step.non_200 += 1
+
+            self.latency_report.record(response_time, by_step=f"{step.rps:g} rps", by_status=status_code)
+
+        step.duration = time.perf_counter() - step_start
+
+    async def _run_load_steps(
+        self, steps: list[LoadStep], step_duration: float, load_requests: itertools.cycle, rng: random.Random
+    ) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for step in steps:
+                await self._run_load_step(step, step_duration, load_requests, rng, executor)
+
+                summary = step.histogram.to_dict()
+                percentiles = (
+                    f"p50: {summary['p50']:.2f}s, p99: {summary['p99']:.2f}s"
+                    if step.histogram.count
+                    else "no response times recorded"
+                )
+                self.print_to_console(
+                    f"Run info - Load step {step.rps:g} rps - sent: {step.sent}, "
+                    f"achieved: {step.achieved_rps():.2f} rps, non-200: {step.non_200}, failures: {step.failures}, "
+                    f"{percentiles}"
+                )
+
+    def load(self, rps_steps: list[float], step_duration: float, knee_ratio: float = 2.0, seed: int | None = None):
+        """
+        Replay the data block queries at each of the request rates in turn, open loop, and report the knee of the run.
+        """
+        os.makedirs(self.load_results_dir)
+        self._open_console_output(self.load_results_dir)
+
+        # replay each distinct request in a random order, looping round them for as long as the steps need
+        rng = random.Random(seed)
+        load_requests = [block_request[0] for block_request in self._build_requests(self._read_datablocks())]
+        rng.shuffle(load_requests)
+
+        steps = [LoadStep(rps) for rps in rps_steps]
+        asyncio.run(self._run_load_steps(steps, step_duration, itertools.cycle(load_requests), rng))
+
+        with open(f"{self.load_results_dir}/load_steps.csv", "w", newline="") as load_steps_file:
+            writer = csv.writer(load_steps_file)
+            writer.writerow(LoadStep.CSV_HEADERS)
+            writer.writerows(step.to_row() for step in steps)
+
+        knee = find_knee(steps, knee_ratio)
+        if knee:
+            sustained = steps[steps.index(knee) - 1]
+            self.print_to_console(
+                f"Run info - Knee at {knee.rps:g} rps, where p99 rose to {knee.histogram.percentile(99):.2f}s "
+                f"- the highest rate sustained was {sustained.rps:g} rps"
+            )
+        else:
+            self.print_to_console(f"Run info - No knee found up to {steps[-1].rps:g} rps")
+
+        self.print_to_console(f"Run info - Response times: {self.latency_report.summary()}")
+        self.latency_report.write_json(f"{self.load_results_dir}/latency_report.json")
+        self._output_file.close()
+
+    def main(self) -> None:
+        if self.output == "jsonl":
+            self.jsonl_writer = JsonlResultWriter(
+                self.results_dir,
+                key="block_id" if len(self.stages) == 1 else "block_stage",
+                body_field="response",
+                compress=self.compress,
+                separate_bodies=self.separate_bodies,
+            )
+        else:
+            for stage in self.stages:
+                for directory in [self.requests_dir, self.responses_dir]:
+                    if not os.path.exists(self._stage_dir(directory, stage)):
+                        os.makedirs(self._stage_dir(directory, stage))
+
+        self._open_console_output(self.results_dir)
+
+        if self.columnar:
+            self.columnar_writer = ColumnarResultWriter(
+                self.results_dir,
+                # a block has a row for each stage, so with more than one stage identify rows by block and stage
+                key="block_id" if len(self.stages) == 1 else "block_stage",
+                schema={
+                    "block_id": "str",
+                    "release_id": "str",
+                    "subject_id": "str",
+                    "stage": "str",
+                    "block_stage": "str",
+                    "request_block_id": "str",
+                    "status_code": "int",
+                    "response_time": "float",
+                    "content_length": "int",
+                },
+            )
+
+        datablocks = self._read_datablocks()
+        block_requests = self._build_requests(datablocks)
+
+        start_time = time.perf_counter()
+        try:
+            asyncio.run(self._time_blocks_concurrently(block_requests))
+        finally:
+            if self.columnar_writer:
+                self.columnar_writer.close()
+            if self.jsonl_writer:
+                self.jsonl_writer.close()
+        end_time = time.perf_counter()
+
+        processing_time = round(end_time - start_time)
+        # each worker sleeps after each of its requests
+        sleep_time = round(self.sleep * len(block_requests) / self.concurrency)
+        processing_time_minus_sleep_time = round(processing_time - sleep_time)
+
+        self.print_to_console(f"Run info - Total processed: {self.processed}")
+        self.print_to_console(f"Run info - Total successes: {self.processed_successfully}")
+        self.print_to_console(f"Run info - Total failures: {self.processed - self.processed_successfully}")
+        self.print_to_console(
+            f"Run info - Requests sent: {len(block_requests)} "
+            f"(saved {len(datablocks) * len(self.stages) - len(block_requests)} by sharing responses of identical queries)"
         )
+        self.print_to_console(f"Run info - Total time: {processing_time} seconds")
+        self.print_to_console(f"Run info - Sleep time: {sleep_time} seconds")
+        self.print_to_console(f"Run info - Total minus sleep time: {processing_time_minus_sleep_time} seconds")
+        self.print_to_console(
+            f"Run info - Average processing time per block: {round(processing_time_minus_sleep_time / len(datablocks), 2)} seconds"
+        )
+        self.print_to_console(f"Run info - Response times: {self.latency_report.summary()}")
+
+        if len(self.stages) > 1:
+            self._write_stage_timings()
+
+        if self.repeat > 1:
+            self.repeat_timings.write_csvs(self.results_dir)
+            self.print_to_console(f"Run info - Cold versus warm: {self.repeat_timings.summary()}")
+
+        self.latency_report.write_json(f"{self.results_dir}/latency_report.json")
+        self._output_file.close()
+
+
+def parse_stages(value: str) -> list[str]:
+    stages = [stage.strip() for stage in value.split(",") if stage.strip()]
+    unknown_stages = [stage for stage in stages if stage not in STAGES]
 
-    block_time_start = time.perf_counter()
+    if not stages or unknown_stages:
+        raise argparse.ArgumentTypeError(f"stages must be a comma separated list of {', '.join(STAGES)}, got {value}")
+
+    # keep the table tool's order of stages, whatever order they were given in
+    return [stage for stage in STAGES if stage in stages]
+
+
+def parse_rps_steps(value: str) -> list[float]:
     try:
-        resp = requests.post(
-            url=url, headers={"Content-Type": "application/json"}, data=json.dumps(query_dict), timeout=60
-        )
-    except requests.Timeout as e:
-        print_to_console(f"request timeout with block {block_id} subject {subject_id}, {e}")
-        write_this_block(status_code=-1, response_time=-1, response_dict={"error": f"request timeout, {e}"})
-        continue
-    except Exception as e:
-        print_to_console(f"request exception with block {block_id} subject {subject_id}, {e}")
-        write_this_block(status_code=-1, response_time=-1, response_dict={"error": f"request exception thrown, {e}"})
-        continue
-
-    block_time_end = time.perf_counter()
-
-    if resp.text is None or resp.text == "":
-        json_response = ""
-    else:
-        json_response = json.loads(resp.text)
+        rps_steps = [float(rps) for rps in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"request rates must be a comma separated list of numbers, got {value}")
+
+    if any(rps <= 0 for rps in rps_steps):
+        raise argparse.ArgumentTypeError(f"request rates must be greater than 0, got {value}")
+
+    return rps_steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python get_data_block_responses.py",
+        description="Used to get and time data block responses from " "an environment",
+    )
+    parser.add_argument(
+        "-e",
+        "--env",
+        dest="env",
+        default="dev",
+        choices=["local", "dev", "test", "preprod", "prod"],
+        help="the environment to run again",
+    )
+    stage_group = parser.add_mutually_exclusive_group()
+    stage_group.add_argument(
+        "--stage",
+        dest="stage",
+        default="table",
+        choices=STAGES,
+        help="the stage of the table tool to wish to get the response for",
+    )
+    stage_group.add_argument(
+        "--stages",
+        dest="stages",
+        default=None,
+        help="comma separated stages of the table tool to get the responses for in one run, e.g. table,filters,time_periods",
+        type=parse_stages,
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        dest="datablocks_csv",
+        default="datablocks.csv",
+        help="CSV of data blocks (see comment in this script)",
+    )
+    parser.add_argument(
+        "-s", "--sleep", dest="sleep_duration", default=1, help="duration to sleep between requests", type=int
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        dest="concurrency",
+        default=1,
+        help="number of data blocks to time concurrently",
+        type=int,
+    )
+    parser.add_argument(
+        "--columnar",
+        dest="columnar",
+        default=False,
+        help="also write the results as typed columns for analysis with timing_utils/analyse_runs.py",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser.add_argument(
+        "--dedupe",
+        dest="dedupe",
+        default=True,
+        help="send one request for blocks with identical queries and share its response between them",
+        action=argparse.BooleanOptionalAction,
+    )
+    parser.add_argument(
+        "--output",
+        dest="output",
+        default="files",
+        choices=["files", "jsonl"],
+        help="write a request and a response file for each block, or append them all to one JSON lines file",
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compress",
+        default=False,
+        help="gzip the JSON lines results of --output jsonl",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--separate-bodies",
+        dest="separate_bodies",
+        default=False,
+        help="store the response bodies of --output jsonl in a separate compressed file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        default=False,
+        help="stream response bodies to disk as they arrive rather than holding and pretty-printing them in memory",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        default=1,
+        help="number of times to send each request, to compare cold and warm response times",
+        type=int,
+    )
+    parser.add_argument(
+        "--repeat-gap",
+        dest="repeat_gap",
+        default=0,
+        help="number of seconds between the repeats of a request",
+        type=float,
+    )
+    parser.add_argument(
+        "--load-rps",
+        dest="load_rps",
+        default=None,
+        help="replay the queries open loop at each of these comma separated requests per second, e.g. 2,5,10,20",
+        type=parse_rps_steps,
+    )
+    parser.add_argument(
+        "--step-duration",
+        dest="step_duration",
+        default=60,
+        help="number of seconds to hold each request rate for with --load-rps",
+        type=float,
+    )
+    parser.add_argument(
+        "--knee-ratio",
+        dest="knee_ratio",
+        default=2.0,
+        help="how many times the first step's p99 response time a step's p99 must reach to be the knee",
+        type=float,
+    )
+    parser.add_argument(
+        "--seed", dest="seed", default=None, help="seed for the random arrivals of --load-rps", type=int
+    )
+    args = parser.parse_args()
+
+    benchmark = DataBlockBenchmark(
+        env=args.env,
+        stages=args.stages or [args.stage],
+        datablocks_csv=args.datablocks_csv,
+        sleep=args.sleep_duration,
+        concurrency=args.concurrency,
+        columnar=args.columnar,
+        dedupe=args.dedupe,
+        output=args.output,
+        compress=args.compress,
+        separate_bodies=args.separate_bodies,
+        stream=args.stream,
+        repeat=args.repeat,
+        repeat_gap=args.repeat_gap,
+    )
 
-    if resp.status_code == 200:
-        print_to_console(f"Successfully processed block {block_id} for subject {subject_id}!")
-        processed_successfully += 1
+    if args.load_rps:
+        benchmark.load(args.load_rps, args.step_duration, args.knee_ratio, args.seed)
     else:
-        print_to_console(f"{resp.status_code} response received for block {block_id} subject {subject_id}")
-
-    write_this_block(
-        status_code=resp.status_code, response_time=block_time_end - block_time_start, response_dict=json_response
-    )
-
-end_time = time.perf_counter()
-processing_time = round(end_time - start_time)
-sleep_time = args.sleep_duration * len(datablocks)
-processing_time_minus_sleep_time = round(processing_time - sleep_time)
-
-print_to_console(f"Run info - Total processed: {processed}")
-print_to_console(f"Run info - Total successes: {processed_successfully}")
-print_to_console(f"Run info - Total failures: {processed - processed_successfully}")
-print_to_console(f"Run info - Total time: {processing_time} seconds")
-print_to_console(f"Run info - Sleep time: {sleep_time} seconds")
-print_to_console(f"Run info - Total minus sleep time: {processing_time_minus_sleep_time} seconds")
-print_to_console(
-    f"Run info - Average processing time per block: {round(processing_time_minus_sleep_time / len(datablocks), 2)} seconds"
-)
+        benchmark.main()
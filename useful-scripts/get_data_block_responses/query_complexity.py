@@ -0,0 +1,292 @@
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+# allow the timing utilities shared with the other useful scripts to be imported when running this script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.jsonl_results import STORE_FILENAME, JsonlResultReader  # noqa: E402
+
+"""
+Scoring of the complexity of data block queries, to find blocks that are slow for their size and to predict how slow
+new blocks will be.
+
+The work a table query does grows with the number of filter items, indicators, locations and time periods it asks
+for, and the number of cells in the table is their product. `fit` fits the table response times of a run of
+get_data_block_responses.py to the size of each of these dimensions of each block's query, as a power law (a linear
+fit of the logs), and then ranks the blocks by how much slower they were than the fit predicts for their size. Those
+are the blocks whose slowness isn't explained by their size, and so where optimisation is most likely to help.
+
+Fit the response times of a run of the table stage, writing the model and a ranked list of outliers:
+python query_complexity.py fit datablocks.csv results_prod_table_20240101_090000 [--model complexity_model.json]
+
+Predict the response time of the blocks in another datablocks.csv, e.g. of blocks not yet published, slowest first:
+python query_complexity.py predict new-datablocks.csv --model complexity_model.json
+"""
+
+DIMENSIONS = ["filter_items", "indicators", "locations", "time_periods"]
+
+# the number of time periods in a year for codes such as M1 - M12 or Q1 - Q4, anything else is yearly
+PERIODS_PER_YEAR = {"M": 12, "W": 52, "Q": 4, "T": 3}
+
+
+def _time_period_count(time_period: dict | None) -> int:
+    if not time_period:
+        return 1
+
+    def period(code: str) -> tuple[int, int]:
+        match = re.fullmatch(r"([A-Z]*?)(\d*)", code or "")
+        prefix, number = (match.group(1), match.group(2)) if match else ("", "")
+        return PERIODS_PER_YEAR.get(prefix[-1:], 1) if number else 1, int(number or 1)
+
+    per_year, start_number = period(time_period.get("StartCode"))
+    _, end_number = period(time_period.get("EndCode"))
+    years = int(time_period.get("EndYear", 0)) - int(time_period.get("StartYear", 0))
+
+    return max(years * per_year + end_number - start_number + 1, 1)
+
+
+def complexity(query: dict) -> dict[str, int]:
+    """
+    The size of each dimension of a query, e.g. {"filter_items": 4, "indicators": 2, "locations": 10, "time_periods": 5}.
+    """
+    if "LocationIds" in query:
+        locations = len(query["LocationIds"])
+    else:
+        # older queries have a list of location codes for each geographic level
+        locations = sum(len(codes) for codes in (query.get("Locations") or {}).values() if isinstance(codes, list))
+
+    return {
+        "filter_items": len(query.get("Filters") or []),
+        "indicators": len(query.get("Indicators") or []),
+        "locations": locations,
+        "time_periods": _time_period_count(query.get("TimePeriod")),
+    }
+
+
+def cells(query_complexity: dict[str, int]) -> int:
+    return math.prod(max(query_complexity[dimension], 1) for dimension in DIMENSIONS)
+
+
+def _features(complexities: list[dict[str, int]]) -> np.ndarray:
+    sizes = np.array([[query_complexity[dimension] for dimension in DIMENSIONS] for query_complexity in complexities])
+    return np.column_stack([np.ones(len(complexities)), np.log1p(sizes)])
+
+
+def read_queries(datablocks_csv: str) -> dict[str, dict]:
+    queries = {}
+    with open(datablocks_csv, "r") as csv_file:
+        for row in csv.reader(csv_file, delimiter=","):
+            if row[0] == "ContentBlockId":
+                continue
+
+            try:
+                queries[row[0]] = json.loads(row[3])
+            except Exception as e:
+                print(f"Invalid JSON with block {row[0]} subject {row[2]}, {e}")
+
+    return queries
+
+
+def read_table_response_times(results_dir: str) -> dict[str, float]:
+    """
+    The response times of the successful table requests of a run, by block Id.
+    """
+    response_times = {}
+
+    if os.path.exists(os.path.join(results_dir, STORE_FILENAME)):
+        for record in JsonlResultReader(results_dir):
+            if record["stage"] == "table" and record["status_code"] == 200:
+                response_times[record["block_id"]] = record["response_time"]
+
+        return response_times
+
+    # a run of several stages keeps the responses of the table stage in their own directory
+    responses_dir = os.path.join(results_dir, "responses")
+    directory_stage = None
+    if os.path.exists(os.path.join(responses_dir, "table")):
+        responses_dir = os.path.join(responses_dir, "table")
+        directory_stage = "table"
+
+    unknown_stage = 0
+
+    for filename in os.listdir(responses_dir):
+        header = _read_response_header(os.path.join(responses_dir, filename))
+        stage = header.get("stage", directory_stage)
+
+        # a run of a single stage writes its responses straight into the responses directory, so files written
+        # before the stage was recorded in their header could be of any stage
+        if stage is None:
+            unknown_stage += 1
+        elif stage == "table" and header.get("response status") == "200":
+            response_times[header["block"]] = float(header["time for response"])
+
+    if unknown_stage:
+        print(
+            f"Skipped {unknown_stage} responses in {responses_dir} without a stage, which may not be of the table stage"
+        )
+
+    return response_times
+
+
+def _read_response_header(response_path: str) -> dict[str, str]:
+    # only the header is needed, so stop reading at the start of the response, which may be large
+    header = {}
+    with open(response_path, "r", encoding="utf-8", errors="replace") as response_file:
+        for line in response_file:
+            if line == "response:\n":
+                break
+
+            key, _, value = line.rstrip("\n").partition(": ")
+            header[key] = value
+
+    return header
+
+
+def fit(args: argparse.Namespace) -> None:
+    queries = read_queries(args.datablocks_csv)
+    response_times = read_table_response_times(args.results_dir)
+
+    block_ids = [block_id for block_id in queries if block_id in response_times]
+    if len(block_ids) <= len(DIMENSIONS) + 1:
+        sys.exit(f"Only {len(block_ids)} blocks have both a query and a table response time, too few to fit")
+
+    complexities = [complexity(queries[block_id]) for block_id in block_ids]
+    features = _features(complexities)
+    log_response_times = np.log(np.array([response_times[block_id] for block_id in block_ids]))
+
+    coefficients, *_ = np.linalg.lstsq(features, log_response_times, rcond=None)
+    residuals = log_response_times - features @ coefficients
+    r_squared = 1 - residuals.var() / log_response_times.var() if log_response_times.var() else 0.0
+    log_cells = np.log([cells(query_complexity) for query_complexity in complexities])
+    correlation = np.corrcoef(log_cells, log_response_times)[0, 1] if log_cells.std() else float("nan")
+
+    with open(args.model, "w") as model_file:
+        json.dump(
+            {
+                "dimensions": DIMENSIONS,
+                "intercept": coefficients[0],
+                "exponents": dict(zip(DIMENSIONS, coefficients[1:])),
+                "r_squared": r_squared,
+                "blocks": len(block_ids),
+            },
+            model_file,
+            indent=2,
+        )
+
+    # the blocks slowest for their size first
+    order = np.argsort(-residuals)
+
+    with open(args.outliers, "w", newline="") as outliers_file:
+        writer = csv.writer(outliers_file)
+        writer.writerow(["block_id"] + DIMENSIONS + ["cells", "response_time", "predicted_time", "slowdown"])
+
+        for i in order:
+            writer.writerow(
+                [block_ids[i]]
+                + [complexities[i][dimension] for dimension in DIMENSIONS]
+                + [
+                    cells(complexities[i]),
+                    round(response_times[block_ids[i]], 3),
+                    round(math.exp(log_response_times[i] - residuals[i]), 3),
+                    round(math.exp(residuals[i]), 2),
+                ]
+            )
+
+    print(f"Fitted {len(block_ids)} blocks - R squared of the fit: {r_squared:.2f}")
+    print(f"Correlation of log table cells with log response time: {correlation:.2f}")
+    print(
+        "Response time grows with "
+        + ", ".join(f"{dimension}^{exponent:.2f}" for dimension, exponent in zip(DIMENSIONS, coefficients[1:]))
+    )
+    print(f"Wrote the model to {args.model} and the blocks slowest for their size to {args.outliers}")
+
+    for i in order[: args.limit]:
+        print(
+            f"block {block_ids[i]} took {response_times[block_ids[i]]:.2f}s, "
+            f"{math.exp(residuals[i]):.1f} times the {math.exp(log_response_times[i] - residuals[i]):.2f}s "
+            f"predicted for {cells(complexities[i])} cells"
+        )
+
+
+def predict(args: argparse.Namespace) -> None:
+    with open(args.model, "r") as model_file:
+        model = json.load(model_file)
+
+    queries = read_queries(args.datablocks_csv)
+    block_ids = list(queries)
+    complexities = [complexity(queries[block_id]) for block_id in block_ids]
+
+    coefficients = np.array([model["intercept"]] + [model["exponents"][dimension] for dimension in DIMENSIONS])
+    predicted_times = np.exp(_features(complexities) @ coefficients) if block_ids else np.array([])
+
+    # the blocks predicted to be slowest first
+    order = np.argsort(-predicted_times)
+
+    with open(args.predictions, "w", newline="") as predictions_file:
+        writer = csv.writer(predictions_file)
+        writer.writerow(["block_id"] + DIMENSIONS + ["cells", "predicted_time"])
+
+        for i in order:
+            writer.writerow(
+                [block_ids[i]]
+                + [complexities[i][dimension] for dimension in DIMENSIONS]
+                + [cells(complexities[i]), round(predicted_times[i], 3)]
+            )
+
+    print(f"Wrote the predicted response times of {len(block_ids)} blocks to {args.predictions}")
+
+    for i in order[: args.limit]:
+        print(f"block {block_ids[i]} predicted to take {predicted_times[i]:.2f}s for {cells(complexities[i])} cells")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python query_complexity.py",
+        description="Score the complexity of data block queries, and find or predict slow data blocks",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Fit the response times of a run to the complexity of its queries")
+    fit_parser.add_argument("datablocks_csv", help="CSV of data blocks (see get_data_block_responses.py)", type=str)
+    fit_parser.add_argument("results_dir", help="results directory of a run including the table stage", type=str)
+    fit_parser.add_argument(
+        "--outliers",
+        dest="outliers",
+        default="complexity_outliers.csv",
+        help="CSV to write the blocks to, slowest for their size first",
+        type=str,
+    )
+    fit_parser.set_defaults(func=fit)
+
+    predict_parser = subparsers.add_parser("predict", help="Predict the response times of data blocks")
+    predict_parser.add_argument("datablocks_csv", help="CSV of data blocks (see get_data_block_responses.py)", type=str)
+    predict_parser.add_argument(
+        "--predictions",
+        dest="predictions",
+        default="complexity_predictions.csv",
+        help="CSV to write the predictions to, slowest first",
+        type=str,
+    )
+    predict_parser.set_defaults(func=predict)
+
+    for subparser in [fit_parser, predict_parser]:
+        subparser.add_argument(
+            "--model",
+            dest="model",
+            default="complexity_model.json",
+            help="JSON file of the fitted model",
+            type=str,
+        )
+        subparser.add_argument(
+            "--limit", dest="limit", default=10, help="number of blocks to list", type=int, required=False
+        )
+
+    args = parser.parse_args()
+    args.func(args)
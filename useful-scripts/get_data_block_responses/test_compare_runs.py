@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+
+from compare_runs import compare_runs
+
+
+def _result(observation_id: str, location_id: str, value: str) -> dict:
+    return {
+        "id": observation_id,
+        "filters": ["filter-item-1"],
+        "geographicLevel": "COUNTRY",
+        "locationId": location_id,
+        "timePeriod": "2020_AY",
+        "measures": {"indicator-1": value},
+    }
+
+
+class CompareRunsTest(unittest.TestCase):
+    def setUp(self):
+        self.runs_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.runs_dir.cleanup()
+
+    def _write_run(self, name: str, results: list[dict], response: str | None = None, status_code: int = 200) -> str:
+        results_dir = os.path.join(self.runs_dir.name, name)
+        os.makedirs(os.path.join(results_dir, "responses"))
+
+        if response is None:
+            response = json.dumps({"results": results, "traceId": name}, sort_keys=True, indent=2)
+
+        with open(os.path.join(results_dir, "responses", "block_block-1_response"), "w") as block_response_file:
+            block_response_file.write(
+                "block: block-1\n"
+                "release: release-1\n"
+                "subject: subject-1\n"
+                f"response status: {status_code}\n"
+                "time for response: 0.5\n"
+                f"response:\n{response}"
+            )
+
+        return results_dir
+
+    def test_runs_differing_only_in_observation_ids_are_the_same(self):
+        run_a = self._write_run("a", [_result("observation-1", "location-1", "10"), _result("observation-2", "", "10")])
+        run_b = self._write_run("b", [_result("observation-3", "", "10"), _result("observation-4", "location-1", "10")])
+
+        comparison = compare_runs(run_a, run_b, processes=1)
+
+        self.assertEqual(comparison["compared"], 1)
+        self.assertEqual(comparison["changed"], {})
+
+    def test_changed_measures_are_reported(self):
+        run_a = self._write_run("a", [_result("observation-1", "location-1", "10")])
+        run_b = self._write_run("b", [_result("observation-2", "location-1", "11")])
+
+        comparison = compare_runs(run_a, run_b, processes=1)
+
+        self.assertEqual(list(comparison["changed"]), ["block-1"])
+        self.assertEqual(len(comparison["changed"]["block-1"]), 1)
+        self.assertIn('"10" -> "11"', comparison["changed"]["block-1"][0])
+
+    def test_streamed_responses_which_are_not_json_are_compared_as_text(self):
+        bad_gateway = "<html><body><h1>502 Bad Gateway</h1></body></html>\n"
+        run_a = self._write_run("a", [], response=bad_gateway, status_code=502)
+        run_b = self._write_run("b", [], response=bad_gateway, status_code=502)
+        run_c = self._write_run("c", [_result("observation-1", "location-1", "10")])
+
+        self.assertEqual(compare_runs(run_a, run_b, processes=1)["changed"], {})
+
+        differences = compare_runs(run_a, run_c, processes=1)["changed"]["block-1"]
+        self.assertIn("response status: 502 -> 200", differences)
+
+
+if __name__ == "__main__":
+    unittest.main()
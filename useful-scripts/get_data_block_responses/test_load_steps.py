@@ -0,0 +1,66 @@
+import asyncio
+import itertools
+import random
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+from get_data_block_responses import DataBlockBenchmark, DataBlockResult, LoadStep, find_knee
+
+TIMEOUT = 0.2
+
+
+class LoadStepsTest(unittest.TestCase):
+    def setUp(self):
+        self.benchmark = DataBlockBenchmark(
+            "local", ["table"], "datablocks.csv", sleep=0, concurrency=8, timeout=TIMEOUT
+        )
+        self.load_requests = itertools.cycle(
+            [
+                DataBlockResult(
+                    "block-1", "release-1", "subject-1", "table", "http://localhost:5000/api/tablebuilder", {}
+                )
+            ]
+        )
+
+    def _run_step(self, rps: float, post) -> LoadStep:
+        step = LoadStep(rps)
+
+        with (
+            mock.patch.object(self.benchmark.session, "post", side_effect=post),
+            ThreadPoolExecutor(max_workers=self.benchmark.concurrency) as executor,
+        ):
+            asyncio.run(self.benchmark._run_load_step(step, 0.5, self.load_requests, random.Random(1), executor))
+
+        return step
+
+    def test_timed_out_requests_count_towards_the_step_percentiles(self):
+        def post(**kwargs):
+            time.sleep(TIMEOUT)
+            raise requests.Timeout()
+
+        step = self._run_step(20, post)
+
+        self.assertGreater(step.failures, 0)
+        self.assertEqual(step.completed(), 0)
+        self.assertEqual(step.histogram.count, step.failures)
+        self.assertGreaterEqual(step.histogram.percentile(99), TIMEOUT)
+
+    def test_step_timing_out_is_the_knee(self):
+        def fast_post(**kwargs):
+            time.sleep(0.01)
+            return mock.Mock(status_code=200)
+
+        def timed_out_post(**kwargs):
+            time.sleep(TIMEOUT)
+            raise requests.Timeout()
+
+        steps = [self._run_step(10, fast_post), self._run_step(20, timed_out_post)]
+
+        self.assertIs(find_knee(steps, knee_ratio=2.0), steps[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from query_complexity import read_table_response_times
+
+
+class ReadTableResponseTimesTest(unittest.TestCase):
+    def setUp(self):
+        self.results_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.results_dir.cleanup()
+
+    def _write_response(self, block_id: str, stage: str | None, status_code: int = 200, subdirectory: str = "") -> None:
+        responses_dir = os.path.join(self.results_dir.name, "responses", subdirectory)
+        os.makedirs(responses_dir, exist_ok=True)
+
+        # responses written before the stage was recorded have no stage line
+        stage_line = f"stage: {stage}\n" if stage else ""
+
+        with open(os.path.join(responses_dir, f"block_{block_id}_response"), "w") as block_response_file:
+            block_response_file.write(
+                f"block: {block_id}\n"
+                "release: release-1\n"
+                "subject: subject-1\n"
+                f"{stage_line}"
+                f"response status: {status_code}\n"
+                "time for response: 1.5\n"
+                'response:\n{"results": [],\n"time for response: 9": "not part of the header"}'
+            )
+
+    def _read(self) -> dict[str, float]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return read_table_response_times(self.results_dir.name)
+
+    def test_only_successful_table_responses_are_read(self):
+        self._write_response("table-block", "table")
+        self._write_response("failed-block", "table", status_code=500)
+        self._write_response("filters-block", "filters")
+
+        self.assertEqual(self._read(), {"table-block": 1.5})
+
+    def test_responses_without_a_stage_are_only_read_from_the_table_directory(self):
+        self._write_response("unknown-stage-block", None)
+        self.assertEqual(self._read(), {})
+
+        self._write_response("table-block", None, subdirectory="table")
+        self.assertEqual(self._read(), {"table-block": 1.5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,26 +1,55 @@
 import argparse
+import asyncio
 import csv
+import hashlib
 import os
+import shutil
+import sys
+import threading
 import time
-from datetime import datetime
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import date, datetime
+from typing import Callable, ClassVar
 
 import certifi
 import requests
-from bs4 import BeautifulSoup
+from permalink_ab import AB_HEADERS, summarise_ab
+from permalink_archive import INDEX_FILENAME, TableArchiveReader, TableArchiveWriter
+from permalink_cache import CacheEntry, PermalinkCache
+from permalink_comparison import compare_runs
+from rate_controller import AimdRateController
+from table_extractor import ExtractedTable, PermalinkTableExtractor, extract_table
+
+# allow the timing utilities shared with the other useful scripts to be imported when running this script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.columnar_results import (  # noqa: E402
+    ColumnarResultWriter,
+    merge_row_groups,
+)
+from timing_utils.latency_report import LatencyReport, content_length_bucket  # noqa: E402
+from timing_utils.repeat_timing import RepeatTimings  # noqa: E402
+from timing_utils.request_timing import (  # noqa: E402
+    TimingHTTPAdapter,
+    connect_time,
+    reset_connect_time,
+)
+from timing_utils.sharding import in_shard, parse_shard  # noqa: E402
 
 """
 This is a script for measuring the response time of permalink requests.
 It uses the public frontend request `GET {public_base_url}/data-tables/permalink/{permalink_id}`.
 It reads a CSV file named 'permalinks.csv' and outputs a CSV file `responses_{env}_{datetime}/responses.csv`.
 
-Usage: `pipenv run python fetch_permalinks.py [-h] [--env {local,dev,test,preprod,prod}] [--save-content | --no-save-content] [--sleep [SLEEP]] [--timeout [TIMEOUT]]`
+Usage: `pipenv run python fetch_permalinks.py [-h] [--env {local,dev,test,preprod,prod}] [--save-content | --no-save-content] [--archive | --no-archive] [--sleep [SLEEP]] [--timeout [TIMEOUT]] [--concurrency [CONCURRENCY]] [--adaptive-rate | --no-adaptive-rate] [--target-p95 [TARGET_P95]] [--max-rate [MAX_RATE]] [--resume RESUME_RESULTS_DIR] [--normalise-processes [NORMALISE_PROCESSES]] [--cache-dir CACHE_DIR] [--changed-since CHANGED_SINCE] [--shard SHARD] [--columnar | --no-columnar] [--repeat [REPEAT]] [--repeat-gap [REPEAT_GAP]]`
 
 Instructions:
 
 1. List all the permalinks by running a query against the Content database:
 
 ```
-SELECT LOWER(Id) AS permalink_id
+SELECT LOWER(Id) AS permalink_id, Created AS created, PublicationTitle AS publication_title
 FROM content.dbo.Permalinks
 ORDER BY Created
 ```
@@ -31,22 +60,218 @@ Save it in the same directory as this script with filename 'permalinks.csv'.
 Example of 'permalinks.csv' input file:
 
 ```
-permalink_id
-a227b04a-42af-4139-28e5-08db35ad5bb4
-a57e9ae9-b442-4005-caec-08db3b6d5a38
+permalink_id,created,publication_title
+a227b04a-42af-4139-28e5-08db35ad5bb4,2023-04-11 10:22:33.1234567,Pupil absence in schools in England
+a57e9ae9-b442-4005-caec-08db3b6d5a38,2023-04-14 15:01:12.7654321,Key stage 4 performance
 ```
 
+The created and publication title columns are only needed for the changed since and columnar options described below.
+
 3. Run the script, choosing whether to save the html content of the permalink requests using the save content option.
 
+By default permalinks are requested one at a time. Use the concurrency option to request several permalinks at once
+over a shared pool of keep-alive connections, e.g. `--concurrency 16 --sleep 0`. The sleep is applied by each worker
+after each of its requests, so the overall request rate is roughly `concurrency / (response time + sleep)`.
+
+Alternatively, use the adaptive rate option to replace the fixed sleep with a request rate that is adjusted as the run
+progresses. The rate is increased while the p95 response time stays within the target and is cut back as soon as it
+doesn't, or when requests time out or fail with a 5xx status. The rate that the run settled on is logged at the end.
+
+When saving content at a high concurrency, extracting the tables can hold up the requests, as it shares the fetch
+workers' process. Use the normalise processes option, e.g. `--normalise-processes 4`, to extract and normalise the
+table html in a separate pool of processes instead. Each response body is then downloaded in full and handed to the
+pool, and its row is written once its table has been extracted.
+
+Permalinks don't change once they have been created, so repeated runs can use a cache directory shared between runs,
+e.g. `--cache-dir permalink_cache`. Each permalink's ETag and Last-Modified headers, body hash, status and table error
+are cached, along with its table html when saving content. Later runs make conditional requests and reuse the cached
+result of any permalink which hasn't been modified, recording `not_modified` in its row. See `permalink_cache.py`.
+
+If the server doesn't support conditional requests, use the changed since option to only request the permalinks
+created on or after a date, e.g. the date of the last run: `--changed-since 2024-01-01`.
+
+Alongside the overall response time, which `requests` measures up to the response headers, each row breaks the request
+down into phases:
+
+* `connect_time` - opening a new connection, including the DNS lookup and TLS handshake. 0 for a keep-alive connection.
+* `ttfb` - time to first byte, from sending the request to receiving the response headers, i.e. server side rendering.
+* `download_time` - downloading the response body.
+* `parse_time` - extracting and normalising the table html from the body.
+
 4. Inspect the console log for errors and view the result CSV file `responses_{env}_{datetime}/responses.csv`.
 
-You can compare two response directories together to see differences between the table html by running the following command:
-`diff --brief --exclude=responses.csv dir1 dir2`
+A summary of the response time percentiles is logged at the end of the run. A fuller report, broken down by content
+length and HTTP status, is written to `responses_{env}_{datetime}/latency_report.json`.
+
+If a run is interrupted, it can be picked up where it left off by passing its responses directory to the resume option,
+e.g. `--env prod --resume responses_prod_20240101_090000`. Each permalink is recorded in the directory's
+'completed_permalinks.journal' file once its result has been written, and those permalinks are skipped on resume.
+
+You can compare the table html saved by two runs by running the compare command:
+`pipenv run python fetch_permalinks.py compare dir1 dir2 [--output comparison.csv] [--processes PROCESSES]`
+
+The tables are compared in parallel, cell by cell. The report lists each permalink saved by either run with whether
+its table changed, how many caption, header, body and footnote cells changed, and the change in response time.
+Tables are compared in the same way whether they were saved as separate files or in an archive.
+
+To see how much of a permalink's response time is absorbed by caching, e.g. by the CDN or the frontend's server side
+rendering cache, use the repeat option to request each permalink several times, e.g. `--repeat 5 --repeat-gap 2`
+requests each permalink 5 times, 2 seconds apart. The first attempt is the one recorded in 'responses.csv'. Every
+attempt's response time is written to 'repeat_attempts.csv', and each permalink's cold (first), warm (second) and
+steady state (median of the rest) response times to 'repeat_summary.csv', along with how many times faster caching
+makes it. The permalinks that warming speeds up the most come first, as those most worth pre-warming after a publish.
+See `../timing_utils/repeat_timing.py`.
+
+For analysing runs, use the columnar option to also write the results, along with each permalink's publication title,
+as typed columns in the `columns` directory of the responses directory. See `../timing_utils/analyse_runs.py` for
+listing the slowest permalinks of a run, the permalinks which have got slower since an earlier run and response times
+by publication.
+
+To split a sweep between several machines, e.g. CI agents, give each of them a different shard of the permalinks with
+the shard option, e.g. `--shard 0/4` to `--shard 3/4`. Permalinks are assigned to shards by a hash of their Id, so
+every machine can use the same 'permalinks.csv' and no permalink is fetched twice. Each shard is written to its own
+responses directory, which can be merged into one with the merge command:
+`pipenv run python fetch_permalinks.py merge responses_prod_merged responses_prod_*_shard_*`
+
+The merged directory has one 'responses.csv' and latency report, and all of the saved table html.
+
+To compare the response times of two environments, e.g. before a release, run the A/B command:
+`pipenv run python fetch_permalinks.py [--sleep SLEEP] [--concurrency CONCURRENCY] ab preprod prod [--resamples RESAMPLES]`
+
+Each permalink is requested from both environments one after the other, alternating which goes first, so that both
+are measured under the same load. The paired status codes, response times and content lengths are written to
+`responses_ab_{env_a}_{env_b}_{datetime}/ab_responses.csv` along with the ratio of the response times. The median
+ratio and its bootstrap confidence interval are written to `ab_summary.json`, along with each environment's latency
+percentiles, and logged along with whether the second environment is significantly slower or faster than the first.
+
+Alternatively, you can see which table html files differ between two response directories by running the following command:
+`diff --brief --exclude=responses.csv --exclude=latency_report.json --exclude=completed_permalinks.journal --exclude=columns dir1 dir2`
+
+With tens of thousands of permalinks, use the archive option along with the save content option to store the table
+html in a compressed, content-addressed archive in the responses directory instead of one file per permalink.
+Each distinct table is stored once. See `permalink_archive.py` for listing the archived permalinks and their content
+hashes, and for extracting their html.
 
 Note that if you are using Windows, you will need to install a tool like Git Bash to provide the `diff` command, or alternatively try a tool like WinMerge.
 """
 
 
+@dataclass
+class PermalinkResult:
+    COLUMNAR_SCHEMA: ClassVar[dict[str, str]] = {
+        "permalink_id": "str",
+        "publication_title": "str",
+        "connection_error": "bool",
+        "timeout": "bool",
+        "exception": "bool",
+        "status_code": "int",
+        "table_error": "bool",
+        "response_time": "float",
+        "content_length": "int",
+        "not_modified": "bool",
+        "connect_time": "float",
+        "ttfb": "float",
+        "download_time": "float",
+        "parse_time": "float",
+    }
+
+    CSV_HEADERS: ClassVar[list[str]] = [
+        "permalink_id",
+        "connection_error",
+        "timeout",
+        "exception",
+        "http_status_code",
+        "table_error",
+        "response_time",
+        "content_length",
+        "content_length_formatted",
+        "not_modified",
+        "connect_time",
+        "ttfb",
+        "download_time",
+        "parse_time",
+    ]
+
+    permalink_id: str
+    connection_error: bool | None = None
+    timeout: bool | None = None
+    exception: bool | None = None
+    status_code: int | None = None
+    table_error: bool | None = None
+    response_time: float | None = None
+    content_length: int | None = None
+    content_length_formatted: str | None = None
+    not_modified: bool | None = None
+    connect_time: float | None = None
+    ttfb: float | None = None
+    download_time: float | None = None
+    parse_time: float | None = None
+    # the response details kept in the cache, which aren't written to the responses csv
+    etag: str | None = None
+    last_modified: str | None = None
+    content_hash: str | None = None
+    # the response time of each attempt at the request with the repeat option, which isn't written to the responses csv
+    repeat_times: list[float | None] | None = None
+
+    @staticmethod
+    def from_row(row: list[str]) -> "PermalinkResult":
+        # rows written by earlier versions of this script don't have the later columns
+        row = row + [""] * (len(PermalinkResult.CSV_HEADERS) - len(row))
+
+        return PermalinkResult(
+            permalink_id=row[0],
+            connection_error=row[1] == "True" or None,
+            timeout=row[2] == "True" or None,
+            exception=row[3] == "True" or None,
+            status_code=int(row[4]) if row[4] else None,
+            table_error=row[5] == "True" or None,
+            response_time=float(row[6]) if row[6] else None,
+            content_length=int(row[7]) if row[7] else None,
+            content_length_formatted=row[8] or None,
+            not_modified=row[9] == "True" or None,
+            connect_time=float(row[10]) if row[10] else None,
+            ttfb=float(row[11]) if row[11] else None,
+            download_time=float(row[12]) if row[12] else None,
+            parse_time=float(row[13]) if row[13] else None,
+        )
+
+    def is_server_failure(self) -> bool:
+        return bool(self.timeout) or (self.status_code is not None and self.status_code >= 500)
+
+    def to_row(self) -> list:
+        return [
+            self.permalink_id,
+            self.connection_error,
+            self.timeout,
+            self.exception,
+            self.status_code,
+            self.table_error if self.table_error is True else "",
+            "" if self.response_time is None else f"{self.response_time:.2f}",
+            self.content_length,
+            self.content_length_formatted,
+            self.not_modified if self.not_modified is True else "",
+            *("" if timing is None else f"{timing:.3f}" for timing in self.phase_timings()),
+        ]
+
+    def phase_timings(self) -> list[float | None]:
+        return [self.connect_time, self.ttfb, self.download_time, self.parse_time]
+
+    def record_latency(self, latency_report: LatencyReport) -> None:
+        if self.response_time is None:
+            if self.connection_error:
+                latency_report.record_failure("connection_error")
+            elif self.timeout:
+                latency_report.record_failure("timeout")
+            else:
+                latency_report.record_failure("exception")
+        else:
+            latency_report.record(
+                self.response_time,
+                by_content_length=content_length_bucket(self.content_length),
+                by_status=self.status_code,
+            )
+
+
 class PermalinkFetcher:
     PUBLIC_URLS = {
         "local": "http://localhost:3000",
@@ -56,26 +281,132 @@ class PermalinkFetcher:
         "prod": "https://explore-education-statistics.service.gov.uk",
     }
 
-    def __init__(self, env: str, save_content: bool, sleep: float, timeout: float):
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(
+        self,
+        env: str,
+        save_content: bool,
+        sleep: float,
+        timeout: float,
+        concurrency: int = 1,
+        rate_controller: AimdRateController | None = None,
+        resume_results_dir: str | None = None,
+        archive_content: bool = False,
+        normalise_processes: int = 0,
+        cache_dir: str | None = None,
+        changed_since: date | None = None,
+        shard: tuple[int, int] | None = None,
+        columnar: bool = False,
+        repeat: int = 1,
+        repeat_gap: float = 0,
+    ):
         self.env = (env,)
         self.public_url = PermalinkFetcher.PUBLIC_URLS[env]
         self.save_content = save_content
-        self.session = requests.Session()
+        self.archive_content = archive_content
+        self.table_archive: TableArchiveWriter | None = None
         self.sleep = sleep
         self.timeout = timeout
+        self.concurrency = concurrency
+        self.rate_controller = rate_controller
+        self.normalise_processes = normalise_processes
+        self.normaliser_pool: ProcessPoolExecutor | None = None
+        # limit the response bodies held in memory waiting for a normaliser process
+        self.normaliser_slots = threading.BoundedSemaphore(max(2 * normalise_processes, 1))
+        # share one pool of keep-alive connections between all workers, sized so that no worker waits for a connection
+        self.session = requests.Session()
+        adapter = TimingHTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.http_headers = {"Accept-Encoding": "gzip, deflate, br"}
-        self.results_dir = f"responses_{env}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.shard = shard
+        self.columnar = columnar
+        self.columnar_writer: ColumnarResultWriter | None = None
+        self.publication_titles: dict[str, str] = {}
+        shard_suffix = f"_shard_{shard[0]}_of_{shard[1]}" if shard else ""
+        self.results_dir = (
+            resume_results_dir or f"responses_{env}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{shard_suffix}"
+        )
+        self.responses_csv = os.path.join(self.results_dir, "responses.csv")
+        # append-only record of the permalinks with a row in the responses csv, used to resume an interrupted run
+        self.journal_file = os.path.join(self.results_dir, "completed_permalinks.journal")
+        self.latency_report = LatencyReport()
+        self.latency_report_json = os.path.join(self.results_dir, "latency_report.json")
+        self.cache_dir = cache_dir
+        self.cache: PermalinkCache | None = None
+        self.changed_since = changed_since
+        self.repeat = repeat
+        self.repeat_gap = repeat_gap
+        self.repeat_timings = RepeatTimings()
 
-    def _get_permalink(self, permalink_id: str) -> tuple[int, bool, float, int, str]:
+    def _get_permalink(self, result: PermalinkResult) -> ExtractedTable | Future | None:
+        permalink_id = result.permalink_id
         url = f"{self.public_url}/data-tables/permalink/{permalink_id}"
+        headers = self.http_headers
+        if self.cache:
+            headers = {**headers, **self.cache.conditional_headers(permalink_id, table_needed=self.save_content)}
+
+        reset_connect_time()
+        request_start = time.perf_counter()
         response = self.session.get(
             url,
-            headers=self.http_headers,
+            headers=headers,
             timeout=self.timeout,
             verify=certifi.where(),
+            stream=True,
         )
-        response_time = response.elapsed.total_seconds()
-        content_length = len(response.content)
+        headers_received = time.perf_counter()
+        request_connect_time = connect_time()
+
+        with response:
+            response_time = response.elapsed.total_seconds()
+
+            table: ExtractedTable | Future | None = None
+
+            if response.status_code == 304:
+                # there's no body to parse, the cached result is used instead (see '_apply_cached_result')
+                download_time = time.perf_counter() - headers_received
+                content_length = 0
+                content_hash = None
+            elif self.normaliser_pool:
+                content = response.content
+                download_time = time.perf_counter() - headers_received
+                content_length = len(content)
+                content_hash = hashlib.sha256(content).hexdigest()
+
+                if response.status_code == 200:
+                    # hand the page to a normaliser process rather than parsing it while other requests wait,
+                    # blocking this fetch worker if there are already enough pages waiting to be normalised
+                    self.normaliser_slots.acquire()
+                    try:
+                        table = self.normaliser_pool.submit(
+                            extract_table, content, response.encoding or response.apparent_encoding
+                        )
+                    except Exception as e:
+                        # e.g. a normaliser process died, breaking the pool, the response is still recorded
+                        self.normaliser_slots.release()
+                        result.exception = True
+                        print(f"Extracting the table of permalink Id {permalink_id} failed with error: {str(e)}")
+                    else:
+                        table.add_done_callback(lambda _: self.normaliser_slots.release())
+            else:
+                # parse the response content incrementally as it is downloaded,
+                # only keeping the parts of the page that are needed
+                # without a charset in the Content-Type header, the encoding is detected from the body, as
+                # `response.text` does, which reads the whole body before it is parsed
+                extractor = PermalinkTableExtractor(encoding=response.encoding or response.apparent_encoding)
+                content_length = 0
+                body_hash = hashlib.sha256()
+                for chunk in response.iter_content(chunk_size=PermalinkFetcher.CHUNK_SIZE):
+                    content_length += len(chunk)
+                    body_hash.update(chunk)
+                    extractor.feed(chunk)
+                table = extractor.finish()
+                # the body is parsed as it is downloaded, so leave out the time spent parsing
+                download_time = time.perf_counter() - headers_received - extractor.parse_time
+                content_hash = body_hash.hexdigest()
+
         content_length_formatted = self._format_content_length(content_length)
         print(
             f"Request for permalink Id {permalink_id} "
@@ -83,127 +414,249 @@ class PermalinkFetcher:
             f"length: {content_length_formatted}."
         )
 
-        # parse the response content using BeautifulSoup
-        soup = BeautifulSoup(response.text, "lxml")
+        result.status_code = response.status_code
+        result.response_time = response_time
+        result.content_length = content_length
+        result.content_length_formatted = content_length_formatted
+        result.etag = response.headers.get("ETag")
+        result.last_modified = response.headers.get("Last-Modified")
+        result.content_hash = content_hash
+        result.connect_time = request_connect_time
+        result.ttfb = headers_received - request_start - request_connect_time
+        result.download_time = download_time
+
+        return table
+
+    def _time_repeat(self, permalink_id: str) -> float | None:
+        time.sleep(self.repeat_gap)
+
+        try:
+            with self.session.get(
+                f"{self.public_url}/data-tables/permalink/{permalink_id}",
+                headers=self.http_headers,
+                timeout=self.timeout,
+                verify=certifi.where(),
+                stream=True,
+            ) as response:
+                # only the time is needed, so the body is read and discarded a chunk at a time
+                for _ in response.iter_content(chunk_size=PermalinkFetcher.CHUNK_SIZE):
+                    pass
+
+                return response.elapsed.total_seconds()
+        except requests.exceptions.RequestException as e:
+            print(f"Repeat request for permalink Id {permalink_id} failed with error: {str(e)}")
+            return None
+
+    def _apply_cached_result(self, result: PermalinkResult) -> None:
+        entry = self.cache.entries[result.permalink_id]
+
+        result.not_modified = True
+        result.status_code = entry.status_code
+        result.table_error = entry.table_error or None
+        result.content_length = entry.content_length
+        result.content_length_formatted = self._format_content_length(entry.content_length)
+
+        if self.save_content and not entry.table_error:
+            self._write_content(self.cache.table(result.permalink_id), result.permalink_id)
+
+    def _apply_table(self, result: PermalinkResult, table: ExtractedTable) -> None:
+        result.parse_time = table.parse_time
 
         # catch cases where the response is successful but the table is not rendered
         # and the error message "There was a problem rendering the table." appears instead
-        table_error = False
-        if response.status_code == 200 and soup.find("div", {"data-testid": "table-error"}):
-            table_error = True
+        if result.status_code == 200 and table.table_error:
+            result.table_error = True
 
         # save the table html if the response is successful and the table is rendered
-        if self.save_content and response.status_code == 200 and not table_error:
-            self._save_table(soup, permalink_id)
-
-        return response.status_code, table_error, response_time, content_length, content_length_formatted
+        if self.save_content and result.status_code == 200 and not result.table_error:
+            self._save_table(table, result.permalink_id)
 
-    def _save_table(self, soup: BeautifulSoup, permalink_id: str) -> None:
-        # find the data table figure element
-        data_table = soup.find("figure", class_=lambda value: value and value.startswith("FixedMultiHeaderDataTable"))
-
-        if data_table is None:
+    def _save_table(self, table: ExtractedTable, permalink_id: str) -> None:
+        if table.table_parent_html is None:
             print(f"Table not found for permalink Id {permalink_id}.")
         else:
-            # get the parent of the figure element
+            # the table parent is the parent of the figure element
             # as well as the the table itself, this contains the table caption, footnotes and the source
-            data_table_parent = data_table.parent
 
             # assert that the parent element is a div tag
-            assert data_table_parent.name == "div", "Parent element is not a div tag"
-
-            # facilitate version-to-version directory comparison using a diff tool by sorting tag attributes alphabetically
-            self._sort_tag_attributes(data_table_parent)
-
-            html = str(data_table_parent)
-
-            self._write_content(html, permalink_id)
+            assert table.table_parent_tag == "div", "Parent element is not a div tag"
 
-    def _remove_style_class(self, parent: BeautifulSoup, tag_names: list[str], ignored_class_prefix: str) -> None:
-        for tag in parent.find_all(
-            tag_names, class_=lambda value: value and any(c.startswith(ignored_class_prefix) for c in value.split())
-        ):
-            tag["class"] = " ".join(c for c in tag.get("class", []) if not c.startswith(ignored_class_prefix))
-
-    def _remove_empty_class_attributes(self, parent: BeautifulSoup, tag_names: list[str]) -> None:
-        for tag in parent.find_all(tag_names, class_=True):
-            if tag.get("class") == "" or tag.get("class") == []:
-                del tag["class"]
+            # the extractor has already sorted tag attributes alphabetically
+            # to facilitate version-to-version directory comparison using a diff tool
+            self._write_content(table.table_parent_html, permalink_id)
 
-    def _sort_tag_attributes(self, parent: BeautifulSoup) -> None:
-        for tag in parent.find_all():
-            sorted_attrs = sorted(tag.attrs.items())
-            tag.attrs = dict(sorted_attrs)
+            if self.cache:
+                self.cache.add_table(permalink_id, table.table_parent_html)
 
     def _write_content(self, content: str, permalink_id: str) -> None:
+        if self.table_archive:
+            self.table_archive.add(permalink_id, content)
+            return
+
         with open(os.path.join(self.results_dir, f"{permalink_id}.html"), "w", encoding="utf-8") as output_file:
             output_file.write(content)
 
+    def _load_completed_permalink_ids(self) -> set[str]:
+        if not os.path.exists(self.journal_file):
+            return set()
+
+        with open(self.journal_file, "r") as journal_file:
+            return {line.strip() for line in journal_file if line.strip()}
+
     def _get_permalinks(self, permalinks: list[list[str]]) -> None:
-        with open(os.path.join(self.results_dir, "responses.csv"), "w", newline="") as output_file:
+        resuming = os.path.exists(self.responses_csv)
+
+        with (
+            open(self.responses_csv, "a" if resuming else "w", newline="") as output_file,
+            open(self.journal_file, "a") as journal_file,
+        ):
             output_writer = csv.writer(output_file)
 
-            output_writer.writerow(
-                [
-                    "permalink_id",
-                    "connection_error",
-                    "timeout",
-                    "exception",
-                    "http_status_code",
-                    "table_error",
-                    "response_time",
-                    "content_length",
-                    "content_length_formatted",
-                ]
+            if resuming:
+                self._record_previous_latencies()
+            else:
+                output_writer.writerow(PermalinkResult.CSV_HEADERS)
+                output_file.flush()
+
+            def write_result(result: PermalinkResult) -> None:
+                output_writer.writerow(result.to_row())
+                output_file.flush()
+                self._record_latency(result)
+
+                if result.repeat_times:
+                    self.repeat_timings.record(result.permalink_id, result.repeat_times)
+
+                if self.columnar_writer:
+                    self.columnar_writer.append(
+                        {**asdict(result), "publication_title": self.publication_titles.get(result.permalink_id)}
+                    )
+
+                if self.cache and result.status_code == 200 and not result.not_modified:
+                    self.cache.add(
+                        CacheEntry(
+                            result.permalink_id,
+                            result.etag,
+                            result.last_modified,
+                            result.content_hash,
+                            result.status_code,
+                            bool(result.table_error),
+                            result.content_length,
+                        )
+                    )
+
+                # only journal the permalink once its row is safely in the responses csv
+                journal_file.write(f"{result.permalink_id}\n")
+                journal_file.flush()
+
+            asyncio.run(self._fetch_permalinks_concurrently(permalinks, write_result))
+
+        self.latency_report.write_json(self.latency_report_json)
+        print(f"Response times: {self.latency_report.summary()}. Full report written to {self.latency_report_json}")
+
+        if self.repeat > 1:
+            self.repeat_timings.write_csvs(self.results_dir)
+            print(f"Cold versus warm response times: {self.repeat_timings.summary()}")
+
+        if self.rate_controller:
+            print(
+                f"Adaptive request rate settled at {self.rate_controller.rate:.2f} requests/second "
+                f"(lowest {self.rate_controller.lowest_rate:.2f}, highest {self.rate_controller.highest_rate:.2f})"
             )
-            output_file.flush()
-
-            for (permalink_id,) in permalinks:
-                connection_error: bool | None = None
-                timeout: bool | None = None
-                exception: bool | None = None
-                status_code: int | None = None
-                table_error: bool | None = None
-                response_time: float | None = None
-                content_length: int | None = None
-                content_length_formatted: str | None = None
 
+    async def _fetch_permalinks_concurrently(
+        self, permalinks: list[list[str]], write_result: Callable[[PermalinkResult], None]
+    ) -> None:
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for permalink in permalinks:
+            queue.put_nowait(permalink[0])
+
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            normalising: set[asyncio.Task] = set()
+
+            async def write_normalised_result(result: PermalinkResult, table: Future) -> None:
                 try:
-                    (
-                        status_code,
-                        table_error,
-                        response_time,
-                        content_length,
-                        content_length_formatted,
-                    ) = self._get_permalink(permalink_id)
-                except requests.exceptions.ConnectionError:
-                    connection_error = True
-                    print(f"Request for permalink Id {permalink_id} failed to connect")
-                except requests.exceptions.Timeout:
-                    timeout = True
-                    print(f"Request for permalink Id {permalink_id} timed out after {self.timeout} seconds")
-                except requests.exceptions.RequestException as e:
-                    exception = True
-                    print(f"Request for permalink Id {permalink_id} failed with error: {str(e)}")
-
-                # write a result row to the output csv file
-                output_writer.writerow(
-                    [
-                        permalink_id,
-                        connection_error,
-                        timeout,
-                        exception,
-                        status_code,
-                        table_error if table_error is True else "",
-                        "" if response_time is None else f"{response_time:.2f}",
-                        content_length,
-                        content_length_formatted,
-                    ]
-                )
-                output_file.flush()
+                    self._apply_table(result, await asyncio.wrap_future(table))
+                except Exception as e:
+                    # e.g. the normaliser process died, the response was still received so its row is still written.
+                    # this is a failure of the script rather than a table error page from the server
+                    result.exception = True
+                    print(f"Extracting the table of permalink Id {result.permalink_id} failed with error: {str(e)}")
+
+                write_result(result)
+
+            async def worker() -> None:
+                while not queue.empty():
+                    permalink_id = queue.get_nowait()
+
+                    if self.rate_controller:
+                        sent_at = await self.rate_controller.wait()
+
+                    result, table = await loop.run_in_executor(executor, self._fetch_permalink, permalink_id)
+
+                    # results are only ever written from the event loop, so rows are never interleaved
+                    if isinstance(table, Future):
+                        # carry on fetching while the table is extracted in a normaliser process
+                        task = asyncio.create_task(write_normalised_result(result, table))
+                        normalising.add(task)
+                        task.add_done_callback(normalising.discard)
+                    else:
+                        write_result(result)
+
+                    if self.rate_controller:
+                        self.rate_controller.record(
+                            result.response_time, failed=result.is_server_failure(), sent_at=sent_at
+                        )
+                    else:
+                        # sleep for a specified amount of time since requesting big permalinks is resource intensive
+                        await asyncio.sleep(self.sleep)
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+            await asyncio.gather(*normalising)
+
+    def _fetch_permalink(self, permalink_id: str) -> tuple[PermalinkResult, Future | None]:
+        result = PermalinkResult(permalink_id=permalink_id)
+        table = None
+
+        try:
+            table = self._get_permalink(result)
+        except requests.exceptions.ConnectionError:
+            result.connection_error = True
+            print(f"Request for permalink Id {permalink_id} failed to connect")
+        except requests.exceptions.Timeout:
+            result.timeout = True
+            print(f"Request for permalink Id {permalink_id} timed out after {self.timeout} seconds")
+        except requests.exceptions.RequestException as e:
+            result.exception = True
+            print(f"Request for permalink Id {permalink_id} failed with error: {str(e)}")
+
+        if self.repeat > 1 and result.response_time is not None and result.status_code != 304:
+            result.repeat_times = [result.response_time] + [
+                self._time_repeat(permalink_id) for _ in range(self.repeat - 1)
+            ]
+
+        if result.status_code == 304:
+            self._apply_cached_result(result)
+        elif isinstance(table, ExtractedTable):
+            self._apply_table(result, table)
+            table = None
+
+        return result, table
+
+    def _record_latency(self, result: PermalinkResult) -> None:
+        result.record_latency(self.latency_report)
+
+    def _record_previous_latencies(self) -> None:
+        # include the results from before the run was interrupted so that the report covers the whole run
+        with open(self.responses_csv, "r", newline="") as responses_csv_file:
+            csv_reader = csv.reader(responses_csv_file)
 
-                # sleep for a specified amount of time since requesting big permalinks is resource intensive
-                time.sleep(self.sleep)
+            # Skip header row
+            next(csv_reader)
+
+            for row in csv_reader:
+                self._record_latency(PermalinkResult.from_row(row))
 
     def _format_content_length(self, length: int) -> str:
         if length < 1024:
@@ -217,15 +670,273 @@ class PermalinkFetcher:
         if not os.path.exists(self.results_dir):
             os.makedirs(self.results_dir)
 
-        with open("permalinks.csv", "r") as permalinks_csv_file:
-            csv_reader = csv.reader(permalinks_csv_file)
+        permalinks = read_permalinks_csv()
 
-            # Skip header row
-            next(csv_reader)
+        if self.shard:
+            permalinks = [permalink for permalink in permalinks if in_shard(permalink[0], self.shard)]
+            print(f"Fetching the {len(permalinks)} permalinks in shard {self.shard[0]}/{self.shard[1]}")
+
+        if self.changed_since:
+            if permalinks and len(permalinks[0]) < 2:
+                raise ValueError("permalinks.csv needs a created column to only fetch permalinks changed since a date")
+
+            # the created column is a SQL Server datetime, e.g. 2023-04-11 10:22:33.1234567
+            changed_permalinks = [
+                permalink for permalink in permalinks if date.fromisoformat(permalink[1][:10]) >= self.changed_since
+            ]
+            print(
+                f"Skipping {len(permalinks) - len(changed_permalinks)} permalinks created before {self.changed_since}, "
+                f"{len(changed_permalinks)} permalinks remaining."
+            )
+            permalinks = changed_permalinks
+
+        # a run killed part way through writing a line leaves it cut short, and the resumed run would append to it,
+        # so drop the partial line, and its permalink is fetched again
+        for path in [self.responses_csv, self.journal_file]:
+            if os.path.exists(path):
+                truncate_partial_line(path)
+
+        completed_permalink_ids = self._load_completed_permalink_ids()
+
+        if completed_permalink_ids:
+            permalinks = [permalink for permalink in permalinks if permalink[0] not in completed_permalink_ids]
+            print(
+                f"Resuming run in {self.results_dir}. Skipping {len(completed_permalink_ids)} permalinks "
+                f"which have already been fetched, {len(permalinks)} permalinks remaining."
+            )
+
+        if self.save_content and self.archive_content:
+            self.table_archive = TableArchiveWriter(self.results_dir)
+
+        if self.normalise_processes:
+            self.normaliser_pool = ProcessPoolExecutor(max_workers=self.normalise_processes)
+
+        if self.cache_dir:
+            self.cache = PermalinkCache(self.cache_dir)
+
+        if self.columnar:
+            self.publication_titles = {permalink[0]: permalink[2] for permalink in permalinks if len(permalink) > 2}
+            self.columnar_writer = ColumnarResultWriter(
+                self.results_dir, key="permalink_id", schema=PermalinkResult.COLUMNAR_SCHEMA
+            )
 
-            permalinks: list[list[str]] = list(csv_reader)
+        try:
+            self._get_permalinks(permalinks)
+        finally:
+            if self.normaliser_pool:
+                self.normaliser_pool.shutdown()
+            if self.cache:
+                self.cache.close()
+            if self.table_archive:
+                self.table_archive.close()
+            if self.columnar_writer:
+                self.columnar_writer.close()
 
-        self._get_permalinks(permalinks)
+
+class PermalinkAbFetcher:
+    """
+    Fetches each permalink from two environments together, alternating which environment is requested first so that
+    neither consistently benefits from the other warming a cache.
+    """
+
+    def __init__(
+        self, env_a: str, env_b: str, sleep: float, timeout: float, concurrency: int = 1, resamples: int = 10_000
+    ):
+        self.env_a = env_a
+        self.env_b = env_b
+        self.fetcher_a = PermalinkFetcher(
+            env_a, save_content=False, sleep=sleep, timeout=timeout, concurrency=concurrency
+        )
+        self.fetcher_b = PermalinkFetcher(
+            env_b, save_content=False, sleep=sleep, timeout=timeout, concurrency=concurrency
+        )
+        self.sleep = sleep
+        self.concurrency = concurrency
+        self.resamples = resamples
+        self.results_dir = f"responses_ab_{env_a}_{env_b}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.responses_csv = os.path.join(self.results_dir, "ab_responses.csv")
+        self.summary_json = os.path.join(self.results_dir, "ab_summary.json")
+
+    def _fetch_pair(self, index: int, permalink_id: str) -> tuple[str, PermalinkResult, PermalinkResult]:
+        if index % 2 == 0:
+            first_env = self.env_a
+            result_a, _ = self.fetcher_a._fetch_permalink(permalink_id)
+            result_b, _ = self.fetcher_b._fetch_permalink(permalink_id)
+        else:
+            first_env = self.env_b
+            result_b, _ = self.fetcher_b._fetch_permalink(permalink_id)
+            result_a, _ = self.fetcher_a._fetch_permalink(permalink_id)
+
+        return first_env, result_a, result_b
+
+    async def _fetch_pairs_concurrently(
+        self, permalinks: list[list[str]], write_pair: Callable[[str, str, PermalinkResult, PermalinkResult], None]
+    ) -> None:
+        queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue()
+        for index, permalink in enumerate(permalinks):
+            queue.put_nowait((index, permalink[0]))
+
+        loop = asyncio.get_running_loop()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            async def worker() -> None:
+                while not queue.empty():
+                    index, permalink_id = queue.get_nowait()
+                    first_env, result_a, result_b = await loop.run_in_executor(
+                        executor, self._fetch_pair, index, permalink_id
+                    )
+                    write_pair(permalink_id, first_env, result_a, result_b)
+                    await asyncio.sleep(self.sleep)
+
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    def main(self):
+        if not os.path.exists(self.results_dir):
+            os.makedirs(self.results_dir)
+
+        permalinks = read_permalinks_csv()
+        ratios: list[float] = []
+
+        with open(self.responses_csv, "w", newline="") as output_file:
+            output_writer = csv.writer(output_file)
+            output_writer.writerow(AB_HEADERS)
+
+            def write_pair(
+                permalink_id: str, first_env: str, result_a: PermalinkResult, result_b: PermalinkResult
+            ) -> None:
+                self.fetcher_a._record_latency(result_a)
+                self.fetcher_b._record_latency(result_b)
+
+                # only compare response times where both environments rendered the permalink
+                ratio = None
+                if result_a.status_code == 200 and result_b.status_code == 200 and result_a.response_time:
+                    ratio = result_b.response_time / result_a.response_time
+                    ratios.append(ratio)
+
+                output_writer.writerow(
+                    [
+                        permalink_id,
+                        first_env,
+                        result_a.status_code,
+                        result_b.status_code,
+                        "" if result_a.response_time is None else f"{result_a.response_time:.2f}",
+                        "" if result_b.response_time is None else f"{result_b.response_time:.2f}",
+                        "" if ratio is None else f"{ratio:.3f}",
+                        result_a.content_length,
+                        result_b.content_length,
+                    ]
+                )
+                output_file.flush()
+
+            asyncio.run(self._fetch_pairs_concurrently(permalinks, write_pair))
+
+        print(f"{self.env_a} response times: {self.fetcher_a.latency_report.summary()}")
+        print(f"{self.env_b} response times: {self.fetcher_b.latency_report.summary()}")
+
+        summary = summarise_ab(
+            self.env_a,
+            self.env_b,
+            ratios,
+            resamples=self.resamples,
+            latency_a=self.fetcher_a.latency_report.overall.to_dict(),
+            latency_b=self.fetcher_b.latency_report.overall.to_dict(),
+        )
+        summary.write_json(self.summary_json)
+        print(f"{summary.verdict()}. Summary written to {self.summary_json}")
+
+
+def truncate_partial_line(path: str, chunk_size: int = 64 * 1024) -> None:
+    """
+    Cut a file back to the end of its last complete line.
+    """
+    with open(path, "rb+") as file:
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        length = 0
+
+        # search backwards from the end of the file, as only its last line can be incomplete
+        while position > 0:
+            start = max(position - chunk_size, 0)
+            file.seek(start)
+            newline = file.read(position - start).rfind(b"\n")
+            if newline != -1:
+                length = start + newline + 1
+                break
+            position = start
+
+        if length != end:
+            file.truncate(length)
+
+
+def merge_runs(output_dir: str, shard_dirs: list[str]) -> None:
+    if os.path.exists(output_dir):
+        raise ValueError(f"Output directory {output_dir} already exists")
+
+    os.makedirs(output_dir)
+
+    latency_report = LatencyReport()
+    permalink_ids: set[str] = set()
+    table_archive: TableArchiveWriter | None = None
+
+    with (
+        open(os.path.join(output_dir, "responses.csv"), "w", newline="") as output_file,
+        open(os.path.join(output_dir, "completed_permalinks.journal"), "w") as journal_file,
+    ):
+        output_writer = csv.writer(output_file)
+        output_writer.writerow(PermalinkResult.CSV_HEADERS)
+
+        for shard_dir in shard_dirs:
+            with open(os.path.join(shard_dir, "responses.csv"), "r", newline="") as responses_csv_file:
+                csv_reader = csv.reader(responses_csv_file)
+
+                # Skip header row
+                next(csv_reader)
+
+                for row in csv_reader:
+                    result = PermalinkResult.from_row(row)
+
+                    if result.permalink_id in permalink_ids:
+                        print(f"Permalink Id {result.permalink_id} appears in more than one shard, keeping both rows")
+
+                    permalink_ids.add(result.permalink_id)
+                    output_writer.writerow(result.to_row())
+                    journal_file.write(f"{result.permalink_id}\n")
+                    result.record_latency(latency_report)
+
+            # saved table html, either as separate files or in an archive
+            for filename in os.listdir(shard_dir):
+                if filename.endswith(".html"):
+                    shutil.copy2(os.path.join(shard_dir, filename), os.path.join(output_dir, filename))
+
+            if os.path.exists(os.path.join(shard_dir, INDEX_FILENAME)):
+                table_archive = table_archive or TableArchiveWriter(output_dir)
+                shard_archive = TableArchiveReader(shard_dir)
+                for permalink_id in shard_archive.entries:
+                    table_archive.add(permalink_id, shard_archive.read(permalink_id))
+
+    if table_archive:
+        table_archive.close()
+
+    merge_row_groups(output_dir, shard_dirs)
+
+    latency_report_json = os.path.join(output_dir, "latency_report.json")
+    latency_report.write_json(latency_report_json)
+
+    print(
+        f"Merged {len(permalink_ids)} permalinks from {len(shard_dirs)} shards into {output_dir}. "
+        f"Response times: {latency_report.summary()}"
+    )
+
+
+def read_permalinks_csv() -> list[list[str]]:
+    with open("permalinks.csv", "r") as permalinks_csv_file:
+        csv_reader = csv.reader(permalinks_csv_file)
+
+        # Skip header row
+        next(csv_reader)
+
+        return list(csv_reader)
 
 
 if __name__ == "__main__":
@@ -252,6 +963,14 @@ if __name__ == "__main__":
         action=argparse.BooleanOptionalAction,
     )
 
+    ap.add_argument(
+        "--archive",
+        dest="archive_content",
+        default=False,
+        help="Save the permalink table html to a compressed archive in the responses directory instead of separate files",
+        action=argparse.BooleanOptionalAction,
+    )
+
     ap.add_argument(
         "--sleep",
         dest="sleep",
@@ -272,9 +991,212 @@ if __name__ == "__main__":
         required=False,
     )
 
-    args = ap.parse_args()
+    ap.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        default=1,
+        nargs="?",
+        help="Number of permalink requests to make concurrently",
+        type=int,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--adaptive-rate",
+        dest="adaptive_rate",
+        default=False,
+        help="Adjust the request rate based on response times and failures instead of sleeping between requests",
+        action=argparse.BooleanOptionalAction,
+    )
 
-    permalink_fetcher = PermalinkFetcher(
-        env=args.env, save_content=args.save_content, sleep=args.sleep, timeout=args.timeout
+    ap.add_argument(
+        "--target-p95",
+        dest="target_p95",
+        default=10.0,
+        nargs="?",
+        help="Target p95 response time in number of seconds when using an adaptive request rate",
+        type=float,
+        required=False,
     )
-    permalink_fetcher.main()
+
+    ap.add_argument(
+        "--max-rate",
+        dest="max_rate",
+        default=10.0,
+        nargs="?",
+        help="Maximum number of requests per second when using an adaptive request rate",
+        type=float,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--resume",
+        dest="resume_results_dir",
+        default=None,
+        help="Resume an interrupted run, skipping permalinks already recorded in the given responses directory",
+        type=str,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--normalise-processes",
+        dest="normalise_processes",
+        default=0,
+        nargs="?",
+        help="Number of processes to extract and normalise table html in. By default tables are extracted as they are downloaded",
+        type=int,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=None,
+        help="Directory of cached responses shared between runs, used to make conditional requests",
+        type=str,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--changed-since",
+        dest="changed_since",
+        default=None,
+        help="Only request permalinks created on or after this date (YYYY-MM-DD)",
+        type=date.fromisoformat,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--shard",
+        dest="shard",
+        default=None,
+        help="Only fetch the permalinks in shard i of N, e.g. 0/4, to split a sweep between machines",
+        type=parse_shard,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--columnar",
+        dest="columnar",
+        default=False,
+        help="Also write the results as typed columns for analysis with timing_utils/analyse_runs.py",
+        action=argparse.BooleanOptionalAction,
+    )
+
+    ap.add_argument(
+        "--repeat",
+        dest="repeat",
+        default=1,
+        nargs="?",
+        help="Number of times to request each permalink, to compare cold and warm response times",
+        type=int,
+        required=False,
+    )
+
+    ap.add_argument(
+        "--repeat-gap",
+        dest="repeat_gap",
+        default=0.0,
+        nargs="?",
+        help="Delay between the repeats of a permalink request in number of seconds",
+        type=float,
+        required=False,
+    )
+
+    subparsers = ap.add_subparsers(
+        dest="command", title="commands", description="Run without a command to make permalink requests"
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare the table html saved by two runs cell by cell, using a pool of processes"
+    )
+    compare_parser.add_argument("results_dir_a", help="The responses directory of the first run", type=str)
+    compare_parser.add_argument("results_dir_b", help="The responses directory of the second run", type=str)
+    compare_parser.add_argument(
+        "--output",
+        dest="report_file",
+        default="comparison.csv",
+        help="The CSV file to write the comparison report to",
+        type=str,
+        required=False,
+    )
+    compare_parser.add_argument(
+        "--processes",
+        dest="processes",
+        default=None,
+        help="Number of processes to compare tables with. Defaults to the number of CPUs",
+        type=int,
+        required=False,
+    )
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Merge the responses directories of a sweep split into shards into one responses directory"
+    )
+    merge_parser.add_argument("output_dir", help="The responses directory to create", type=str)
+    merge_parser.add_argument("shard_dirs", help="The responses directories of the shards", nargs="+", type=str)
+
+    ab_parser = subparsers.add_parser(
+        "ab",
+        help="Fetch each permalink from two environments together and compare their response times",
+    )
+    ab_parser.add_argument(
+        "env_a", choices=list(PermalinkFetcher.PUBLIC_URLS), help="The baseline environment", type=str
+    )
+    ab_parser.add_argument(
+        "env_b", choices=list(PermalinkFetcher.PUBLIC_URLS), help="The environment to compare with", type=str
+    )
+    ab_parser.add_argument(
+        "--resamples",
+        dest="resamples",
+        default=10_000,
+        help="Number of bootstrap resamples used to find the confidence interval of the median response time ratio",
+        type=int,
+        required=False,
+    )
+
+    args = ap.parse_args()
+
+    if args.command == "compare":
+        compare_runs(args.results_dir_a, args.results_dir_b, args.report_file, args.processes)
+    elif args.command == "merge":
+        merge_runs(args.output_dir, args.shard_dirs)
+    elif args.command == "ab":
+        permalink_ab_fetcher = PermalinkAbFetcher(
+            env_a=args.env_a,
+            env_b=args.env_b,
+            sleep=args.sleep,
+            timeout=args.timeout,
+            concurrency=args.concurrency,
+            resamples=args.resamples,
+        )
+        permalink_ab_fetcher.main()
+    else:
+        if args.resume_results_dir and not os.path.isdir(args.resume_results_dir):
+            ap.error(f"Responses directory {args.resume_results_dir} does not exist")
+
+        rate_controller = None
+        if args.adaptive_rate:
+            # start from the rate implied by the sleep option and adjust from there
+            initial_rate = 1 / args.sleep if args.sleep > 0 else args.max_rate
+            rate_controller = AimdRateController(
+                initial_rate=initial_rate, max_rate=args.max_rate, target_p95=args.target_p95
+            )
+
+        permalink_fetcher = PermalinkFetcher(
+            env=args.env,
+            save_content=args.save_content,
+            sleep=args.sleep,
+            timeout=args.timeout,
+            concurrency=args.concurrency,
+            rate_controller=rate_controller,
+            resume_results_dir=args.resume_results_dir,
+            archive_content=args.archive_content,
+            normalise_processes=args.normalise_processes,
+            cache_dir=args.cache_dir,
+            changed_since=args.changed_since,
+            shard=args.shard,
+            columnar=args.columnar,
+            repeat=args.repeat,
+            repeat_gap=args.repeat_gap,
+        )
+        permalink_fetcher.main()
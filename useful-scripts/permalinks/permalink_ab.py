@@ -0,0 +1,102 @@
+import json
+from dataclasses import dataclass
+
+import numpy as np
+
+"""
+Statistics for the A/B mode of `fetch_permalinks.py`, which requests each permalink from two environments together.
+
+As both environments are measured at the same time, under the same load, each permalink's ratio of response times
+(environment B / environment A) is a fair comparison. The run is summarised by the median ratio, with a confidence
+interval found by bootstrap resampling of the ratios. If the interval doesn't include 1, the difference between the
+environments is statistically significant. The summary also records each environment's overall latency percentiles,
+from its `LatencyReport`.
+"""
+
+AB_HEADERS = [
+    "permalink_id",
+    "first_env",
+    "http_status_code_a",
+    "http_status_code_b",
+    "response_time_a",
+    "response_time_b",
+    "response_time_ratio",
+    "content_length_a",
+    "content_length_b",
+]
+
+
+@dataclass
+class AbSummary:
+    env_a: str
+    env_b: str
+    paired_count: int
+    median_ratio: float | None = None
+    ci_low: float | None = None
+    ci_high: float | None = None
+    confidence: float = 0.95
+    latency_a: dict | None = None
+    latency_b: dict | None = None
+
+    def verdict(self) -> str:
+        if self.median_ratio is None:
+            return "No permalinks were fetched successfully from both environments"
+
+        interval = f"{self.confidence:.0%} CI {self.ci_low:.3f} - {self.ci_high:.3f}"
+
+        if self.ci_low > 1:
+            return f"{self.env_b} is significantly slower than {self.env_a} (median ratio {self.median_ratio:.3f}, {interval})"
+        elif self.ci_high < 1:
+            return f"{self.env_b} is significantly faster than {self.env_a} (median ratio {self.median_ratio:.3f}, {interval})"
+        else:
+            return (
+                f"No significant difference between {self.env_a} and {self.env_b} "
+                f"(median ratio {self.median_ratio:.3f}, {interval})"
+            )
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as summary_file:
+            json.dump({**self.__dict__, "verdict": self.verdict()}, summary_file, indent=2)
+
+
+def median_ratio_ci(
+    ratios: list[float], resamples: int = 10_000, confidence: float = 0.95, seed: int | None = None
+) -> tuple[float, float, float]:
+    """
+    Return the median of the ratios along with the bounds of its bootstrap confidence interval.
+    """
+    ratios = np.asarray(ratios)
+    rng = np.random.default_rng(seed)
+    medians = np.empty(resamples)
+
+    # resample in batches so that the matrix of resampled ratios stays small with tens of thousands of permalinks
+    batch_size = max(1_000_000 // len(ratios), 1)
+
+    for start in range(0, resamples, batch_size):
+        size = min(batch_size, resamples - start)
+        samples = ratios[rng.integers(0, len(ratios), size=(size, len(ratios)))]
+        medians[start : start + size] = np.median(samples, axis=1)
+
+    tail = (1 - confidence) / 2
+    ci_low, ci_high = np.quantile(medians, [tail, 1 - tail])
+
+    return float(np.median(ratios)), float(ci_low), float(ci_high)
+
+
+def summarise_ab(
+    env_a: str,
+    env_b: str,
+    ratios: list[float],
+    resamples: int = 10_000,
+    confidence: float = 0.95,
+    latency_a: dict | None = None,
+    latency_b: dict | None = None,
+) -> AbSummary:
+    summary = AbSummary(
+        env_a, env_b, paired_count=len(ratios), confidence=confidence, latency_a=latency_a, latency_b=latency_b
+    )
+
+    if ratios:
+        summary.median_ratio, summary.ci_low, summary.ci_high = median_ratio_ci(ratios, resamples, confidence)
+
+    return summary
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import hashlib
+import os
+import threading
+import zlib
+from dataclasses import dataclass
+
+"""
+A content-addressed archive of the permalink table html saved by `fetch_permalinks.py`.
+
+Instead of one html file per permalink, an archive is made up of two files in the responses directory:
+
+* 'tables.pack' contains each distinct table html once, compressed with zlib, one entry after another.
+* 'tables_index.csv' maps each permalink Id to the SHA-256 hash of its table html and the position of the compressed
+  html in the pack.
+
+Many permalinks share exactly the same table, both within a run and between runs, so this uses a fraction of the disk
+space and a single pair of files rather than tens of thousands. As the index records the content hash of each table,
+comparing two runs is a matter of comparing their indexes.
+
+Usage:
+
+List the permalinks in an archive along with the content hash of their table:
+`pipenv run python permalink_archive.py list responses_prod_20240101_090000`
+
+Extract the tables of all or some of the permalinks in an archive to html files, as saved without an archive:
+`pipenv run python permalink_archive.py extract responses_prod_20240101_090000 --output-dir tables [PERMALINK_ID ...]`
+"""
+
+PACK_FILENAME = "tables.pack"
+INDEX_FILENAME = "tables_index.csv"
+INDEX_HEADERS = ["permalink_id", "content_hash", "offset", "compressed_length"]
+
+
+@dataclass(frozen=True)
+class ArchiveEntry:
+    content_hash: str
+    offset: int
+    compressed_length: int
+
+
+def _read_index(index_file: str) -> dict[str, ArchiveEntry]:
+    entries: dict[str, ArchiveEntry] = {}
+
+    with open(index_file, "r", newline="") as index_csv_file:
+        csv_reader = csv.reader(index_csv_file)
+
+        # Skip header row
+        next(csv_reader)
+
+        for row in csv_reader:
+            # a permalink which was fetched again after resuming a run appears twice, the latest entry wins
+            permalink_id, content_hash, offset, compressed_length = row
+            entries[permalink_id] = ArchiveEntry(content_hash, int(offset), int(compressed_length))
+
+    return entries
+
+
+class TableArchiveWriter:
+    def __init__(self, archive_dir: str, compression_level: int = 6):
+        self.compression_level = compression_level
+        self._pack_file_path = os.path.join(archive_dir, PACK_FILENAME)
+        self._index_file_path = os.path.join(archive_dir, INDEX_FILENAME)
+        self._lock = threading.Lock()
+
+        # when adding to an existing archive, e.g. when resuming a run, carry on de-duplicating against its content
+        self._entries_by_hash: dict[str, ArchiveEntry] = {}
+        resuming = os.path.exists(self._index_file_path)
+        if resuming:
+            for entry in _read_index(self._index_file_path).values():
+                self._entries_by_hash[entry.content_hash] = entry
+
+        self._pack_file = open(self._pack_file_path, "ab")
+        self._index_file = open(self._index_file_path, "a", newline="")
+        self._index_writer = csv.writer(self._index_file)
+
+        if not resuming:
+            self._index_writer.writerow(INDEX_HEADERS)
+            self._index_file.flush()
+
+    def add(self, permalink_id: str, html: str) -> str:
+        content = html.encode("utf-8")
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        # tables are saved from several fetch workers at once
+        with self._lock:
+            entry = self._entries_by_hash.get(content_hash)
+
+            if entry is None:
+                compressed = zlib.compress(content, self.compression_level)
+                entry = ArchiveEntry(content_hash, self._pack_file.tell(), len(compressed))
+                self._pack_file.write(compressed)
+                self._pack_file.flush()
+                self._entries_by_hash[content_hash] = entry
+
+            # only index the permalink once its content is safely in the pack
+            self._index_writer.writerow([permalink_id, entry.content_hash, entry.offset, entry.compressed_length])
+            self._index_file.flush()
+
+        return content_hash
+
+    def close(self) -> None:
+        self._pack_file.close()
+        self._index_file.close()
+
+    def __enter__(self) -> "TableArchiveWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class TableArchiveReader:
+    def __init__(self, archive_dir: str):
+        self._pack_file_path = os.path.join(archive_dir, PACK_FILENAME)
+        self.entries = _read_index(os.path.join(archive_dir, INDEX_FILENAME))
+
+    def content_hashes(self) -> dict[str, str]:
+        return {permalink_id: entry.content_hash for permalink_id, entry in self.entries.items()}
+
+    def read(self, permalink_id: str) -> str:
+        entry = self.entries[permalink_id]
+
+        with open(self._pack_file_path, "rb") as pack_file:
+            pack_file.seek(entry.offset)
+            content = zlib.decompress(pack_file.read(entry.compressed_length))
+
+        if hashlib.sha256(content).hexdigest() != entry.content_hash:
+            raise ValueError(f"Table for permalink Id {permalink_id} does not match its content hash")
+
+        return content.decode("utf-8")
+
+    def extract(self, output_dir: str, permalink_ids: list[str] | None = None) -> int:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        permalink_ids = permalink_ids or list(self.entries)
+
+        for permalink_id in permalink_ids:
+            with open(os.path.join(output_dir, f"{permalink_id}.html"), "w", encoding="utf-8") as output_file:
+                output_file.write(self.read(permalink_id))
+
+        return len(permalink_ids)
+
+
+def _list(args: argparse.Namespace) -> None:
+    reader = TableArchiveReader(args.archive_dir)
+
+    for permalink_id, content_hash in reader.content_hashes().items():
+        print(f"{permalink_id},{content_hash}")
+
+    distinct_tables = len(set(reader.content_hashes().values()))
+    print(f"{len(reader.entries)} permalinks, {distinct_tables} distinct tables")
+
+
+def _extract(args: argparse.Namespace) -> None:
+    reader = TableArchiveReader(args.archive_dir)
+    extracted = reader.extract(args.output_dir, args.permalink_ids)
+    print(f"Extracted {extracted} tables to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        prog=f"pipenv run python {os.path.basename(__file__)}",
+        description="List or extract the permalink table html in an archive written by fetch_permalinks.py.",
+    )
+    subparsers = ap.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List the permalinks in an archive and their content hashes")
+    list_parser.add_argument("archive_dir", help="The responses directory containing the archive", type=str)
+    list_parser.set_defaults(func=_list)
+
+    extract_parser = subparsers.add_parser("extract", help="Extract table html files from an archive")
+    extract_parser.add_argument("archive_dir", help="The responses directory containing the archive", type=str)
+    extract_parser.add_argument(
+        "permalink_ids", help="The permalinks to extract. Extracts all permalinks if omitted", nargs="*", type=str
+    )
+    extract_parser.add_argument(
+        "--output-dir",
+        dest="output_dir",
+        default="tables",
+        help="The directory to extract the table html files to",
+        type=str,
+        required=False,
+    )
+    extract_parser.set_defaults(func=_extract)
+
+    args = ap.parse_args()
+    args.func(args)
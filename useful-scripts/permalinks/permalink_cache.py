@@ -0,0 +1,140 @@
+import csv
+import os
+import threading
+from dataclasses import dataclass
+
+from permalink_archive import INDEX_FILENAME, TableArchiveReader, TableArchiveWriter
+
+"""
+An on-disk cache of permalink responses, shared between runs of `fetch_permalinks.py`.
+
+Permalinks are snapshots which don't change once they have been created, so there is little point downloading and
+parsing each of them in full on every run. The cache directory contains:
+
+* 'permalink_cache.csv', recording the ETag and Last-Modified headers of each permalink's last full response, along
+  with the SHA-256 hash of its body and how it was classified, i.e. its status code and whether it had a table error.
+* a table archive (see `permalink_archive.py`) of each permalink's table html, so that the table can still be saved
+  when a permalink hasn't been downloaded again.
+
+Later runs send the cached headers as `If-None-Match` and `If-Modified-Since`, and reuse the cached result whenever
+the response is 304 Not Modified.
+"""
+
+CACHE_FILENAME = "permalink_cache.csv"
+CACHE_HEADERS = [
+    "permalink_id",
+    "etag",
+    "last_modified",
+    "content_hash",
+    "status_code",
+    "table_error",
+    "content_length",
+]
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    permalink_id: str
+    etag: str | None
+    last_modified: str | None
+    content_hash: str
+    status_code: int
+    table_error: bool
+    content_length: int
+
+
+def _read_entries(cache_file: str) -> dict[str, CacheEntry]:
+    entries: dict[str, CacheEntry] = {}
+
+    with open(cache_file, "r", newline="") as cache_csv_file:
+        csv_reader = csv.reader(cache_csv_file)
+
+        # Skip header row
+        next(csv_reader)
+
+        for row in csv_reader:
+            # a permalink which has been fetched in full again appears twice, the latest entry wins
+            permalink_id, etag, last_modified, content_hash, status_code, table_error, content_length = row
+            entries[permalink_id] = CacheEntry(
+                permalink_id,
+                etag or None,
+                last_modified or None,
+                content_hash,
+                int(status_code),
+                table_error == "True",
+                int(content_length),
+            )
+
+    return entries
+
+
+class PermalinkCache:
+    def __init__(self, cache_dir: str):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._cache_file_path = os.path.join(cache_dir, CACHE_FILENAME)
+        self._lock = threading.Lock()
+
+        resuming = os.path.exists(self._cache_file_path)
+        self.entries = _read_entries(self._cache_file_path) if resuming else {}
+
+        # tables cached by previous runs, tables added during this run are only written
+        self._table_reader = (
+            TableArchiveReader(cache_dir) if os.path.exists(os.path.join(cache_dir, INDEX_FILENAME)) else None
+        )
+        self._table_writer = TableArchiveWriter(cache_dir)
+
+        self._cache_file = open(self._cache_file_path, "a", newline="")
+        self._cache_writer = csv.writer(self._cache_file)
+
+        if not resuming:
+            self._cache_writer.writerow(CACHE_HEADERS)
+            self._cache_file.flush()
+
+    def conditional_headers(self, permalink_id: str, table_needed: bool) -> dict[str, str]:
+        entry = self.entries.get(permalink_id)
+
+        # a cached result is no use if its table is needed but wasn't cached, so fetch the permalink in full
+        if entry is None or (table_needed and not entry.table_error and not self.has_table(permalink_id)):
+            return {}
+
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+        return headers
+
+    def has_table(self, permalink_id: str) -> bool:
+        return self._table_reader is not None and permalink_id in self._table_reader.entries
+
+    def table(self, permalink_id: str) -> str | None:
+        if not self.has_table(permalink_id):
+            return None
+
+        return self._table_reader.read(permalink_id)
+
+    def add(self, entry: CacheEntry) -> None:
+        with self._lock:
+            self._cache_writer.writerow(
+                [
+                    entry.permalink_id,
+                    entry.etag or "",
+                    entry.last_modified or "",
+                    entry.content_hash,
+                    entry.status_code,
+                    entry.table_error,
+                    entry.content_length,
+                ]
+            )
+            self._cache_file.flush()
+            self.entries[entry.permalink_id] = entry
+
+    def add_table(self, permalink_id: str, html: str) -> None:
+        self._table_writer.add(permalink_id, html)
+
+    def close(self) -> None:
+        self._cache_file.close()
+        self._table_writer.close()
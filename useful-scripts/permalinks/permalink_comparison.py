@@ -0,0 +1,232 @@
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from bs4 import BeautifulSoup
+from permalink_archive import INDEX_FILENAME, TableArchiveReader
+
+"""
+Comparison of the permalink tables saved by two runs of `fetch_permalinks.py`.
+
+Each permalink saved by both runs is compared in a pool of worker processes. Tables with identical html are skipped
+without being parsed. Otherwise the caption, header cells, body cells and footnotes of the two tables are compared
+position by position, so the report says how much of a table changed as well as that it changed.
+
+The report also includes each permalink's response time in both runs, and the difference between them.
+"""
+
+REPORT_HEADERS = [
+    "permalink_id",
+    "status",
+    "caption_changed",
+    "header_cells_changed",
+    "body_cells_changed",
+    "footnotes_changed",
+    "response_time_a",
+    "response_time_b",
+    "response_time_delta",
+]
+
+
+@dataclass
+class TableContent:
+    caption: str
+    header_rows: list[list[str]]
+    body_rows: list[list[str]]
+    footnotes: list[str]
+
+
+@dataclass
+class TableComparison:
+    permalink_id: str
+    status: str
+    caption_changed: bool = False
+    header_cells_changed: int = 0
+    body_cells_changed: int = 0
+    footnotes_changed: int = 0
+
+
+class SavedTables:
+    """
+    The tables saved by a run, either as separate html files or in an archive.
+    """
+
+    def __init__(self, results_dir: str):
+        self.results_dir = results_dir
+        self._archive = (
+            TableArchiveReader(results_dir) if os.path.exists(os.path.join(results_dir, INDEX_FILENAME)) else None
+        )
+
+    def permalink_ids(self) -> set[str]:
+        if self._archive:
+            return set(self._archive.entries)
+
+        return {filename[:-5] for filename in os.listdir(self.results_dir) if filename.endswith(".html")}
+
+    def content_hash(self, permalink_id: str) -> str | None:
+        return self._archive.entries[permalink_id].content_hash if self._archive else None
+
+    def read(self, permalink_id: str) -> str:
+        if self._archive:
+            return self._archive.read(permalink_id)
+
+        with open(os.path.join(self.results_dir, f"{permalink_id}.html"), "r", encoding="utf-8") as table_file:
+            return table_file.read()
+
+
+# the saved tables of the two runs, loaded once in each worker process
+_worker_tables: tuple[SavedTables, SavedTables] | None = None
+
+
+def _init_worker(results_dir_a: str, results_dir_b: str) -> None:
+    global _worker_tables
+    _worker_tables = (SavedTables(results_dir_a), SavedTables(results_dir_b))
+
+
+def _compare_permalink(permalink_id: str) -> TableComparison:
+    tables_a, tables_b = _worker_tables
+
+    content_hash_a = tables_a.content_hash(permalink_id)
+    if content_hash_a is not None and content_hash_a == tables_b.content_hash(permalink_id):
+        return TableComparison(permalink_id, "unchanged")
+
+    html_a = tables_a.read(permalink_id)
+    html_b = tables_b.read(permalink_id)
+
+    if html_a == html_b:
+        return TableComparison(permalink_id, "unchanged")
+
+    content_a = parse_table_content(html_a)
+    content_b = parse_table_content(html_b)
+
+    comparison = TableComparison(
+        permalink_id,
+        "changed",
+        caption_changed=content_a.caption != content_b.caption,
+        header_cells_changed=_count_changed_cells(content_a.header_rows, content_b.header_rows),
+        body_cells_changed=_count_changed_cells(content_a.body_rows, content_b.body_rows),
+        footnotes_changed=_count_changed_cells([content_a.footnotes], [content_b.footnotes]),
+    )
+
+    # the html differs but none of the table's content does, e.g. only styling classes have changed
+    if not (
+        comparison.caption_changed
+        or comparison.header_cells_changed
+        or comparison.body_cells_changed
+        or comparison.footnotes_changed
+    ):
+        comparison.status = "markup_changed"
+
+    return comparison
+
+
+def parse_table_content(html: str) -> TableContent:
+    soup = BeautifulSoup(html, "lxml")
+    table = soup.find("table")
+
+    caption = soup.find("figcaption")
+    header_rows = []
+    body_rows = []
+
+    if table is not None:
+        for row in table.find_all("tr"):
+            cells = [cell.get_text(" ", strip=True) for cell in row.find_all(["th", "td"])]
+            if row.find_parent("thead") is not None:
+                header_rows.append(cells)
+            else:
+                body_rows.append(cells)
+
+    # the footnotes are in a list alongside the table figure
+    footnotes = [item.get_text(" ", strip=True) for item in soup.find_all("li") if item.find_parent("table") is None]
+
+    return TableContent(
+        caption=caption.get_text(" ", strip=True) if caption else "",
+        header_rows=header_rows,
+        body_rows=body_rows,
+        footnotes=footnotes,
+    )
+
+
+def _count_changed_cells(rows_a: list[list[str]], rows_b: list[list[str]]) -> int:
+    changed = 0
+
+    for row_index in range(max(len(rows_a), len(rows_b))):
+        row_a = rows_a[row_index] if row_index < len(rows_a) else []
+        row_b = rows_b[row_index] if row_index < len(rows_b) else []
+
+        for cell_index in range(max(len(row_a), len(row_b))):
+            cell_a = row_a[cell_index] if cell_index < len(row_a) else None
+            cell_b = row_b[cell_index] if cell_index < len(row_b) else None
+            if cell_a != cell_b:
+                changed += 1
+
+    return changed
+
+
+def _read_response_times(results_dir: str) -> dict[str, float | None]:
+    response_times: dict[str, float | None] = {}
+    responses_csv = os.path.join(results_dir, "responses.csv")
+
+    if not os.path.exists(responses_csv):
+        return response_times
+
+    with open(responses_csv, "r", newline="") as responses_csv_file:
+        for row in csv.DictReader(responses_csv_file):
+            response_time = row["response_time"]
+            response_times[row["permalink_id"]] = float(response_time) if response_time else None
+
+    return response_times
+
+
+def compare_runs(results_dir_a: str, results_dir_b: str, report_file: str, processes: int | None = None) -> None:
+    permalink_ids_a = SavedTables(results_dir_a).permalink_ids()
+    permalink_ids_b = SavedTables(results_dir_b).permalink_ids()
+    paired_permalink_ids = sorted(permalink_ids_a & permalink_ids_b)
+
+    response_times_a = _read_response_times(results_dir_a)
+    response_times_b = _read_response_times(results_dir_b)
+
+    print(f"Comparing {len(paired_permalink_ids)} permalink tables saved by both {results_dir_a} and {results_dir_b}")
+
+    comparisons = [TableComparison(permalink_id, "only_in_a") for permalink_id in permalink_ids_a - permalink_ids_b]
+    comparisons += [TableComparison(permalink_id, "only_in_b") for permalink_id in permalink_ids_b - permalink_ids_a]
+
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker, initargs=(results_dir_a, results_dir_b)
+    ) as executor:
+        comparisons += executor.map(_compare_permalink, paired_permalink_ids, chunksize=64)
+
+    with open(report_file, "w", newline="") as output_file:
+        output_writer = csv.writer(output_file)
+        output_writer.writerow(REPORT_HEADERS)
+
+        for comparison in sorted(comparisons, key=lambda c: c.permalink_id):
+            response_time_a = response_times_a.get(comparison.permalink_id)
+            response_time_b = response_times_b.get(comparison.permalink_id)
+            response_time_delta = (
+                response_time_b - response_time_a
+                if response_time_a is not None and response_time_b is not None
+                else None
+            )
+
+            output_writer.writerow(
+                [
+                    comparison.permalink_id,
+                    comparison.status,
+                    comparison.caption_changed,
+                    comparison.header_cells_changed,
+                    comparison.body_cells_changed,
+                    comparison.footnotes_changed,
+                    "" if response_time_a is None else f"{response_time_a:.2f}",
+                    "" if response_time_b is None else f"{response_time_b:.2f}",
+                    "" if response_time_delta is None else f"{response_time_delta:.2f}",
+                ]
+            )
+
+    statuses = [comparison.status for comparison in comparisons]
+    print(
+        f"{statuses.count('changed')} tables changed, {statuses.count('markup_changed')} changed markup only, "
+        f"{statuses.count('unchanged')} unchanged, {statuses.count('only_in_a')} only in {results_dir_a}, "
+        f"{statuses.count('only_in_b')} only in {results_dir_b}. Report written to {report_file}"
+    )
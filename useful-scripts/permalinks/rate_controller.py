@@ -0,0 +1,119 @@
+import asyncio
+import math
+import time
+
+"""
+Adaptive request rate control for the permalink scripts.
+
+Rather than sleeping for a fixed amount of time between requests, `AimdRateController` spaces requests out at a rate
+which is adjusted using additive-increase / multiplicative-decrease (AIMD) based on the responses being observed:
+
+* after every window of responses whose p95 latency is within the target budget and whose failure rate is acceptable,
+  the rate is increased by a fixed step.
+* as soon as a window's p95 latency exceeds the target budget, or a request times out or returns a 5xx status,
+  the rate is multiplied by the decrease factor.
+
+The requests still in flight when the rate is decreased were sent at the old rate, and a slow period will often time
+out several of them at once. So, as in TCP congestion control, the outcomes of requests sent before the last decrease
+are ignored, and the rate is decreased at most once for each round of requests in flight.
+
+The rate is always kept between the minimum and maximum rates.
+"""
+
+
+class AimdRateController:
+    def __init__(
+        self,
+        initial_rate: float,
+        max_rate: float,
+        target_p95: float,
+        min_rate: float = 0.05,
+        increase_step: float = 0.25,
+        decrease_factor: float = 0.5,
+        window_size: int = 10,
+        max_failure_rate: float = 0.0,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.rate = min(max(initial_rate, min_rate), max_rate)
+        self.target_p95 = target_p95
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.window_size = window_size
+        self.max_failure_rate = max_failure_rate
+        self.lowest_rate = self.rate
+        self.highest_rate = self.rate
+        self._next_request_time = 0.0
+        self._window_latencies: list[float] = []
+        self._window_requests = 0
+        self._window_failures = 0
+        self._last_decrease_time = -math.inf
+
+    async def wait(self) -> float:
+        """
+        Wait until the next request is permitted by the current rate, returning the time it is sent at, to be passed
+        to `record` with its outcome.
+        """
+        now = time.monotonic()
+        request_time = max(now, self._next_request_time)
+        self._next_request_time = request_time + 1 / self.rate
+        await asyncio.sleep(request_time - now)
+        return request_time
+
+    def record(self, latency: float | None, failed: bool, sent_at: float) -> None:
+        """
+        Record the outcome of a request sent at the time returned by `wait`, adjusting the rate if the outcome
+        completes a window or indicates that the server is struggling.
+        """
+        if sent_at < self._last_decrease_time:
+            # sent at the rate before the last decrease, which has already been backed off from
+            return
+
+        self._window_requests += 1
+
+        if latency is not None:
+            self._window_latencies.append(latency)
+
+        if failed:
+            self._window_failures += 1
+
+            # back off straight away rather than waiting for the window to fill up,
+            # as there will be more requests in flight that are likely to fail too
+            if self._window_failures / self._window_requests > self.max_failure_rate:
+                self._adjust(self.rate * self.decrease_factor, "request failed")
+                return
+
+        if self._window_requests < self.window_size:
+            return
+
+        p95 = self._percentile(self._window_latencies, 95)
+
+        if p95 is not None and p95 > self.target_p95:
+            self._adjust(self.rate * self.decrease_factor, f"p95 latency {p95:.2f}s over {self.target_p95:.2f}s")
+        else:
+            self._adjust(self.rate + self.increase_step, "p95 latency within target")
+
+    def _adjust(self, rate: float, reason: str) -> None:
+        previous_rate = self.rate
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+
+        if rate < previous_rate:
+            self._last_decrease_time = time.monotonic()
+        self.lowest_rate = min(self.lowest_rate, self.rate)
+        self.highest_rate = max(self.highest_rate, self.rate)
+
+        self._window_latencies = []
+        self._window_requests = 0
+        self._window_failures = 0
+
+        if self.rate != previous_rate:
+            print(f"Adjusted request rate from {previous_rate:.2f} to {self.rate:.2f} requests/second ({reason})")
+
+    @staticmethod
+    def _percentile(values: list[float], percentile: float) -> float | None:
+        if not values:
+            return None
+
+        sorted_values = sorted(values)
+        index = math.ceil(percentile / 100 * len(sorted_values)) - 1
+        return sorted_values[max(index, 0)]
@@ -0,0 +1,204 @@
+import time
+from dataclasses import dataclass
+
+from lxml import etree
+
+"""
+Incremental extraction of the data table from a permalink page.
+
+Permalink pages can be several megabytes, most of which is the table itself and the page data embedded in the
+`__NEXT_DATA__` script at the end of the body. Rather than building a BeautifulSoup tree for the whole page,
+`PermalinkTableExtractor` is fed the response body a chunk at a time and acts as the target of lxml's html parser,
+so no tree is built at all. It notes whether the page has a table error and serialises the parent of the table figure
+directly from the parser events. Nothing is kept once the table parent has been serialised, so the page data after
+the table is never held in memory.
+
+Until the figure is reached, any of the open elements could turn out to be the table parent, and an element which
+has already closed could be a sibling of the figure within it, e.g. a heading above the table. So the part of the page
+before the table is kept until the table parent is known, for the table parent to include everything that
+BeautifulSoup's would.
+
+The table parent is serialised with its tag attributes sorted alphabetically, producing exactly the same html as
+`str()` of the equivalent BeautifulSoup tag. BeautifulSoup receives the same lxml parser events, so only its output
+formatting needs to be reproduced:
+
+* text and attribute values have `&`, `<` and `>` escaped, except for text inside `script` and `style` tags.
+* attribute values are double quoted, unless they contain double quotes but no single quotes.
+* whitespace separated attributes such as `class` have their whitespace collapsed.
+* void elements such as `br` are closed with `/>`.
+
+The time spent parsing is recorded, so that it can be told apart from the time spent downloading the page.
+
+`extract_table` does the same for a page which has already been downloaded, so that it can be run in another process.
+"""
+
+
+@dataclass(frozen=True)
+class ExtractedTable:
+    table_error: bool
+    table_parent_html: str | None
+    table_parent_tag: str | None
+    parse_time: float
+
+
+def extract_table(content: bytes, encoding: str | None) -> ExtractedTable:
+    extractor = PermalinkTableExtractor(encoding=encoding)
+    extractor.feed(content)
+    return extractor.finish()
+
+
+class PermalinkTableExtractor:
+    TABLE_FIGURE_CLASS_PREFIX = "FixedMultiHeaderDataTable"
+
+    # the formatting rules used by BeautifulSoup's html tree builder and "minimal" formatter
+    VOID_ELEMENTS = {
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+        "basefont",
+        "bgsound",
+        "command",
+        "frame",
+        "image",
+        "isindex",
+        "nextid",
+        "spacer",
+    }
+    CDATA_CONTAINING_TAGS = {"script", "style"}
+    MULTI_VALUED_ATTRIBUTES = {
+        "*": {"class", "accesskey", "dropzone"},
+        "a": {"rel", "rev"},
+        "link": {"rel", "rev"},
+        "td": {"headers"},
+        "th": {"headers"},
+        "form": {"accept-charset"},
+        "object": {"archive"},
+        "area": {"rel"},
+        "icon": {"sizes"},
+        "iframe": {"sandbox"},
+        "output": {"for"},
+    }
+
+    def __init__(self, encoding: str | None = None):
+        self.table_error = False
+        self.table_parent_html: str | None = None
+        self.table_parent_tag: str | None = None
+        # the open elements as (tag, index of their start tag in the serialised parts)
+        self._open_elements: list[tuple[str, int]] = []
+        self._parts: list[str] = []
+        self._table_parent_depth: int | None = None
+        self.parse_time = 0.0
+        self._parser = etree.HTMLParser(target=self, encoding=encoding)
+
+    def feed(self, chunk: bytes) -> None:
+        start = time.perf_counter()
+        self._parser.feed(chunk)
+        self.parse_time += time.perf_counter() - start
+
+    def finish(self) -> ExtractedTable:
+        start = time.perf_counter()
+        # lxml raises on closing a parser which has never been fed, so feed it nothing in case the body was empty,
+        # e.g. of a 204 or of a load balancer's 502, which is then a page without a table
+        self._parser.feed(b"")
+        self._parser.close()
+        self.parse_time += time.perf_counter() - start
+        return ExtractedTable(self.table_error, self.table_parent_html, self.table_parent_tag, self.parse_time)
+
+    # lxml parser target interface, see https://lxml.de/parsing.html#the-target-parser-interface
+
+    def start(self, tag: str, attrib: dict[str, str]) -> None:
+        if tag == "div" and attrib.get("data-testid") == "table-error":
+            self.table_error = True
+
+        if self.table_parent_html is not None:
+            return
+
+        if (
+            tag == "figure"
+            and self._table_parent_depth is None
+            and self._open_elements
+            and any(c.startswith(self.TABLE_FIGURE_CLASS_PREFIX) for c in attrib.get("class", "").split())
+        ):
+            self._table_parent_depth = len(self._open_elements) - 1
+            self.table_parent_tag = self._open_elements[-1][0]
+
+        self._open_elements.append((tag, len(self._parts)))
+        self._parts.append(self._start_tag(tag, attrib))
+
+    def end(self, tag: str) -> None:
+        if self.table_parent_html is not None:
+            return
+
+        tag, start_index = self._open_elements.pop()
+
+        if tag in self.VOID_ELEMENTS and len(self._parts) == start_index + 1:
+            self._parts[start_index] = self._parts[start_index][:-1] + "/>"
+        else:
+            self._parts.append(f"</{tag}>")
+
+        if self._table_parent_depth == len(self._open_elements):
+            self._capture_table_parent(start_index)
+
+    def data(self, data: str) -> None:
+        if self.table_parent_html is not None:
+            return
+
+        if self._open_elements and self._open_elements[-1][0] in self.CDATA_CONTAINING_TAGS:
+            self._parts.append(data)
+        else:
+            self._parts.append(self._escape(data))
+
+    def comment(self, text: str) -> None:
+        if self.table_parent_html is None:
+            self._parts.append(f"<!--{text}-->")
+
+    def pi(self, target: str, data: str) -> None:
+        if self.table_parent_html is None:
+            self._parts.append(f"<?{target} {data}>")
+
+    def close(self) -> None:
+        # a truncated page can end before the table parent is closed, in which case take what was parsed of it
+        if self.table_parent_html is None and self._table_parent_depth is not None:
+            while len(self._open_elements) > self._table_parent_depth:
+                self.end(self._open_elements[-1][0])
+
+    def _capture_table_parent(self, start_index: int) -> None:
+        self.table_parent_html = "".join(self._parts[start_index:])
+        self._parts = []
+        self._open_elements = []
+
+    def _start_tag(self, tag: str, attrib: dict[str, str]) -> str:
+        multi_valued_attributes = self.MULTI_VALUED_ATTRIBUTES["*"] | self.MULTI_VALUED_ATTRIBUTES.get(tag, set())
+        attributes = []
+
+        for key, value in sorted(attrib.items()):
+            if key in multi_valued_attributes:
+                value = " ".join(value.split())
+            attributes.append(f" {key}={self._quote_attribute_value(self._escape(value))}")
+
+        return f"<{tag}{''.join(attributes)}>"
+
+    @staticmethod
+    def _escape(text: str) -> str:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+    @staticmethod
+    def _quote_attribute_value(value: str) -> str:
+        if '"' in value:
+            if "'" in value:
+                return '"' + value.replace('"', "&quot;") + '"'
+            return "'" + value + "'"
+        return '"' + value + '"'
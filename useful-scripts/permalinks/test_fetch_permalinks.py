@@ -0,0 +1,220 @@
+import asyncio
+import contextlib
+import csv
+import io
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from bs4 import BeautifulSoup
+from fetch_permalinks import PermalinkFetcher, PermalinkResult, truncate_partial_line
+from permalink_archive import TableArchiveReader
+from permalink_cache import CacheEntry, PermalinkCache
+
+PAGE = (
+    "<html><body><h1>Subject from Publication</h1>"
+    '<div><figure class="FixedMultiHeaderDataTable_figure__abc"><figcaption>Caption</figcaption>'
+    "<table><tbody><tr><th>England</th><td>1\u00a0000</td></tr></tbody></table></figure></div>"
+    "</body></html>"
+).encode("utf-8")
+# a frontend change putting a heading beside the table figure, which has to show up in the saved table
+PAGE_WITH_FIGURE_SIBLING = PAGE.replace(b"<div><figure", b"<div><h2>Before</h2><figure")
+ETAG = '"page-etag"'
+
+
+class PermalinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        page = PAGE_WITH_FIGURE_SIBLING if self.path.endswith("figure-sibling") else PAGE
+
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        # without a Content-Type, and so without a charset, the encoding of the body has to be detected
+        if not self.path.endswith("no-content-type"):
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PermalinkFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), PermalinkHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.fetcher = PermalinkFetcher("local", save_content=False, sleep=0, timeout=10)
+        self.fetcher.public_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.fetcher.cache = PermalinkCache(self.cache_dir.name)
+
+    def tearDown(self):
+        self.fetcher.cache.close()
+        self.cache_dir.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_cached_fetch_uses_cached_result_when_not_modified(self):
+        result, _ = self.fetcher._fetch_permalink("permalink-1")
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(result.table_error)
+
+        self.fetcher.cache.add(
+            CacheEntry(
+                result.permalink_id,
+                result.etag,
+                result.last_modified,
+                result.content_hash,
+                result.status_code,
+                bool(result.table_error),
+                result.content_length,
+            )
+        )
+
+        cached_result, table = self.fetcher._fetch_permalink("permalink-1")
+
+        self.assertIsNone(table)
+        self.assertTrue(cached_result.not_modified)
+        self.assertEqual(cached_result.status_code, 200)
+        self.assertEqual(cached_result.content_length, len(PAGE))
+        self.assertFalse(cached_result.timeout or cached_result.exception or cached_result.connection_error)
+
+    def test_conditional_headers_do_not_read_the_cached_table(self):
+        result = PermalinkResult(permalink_id="permalink-1")
+        table = self.fetcher._get_permalink(result)
+        self.fetcher.cache.add(
+            CacheEntry(
+                result.permalink_id,
+                result.etag,
+                result.last_modified,
+                result.content_hash,
+                result.status_code,
+                table.table_error,
+                result.content_length,
+            )
+        )
+        self.fetcher.cache.add_table(result.permalink_id, table.table_parent_html)
+        self.fetcher.cache.close()
+        self.fetcher.cache = PermalinkCache(self.cache_dir.name)
+
+        with mock.patch.object(TableArchiveReader, "read") as read:
+            headers = self.fetcher.cache.conditional_headers("permalink-1", table_needed=True)
+
+        self.assertEqual(headers, {"If-None-Match": ETAG})
+        read.assert_not_called()
+        self.assertEqual(self.fetcher.cache.table("permalink-1"), table.table_parent_html)
+
+    def test_result_is_written_when_its_table_fails_to_be_extracted(self):
+        written_results = []
+        self.fetcher.normaliser_pool = ThreadPoolExecutor(max_workers=1)
+
+        with (
+            mock.patch("fetch_permalinks.extract_table", side_effect=RuntimeError("normaliser process died")),
+            contextlib.redirect_stdout(io.StringIO()) as output,
+        ):
+            asyncio.run(self.fetcher._fetch_permalinks_concurrently([["permalink-1"]], written_results.append))
+        self.fetcher.normaliser_pool.shutdown()
+
+        self.assertEqual([result.permalink_id for result in written_results], ["permalink-1"])
+        self.assertEqual(written_results[0].status_code, 200)
+        self.assertTrue(written_results[0].exception)
+        self.assertFalse(written_results[0].table_error)
+        self.assertIn("normaliser process died", output.getvalue())
+
+    def test_result_is_recorded_when_the_normaliser_pool_is_broken(self):
+        # a pool which has been shut down refuses new work, as a broken process pool does
+        self.fetcher.normaliser_pool = ThreadPoolExecutor(max_workers=1)
+        self.fetcher.normaliser_pool.shutdown()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            result, table = self.fetcher._fetch_permalink("permalink-1")
+
+        self.assertIsNone(table)
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(result.exception)
+        self.assertFalse(result.table_error)
+        # the normaliser slot taken for the page has been given back
+        self.assertTrue(self.fetcher.normaliser_slots.acquire(blocking=False))
+
+    def test_body_without_charset_is_decoded_with_its_detected_encoding(self):
+        table = self.fetcher._get_permalink(PermalinkResult(permalink_id="no-content-type"))
+
+        self.assertIn("<td>1\u00a0000</td>", table.table_parent_html)
+
+    def test_siblings_of_the_table_figure_are_in_the_table_parent(self):
+        table = self.fetcher._get_permalink(PermalinkResult(permalink_id="figure-sibling"))
+
+        figure = BeautifulSoup(PAGE_WITH_FIGURE_SIBLING, "lxml").find("figure")
+        self.assertIn("<h2>Before</h2>", table.table_parent_html)
+        self.assertEqual(table.table_parent_html, str(figure.parent))
+
+    def test_resumed_run_drops_lines_cut_short_by_the_killed_run(self):
+        results_dir = os.path.join(self.cache_dir.name, "responses_local")
+        os.makedirs(results_dir)
+        completed_row = PermalinkResult(
+            permalink_id="permalink-1", status_code=200, response_time=0.1, content_length=100
+        ).to_row()
+
+        with open(os.path.join(results_dir, "responses.csv"), "w", newline="") as responses_csv_file:
+            csv.writer(responses_csv_file).writerows([PermalinkResult.CSV_HEADERS, completed_row])
+            responses_csv_file.write("permalink-2,False,Fal")
+        with open(os.path.join(results_dir, "completed_permalinks.journal"), "w") as journal_file:
+            journal_file.write("permalink-1\nperma")
+
+        fetcher = PermalinkFetcher("local", save_content=False, sleep=0, timeout=10, resume_results_dir=results_dir)
+        fetcher.public_url = self.fetcher.public_url
+
+        with (
+            mock.patch("fetch_permalinks.read_permalinks_csv", return_value=[["permalink-1"], ["permalink-2"]]),
+            contextlib.redirect_stdout(io.StringIO()),
+        ):
+            fetcher.main()
+
+        with open(os.path.join(results_dir, "responses.csv"), "r", newline="") as responses_csv_file:
+            rows = list(csv.reader(responses_csv_file))
+        with open(os.path.join(results_dir, "completed_permalinks.journal"), "r") as journal_file:
+            journal = journal_file.read()
+
+        self.assertEqual([row[0] for row in rows], ["permalink_id", "permalink-1", "permalink-2"])
+        self.assertTrue(all(len(row) == len(PermalinkResult.CSV_HEADERS) for row in rows))
+        self.assertEqual(journal, "permalink-1\npermalink-2\n")
+
+
+class TruncatePartialLineTest(unittest.TestCase):
+    def test_file_is_cut_back_to_its_last_complete_line(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "lines")
+
+            for content, expected in [
+                (b"a\nbb\n", b"a\nbb\n"),
+                (b"a\nbb\ncut sh", b"a\nbb\n"),
+                (b"a long line\nand a longer cut short line", b"a long line\n"),
+                (b"no complete line", b""),
+                (b"", b""),
+            ]:
+                with open(path, "wb") as file:
+                    file.write(content)
+
+                # a small chunk size to search back across several chunks
+                truncate_partial_line(path, chunk_size=4)
+
+                with open(path, "rb") as file:
+                    self.assertEqual(file.read(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
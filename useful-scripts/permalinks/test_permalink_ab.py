@@ -0,0 +1,44 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from permalink_ab import summarise_ab
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.latency_report import LatencyReport  # noqa: E402
+
+
+class AbSummaryTest(unittest.TestCase):
+    def test_summary_includes_the_latency_percentiles_of_each_environment(self):
+        latency_reports = {"preprod": LatencyReport(), "prod": LatencyReport()}
+        for latency in [0.1, 0.2, 0.3]:
+            latency_reports["preprod"].record(latency)
+            latency_reports["prod"].record(latency * 2)
+
+        summary = summarise_ab(
+            "preprod",
+            "prod",
+            [2.0, 2.0, 2.0],
+            resamples=100,
+            latency_a=latency_reports["preprod"].overall.to_dict(),
+            latency_b=latency_reports["prod"].overall.to_dict(),
+        )
+
+        with tempfile.TemporaryDirectory() as results_dir:
+            summary_json = os.path.join(results_dir, "ab_summary.json")
+            summary.write_json(summary_json)
+            with open(summary_json, "r") as summary_file:
+                written_summary = json.load(summary_file)
+
+        self.assertEqual(written_summary["median_ratio"], 2.0)
+        self.assertEqual(written_summary["latency_a"]["count"], 3)
+        self.assertAlmostEqual(written_summary["latency_a"]["p50"], 0.2, places=2)
+        self.assertAlmostEqual(written_summary["latency_b"]["p99"], 0.6, places=2)
+        self.assertIn("significantly slower", written_summary["verdict"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import asyncio
+import contextlib
+import io
+import unittest
+
+from rate_controller import AimdRateController
+
+
+class AimdRateControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = AimdRateController(initial_rate=1000, max_rate=1000, target_p95=1.0, window_size=4)
+
+    def _send(self, requests: int) -> list[float]:
+        async def send() -> list[float]:
+            return [await self.controller.wait() for _ in range(requests)]
+
+        return asyncio.run(send())
+
+    def _record(self, sent_at: list[float], latency: float, failed: bool) -> None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for request_sent_at in sent_at:
+                self.controller.record(latency, failed=failed, sent_at=request_sent_at)
+
+    def test_requests_in_flight_timing_out_together_decrease_the_rate_once(self):
+        in_flight = self._send(8)
+
+        self._record(in_flight, latency=None, failed=True)
+
+        self.assertEqual(self.controller.rate, 500)
+
+    def test_failures_of_requests_sent_after_a_decrease_decrease_the_rate_again(self):
+        self._record(self._send(1), latency=None, failed=True)
+        self._record(self._send(1), latency=None, failed=True)
+
+        self.assertEqual(self.controller.rate, 250)
+
+    def test_slow_window_decreases_the_rate_and_fast_window_increases_it(self):
+        self._record(self._send(4), latency=2.0, failed=False)
+        self.assertEqual(self.controller.rate, 500)
+
+        self._record(self._send(4), latency=0.5, failed=False)
+        self.assertEqual(self.controller.rate, 500.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
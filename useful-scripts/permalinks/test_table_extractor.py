@@ -0,0 +1,59 @@
+import unittest
+
+from bs4 import BeautifulSoup
+from table_extractor import PermalinkTableExtractor, extract_table
+
+PAGE = (
+    "<html><head><title>Permalink</title></head><body>"
+    "<header><nav><a class='link  active' href='/'>Home</a></nav></header>"
+    "<main><h1>Subject from Publication</h1><p>Created <strong>1 January 2024</strong></p>"
+    '<div><figure class="FixedMultiHeaderDataTable_figure__abc"><figcaption>Caption &amp; notes</figcaption>'
+    "<table><thead><tr><th scope='col'>2024</th></tr></thead>"
+    "<tbody><tr><th scope='row'>England</th><td>1\u00a0000<br></td></tr></tbody></table></figure></div>"
+    "<div class='downloads'><a href='/download'>Download</a></div></main>"
+    '<script id="__NEXT_DATA__">{"props": "<table>"}</script></body></html>'
+)
+
+
+class PermalinkTableExtractorTest(unittest.TestCase):
+    def assert_no_table(self, table):
+        self.assertFalse(table.table_error)
+        self.assertIsNone(table.table_parent_html)
+        self.assertIsNone(table.table_parent_tag)
+
+    def test_empty_body_has_no_table(self):
+        self.assert_no_table(PermalinkTableExtractor().finish())
+        self.assert_no_table(extract_table(b"", "utf-8"))
+
+    def test_non_html_body_has_no_table(self):
+        self.assert_no_table(extract_table(b'{"status": 502, "title": "Bad Gateway"}', "utf-8"))
+        self.assert_no_table(extract_table(b"upstream connect error or disconnect/reset before headers", None))
+        self.assert_no_table(extract_table(bytes(range(256)), None))
+
+    def test_table_parent_is_serialised_as_beautiful_soup_does(self):
+        figure = BeautifulSoup(PAGE, "lxml").find("figure")
+
+        table = extract_table(PAGE.encode("utf-8"), "utf-8")
+
+        self.assertEqual(table.table_parent_html, str(figure.parent))
+        self.assertEqual(table.table_parent_tag, "div")
+
+    def test_siblings_of_the_table_figure_are_kept(self):
+        page = PAGE.replace("<div><figure", "<div><h2>Before</h2><p>Notes</p><figure")
+        figure = BeautifulSoup(page, "lxml").find("figure")
+
+        table = extract_table(page.encode("utf-8"), "utf-8")
+
+        self.assertIn("<h2>Before</h2><p>Notes</p><figure", table.table_parent_html)
+        self.assertEqual(table.table_parent_html, str(figure.parent))
+
+    def test_nothing_after_the_table_parent_is_kept(self):
+        extractor = PermalinkTableExtractor(encoding="utf-8")
+        extractor.feed(PAGE.encode("utf-8") + b"<p>Page data</p>" * 10_000)
+
+        self.assertIsNotNone(extractor.table_parent_html)
+        self.assertEqual(extractor._parts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
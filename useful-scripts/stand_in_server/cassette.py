@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+from dataclasses import asdict, dataclass
+
+# allow the timing utilities shared with the other useful scripts to be imported when running this script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.jsonl_results import JsonlResultReader, JsonlResultWriter  # noqa: E402
+
+"""
+Storage of recorded HTTP interactions (cassettes) for the stand-in server.
+
+A cassette is a directory holding the JSON lines result store of `timing_utils/jsonl_results.py`, with one compressed
+record per interaction, indexed by a key of its method, path and request body, and the response bodies in their own
+compressed file. A request is matched to a recorded interaction by that key, so a JSON request body matches whatever
+the order of its keys. If the same request was recorded more than once, the last recording is replayed.
+"""
+
+BODY_FIELD = "body"
+
+# the response headers which are recorded and replayed, as the timing and health scripts depend on them
+RECORDED_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+def request_key(method: str, target: str, body: bytes) -> str:
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True).encode("utf-8") if body else b""
+    except ValueError:
+        pass
+
+    return hashlib.sha256(method.upper().encode("utf-8") + b" " + target.encode("utf-8") + b"\n" + body).hexdigest()
+
+
+@dataclass
+class Interaction:
+    key: str
+    method: str
+    target: str
+    status_code: int
+    headers: dict[str, str]
+    # the time to the response headers and the time to download the body, in seconds
+    ttfb: float
+    download_time: float
+    body: bytes = b""
+
+    def to_record(self) -> dict:
+        record = asdict(self)
+
+        # bodies are usually html or JSON, so they're kept as text where they can be
+        try:
+            record[BODY_FIELD] = self.body.decode("utf-8")
+            record["body_encoding"] = "utf-8"
+        except UnicodeDecodeError:
+            record[BODY_FIELD] = base64.b64encode(self.body).decode("ascii")
+            record["body_encoding"] = "base64"
+
+        return record
+
+    @staticmethod
+    def from_record(record: dict, body: str) -> "Interaction":
+        return Interaction(
+            key=record["key"],
+            method=record["method"],
+            target=record["target"],
+            status_code=record["status_code"],
+            headers=record["headers"],
+            ttfb=record["ttfb"],
+            download_time=record["download_time"],
+            body=base64.b64decode(body) if record["body_encoding"] == "base64" else body.encode("utf-8"),
+        )
+
+
+class CassetteWriter:
+    def __init__(self, cassette_dir: str):
+        self._writer = JsonlResultWriter(
+            cassette_dir, key="key", body_field=BODY_FIELD, compress=True, separate_bodies=True
+        )
+
+    def add(self, interaction: Interaction) -> None:
+        self._writer.append(interaction.to_record())
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class Cassette:
+    def __init__(self, cassette_dir: str):
+        self._reader = JsonlResultReader(cassette_dir)
+
+    def __len__(self) -> int:
+        return len(self._reader.index())
+
+    def find(self, key: str) -> Interaction | None:
+        record = self._reader.get(key)
+        if record is None:
+            return None
+
+        return Interaction.from_record(record, self._reader.body(record))
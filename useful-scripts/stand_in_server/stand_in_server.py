@@ -0,0 +1,428 @@
+import abc
+import argparse
+import asyncio
+import http
+import json
+import random
+import re
+import signal
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from cassette import RECORDED_HEADERS, Cassette, CassetteWriter, Interaction, request_key
+
+"""
+A stand-in for the public frontend or the Data API, for developing and benchmarking the timing and health scripts
+(`fetch_permalinks.py`, `get_data_block_responses.py`, `check_permalinks.py` and `create_snapshots.py`) without a
+network connection or load on a real environment.
+
+First record the responses of a real environment, by running the recorder as a proxy in front of it on the port that
+the scripts' local environment uses, and running the scripts against the local environment:
+
+`python stand_in_server.py record --target https://explore-education-statistics.service.gov.uk --port 3000 --cassette prod_public`
+`python stand_in_server.py record --target https://data.explore-education-statistics.service.gov.uk --port 5000 --cassette prod_data_api`
+
+Each request is forwarded to the target and its response is recorded in the cassette directory, along with how long
+the target took to respond and to send the body. See `cassette.py`. A HEAD request is forwarded and recorded as a GET,
+so that its replay has the headers of the full response, and the one recording replays both. Stop the recorder with
+Ctrl+C.
+
+Then replay the cassette in place of the real environment:
+
+`python stand_in_server.py replay --port 3000 --cassette prod_public [--latency-scale 1.0]`
+
+Each recorded response is served after its recorded latency, multiplied by the latency scale, e.g. `--latency-scale 0`
+to benchmark the scripts themselves as fast as they can go. Requests that weren't recorded get a 404. The server
+handles many connections at once, and keeps them alive between requests.
+
+To reproduce failures seen in production, faults can be injected into a proportion of the replayed responses:
+
+* `--timeout-rate` - the response never arrives, the connection is held open for `--hang` seconds and then closed.
+* `--server-error-rate` - a 500 response, with the frontend's error page or a Data API error body.
+* `--table-error-rate` - the table of a permalink page is replaced by the "There was a problem rendering the table."
+  error, as seen in production.
+
+e.g. `--timeout-rate 0.01 --server-error-rate 0.02 --table-error-rate 0.05 --seed 1`. With a seed, the same requests
+fail in the same way in every replay.
+
+Both recorder and replay server print a count of the requests they handled when they're stopped.
+"""
+
+TABLE_ERROR_HTML = '<div data-testid="table-error"><strong>There was a problem rendering the table.</strong></div>'
+SERVER_ERROR_HTML = "<!DOCTYPE html><html><body><h1>Sorry, there's a problem with the service</h1></body></html>"
+
+# the request headers which aren't passed on to the target, as they're set for the connection to the target or, for the
+# conditional headers, so that the full response is always recorded
+UNFORWARDED_HEADERS = {
+    "host",
+    "connection",
+    "content-length",
+    "transfer-encoding",
+    "accept-encoding",
+    "if-none-match",
+    "if-modified-since",
+}
+
+
+@dataclass
+class Request:
+    method: str
+    target: str
+    # with lower case names
+    headers: dict[str, str]
+    body: bytes
+
+    def recorded_method(self) -> str:
+        # the response to a HEAD request is the response to a GET without its body
+        return "GET" if self.method == "HEAD" else self.method
+
+    def key(self) -> str:
+        return request_key(self.recorded_method(), self.target, self.body)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Request | None:
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = await _read_chunked_body(reader)
+    else:
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+    return Request(method, target, headers, body)
+
+
+async def _read_chunked_body(reader: asyncio.StreamReader) -> bytes:
+    chunks = []
+
+    # each chunk is its size in hex, optionally followed by extensions, then the chunk and a line break
+    while size := int((await reader.readline()).split(b";", 1)[0].strip(), 16):
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+    # skip any trailer headers, up to the blank line which ends the body
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+
+    return b"".join(chunks)
+
+
+def _is_not_modified(request: Request, interaction: Interaction) -> bool:
+    etag = interaction.headers.get("ETag")
+    last_modified = interaction.headers.get("Last-Modified")
+
+    return bool(
+        (etag and request.headers.get("if-none-match") == etag)
+        or (last_modified and request.headers.get("if-modified-since") == last_modified)
+    )
+
+
+class StandInServer(abc.ABC):
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.counts: dict[str, int] = {}
+
+    def _count(self, name: str) -> None:
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    @abc.abstractmethod
+    async def _respond(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        """
+        Write the response to a request, returning whether the connection can be kept alive.
+        """
+
+    async def _write_response(
+        self,
+        request: Request,
+        writer: asyncio.StreamWriter,
+        status_code: int,
+        headers: dict[str, str],
+        body: bytes,
+        download_time: float = 0,
+    ) -> None:
+        head = f"HTTP/1.1 {status_code} {http.HTTPStatus(status_code).phrase}\r\n"
+        for name, value in {**headers, "Content-Length": str(len(body)), "Connection": "keep-alive"}.items():
+            head += f"{name}: {value}\r\n"
+
+        writer.write(f"{head}\r\n".encode("latin-1"))
+        await writer.drain()
+
+        # the response to a HEAD request has the Content-Length of the body it would have had, but no body
+        if request.method == "HEAD":
+            return
+
+        # send the headers first, so that the client sees the same time to first byte and download time as recorded
+        if download_time > 0:
+            await asyncio.sleep(download_time)
+
+        writer.write(body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while (request := await _read_request(reader)) is not None:
+                keep_alive = await self._respond(request, writer)
+
+                if not keep_alive or request.headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self) -> None:
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        print(f"Listening on http://{self.host}:{self.port}")
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        pass
+
+    def run(self) -> None:
+        # stop as for Ctrl+C when terminated, e.g. when run in the background
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+            print(", ".join(f"{name}: {count}" for name, count in sorted(self.counts.items())) or "No requests")
+
+
+class RecordingServer(StandInServer):
+    def __init__(self, host: str, port: int, target_url: str, cassette_dir: str, timeout: float):
+        super().__init__(host, port)
+        self.target_url = target_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=32)
+        self.cassette = CassetteWriter(cassette_dir)
+
+    def _forward(self, request: Request) -> Interaction:
+        start = time.perf_counter()
+        response = self.session.request(
+            request.recorded_method(),
+            f"{self.target_url}{request.target}",
+            headers={name: value for name, value in request.headers.items() if name not in UNFORWARDED_HEADERS},
+            data=request.body or None,
+            timeout=self.timeout,
+            stream=True,
+        )
+        ttfb = time.perf_counter() - start
+        body = response.content
+
+        return Interaction(
+            key=request.key(),
+            method=request.recorded_method(),
+            target=request.target,
+            status_code=response.status_code,
+            headers={name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            ttfb=ttfb,
+            download_time=time.perf_counter() - start - ttfb,
+            body=body,
+        )
+
+    async def _respond(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        try:
+            interaction = await asyncio.get_running_loop().run_in_executor(self.executor, self._forward, request)
+        except requests.exceptions.RequestException as e:
+            print(f"{request.method} {request.target} failed, not recording it: {e}")
+            self._count("failed")
+            await self._write_response(request, writer, 502, {"Content-Type": "text/plain"}, str(e).encode("utf-8"))
+            return True
+
+        self.cassette.add(interaction)
+        self._count("recorded")
+        print(f"Recorded {request.method} {request.target} - {interaction.status_code} in {interaction.ttfb:.2f}s")
+
+        if _is_not_modified(request, interaction):
+            await self._write_response(request, writer, 304, interaction.headers, b"")
+        else:
+            await self._write_response(request, writer, interaction.status_code, interaction.headers, interaction.body)
+
+        return True
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.cassette.close()
+
+
+class ReplayServer(StandInServer):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        cassette_dir: str,
+        latency_scale: float = 1.0,
+        fault_rates: dict[str, float] | None = None,
+        hang: float = 300,
+        seed: int | None = None,
+    ):
+        super().__init__(host, port)
+        self.cassette = Cassette(cassette_dir)
+        self.latency_scale = latency_scale
+        self.fault_rates = {fault: rate for fault, rate in (fault_rates or {}).items() if rate > 0}
+        self.hang = hang
+        self.rng = random.Random(seed)
+
+        print(f"Replaying {len(self.cassette)} recorded requests from {cassette_dir}")
+
+    def _choose_fault(self, interaction: Interaction) -> str | None:
+        roll = self.rng.random()
+
+        for fault, rate in self.fault_rates.items():
+            if roll < rate:
+                # a table can only fail to render on a page which was rendered
+                is_page = interaction.status_code == 200 and "html" in interaction.headers.get("Content-Type", "")
+                return fault if fault != "table_error" or is_page else None
+            roll -= rate
+
+        return None
+
+    async def _respond(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        interaction = await asyncio.get_running_loop().run_in_executor(None, self.cassette.find, request.key())
+
+        if interaction is None:
+            print(f"No recorded response to {request.method} {request.target}")
+            self._count("not recorded")
+            body = json.dumps({"error": "No recorded response", "target": request.target}).encode("utf-8")
+            await self._write_response(request, writer, 404, {"Content-Type": "application/json"}, body)
+            return True
+
+        fault = self._choose_fault(interaction)
+        self._count(fault or "replayed")
+
+        if fault == "timeout":
+            # never respond, and close the connection once the client has given up
+            await asyncio.sleep(self.hang)
+            return False
+
+        await asyncio.sleep(interaction.ttfb * self.latency_scale)
+
+        if fault == "server_error":
+            if "html" in interaction.headers.get("Content-Type", ""):
+                headers, body = {"Content-Type": "text/html; charset=utf-8"}, SERVER_ERROR_HTML.encode("utf-8")
+            else:
+                headers = {"Content-Type": "application/problem+json"}
+                body = json.dumps({"status": 500, "title": "Internal Server Error", "traceId": str(uuid.uuid4())})
+                body = body.encode("utf-8")
+
+            await self._write_response(request, writer, 500, headers, body)
+        elif _is_not_modified(request, interaction):
+            await self._write_response(request, writer, 304, interaction.headers, b"")
+        else:
+            body = _with_table_error(interaction.body) if fault == "table_error" else interaction.body
+            await self._write_response(
+                request,
+                writer,
+                interaction.status_code,
+                interaction.headers,
+                body,
+                download_time=interaction.download_time * self.latency_scale,
+            )
+
+        return True
+
+
+def _with_table_error(body: bytes) -> bytes:
+    html = body.decode("utf-8", errors="replace")
+    html, replaced = re.subn(r"<table\b.*?</table>", TABLE_ERROR_HTML, html, count=1, flags=re.DOTALL)
+
+    if not replaced:
+        html = html.replace("</body>", f"{TABLE_ERROR_HTML}</body>", 1)
+
+    return html.encode("utf-8")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        prog="python stand_in_server.py",
+        description="Record the responses of an environment, and replay them as a stand-in for it.",
+    )
+    subparsers = ap.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Record the responses of an environment as a proxy")
+    record_parser.add_argument(
+        "--target", dest="target_url", help="The URL of the environment to record", type=str, required=True
+    )
+    record_parser.add_argument(
+        "--timeout", dest="timeout", default=240.0, help="Timeout for requests to the target in seconds", type=float
+    )
+
+    replay_parser = subparsers.add_parser("replay", help="Replay recorded responses")
+    replay_parser.add_argument(
+        "--latency-scale",
+        dest="latency_scale",
+        default=1.0,
+        help="Multiply the recorded latencies by this, e.g. 0 to respond immediately",
+        type=float,
+    )
+    replay_parser.add_argument(
+        "--timeout-rate",
+        dest="timeout_rate",
+        default=0.0,
+        help="Proportion of requests to never respond to",
+        type=float,
+    )
+    replay_parser.add_argument(
+        "--server-error-rate",
+        dest="server_error_rate",
+        default=0.0,
+        help="Proportion of requests to respond to with a 500",
+        type=float,
+    )
+    replay_parser.add_argument(
+        "--table-error-rate",
+        dest="table_error_rate",
+        default=0.0,
+        help="Proportion of pages to replace the table of with a table error",
+        type=float,
+    )
+    replay_parser.add_argument(
+        "--hang", dest="hang", default=300.0, help="Seconds to hold a timed out request's connection open", type=float
+    )
+    replay_parser.add_argument("--seed", dest="seed", default=None, help="Seed for choosing faults", type=int)
+
+    for subparser in [record_parser, replay_parser]:
+        subparser.add_argument(
+            "--cassette", dest="cassette_dir", help="Directory of the recorded responses", type=str, required=True
+        )
+        subparser.add_argument("--host", dest="host", default="127.0.0.1", help="Host to listen on", type=str)
+        subparser.add_argument("--port", dest="port", default=3000, help="Port to listen on", type=int)
+
+    args = ap.parse_args()
+
+    if args.command == "record":
+        stand_in_server = RecordingServer(args.host, args.port, args.target_url, args.cassette_dir, args.timeout)
+    else:
+        stand_in_server = ReplayServer(
+            args.host,
+            args.port,
+            args.cassette_dir,
+            latency_scale=args.latency_scale,
+            fault_rates={
+                "timeout": args.timeout_rate,
+                "server_error": args.server_error_rate,
+                "table_error": args.table_error_rate,
+            },
+            hang=args.hang,
+            seed=args.seed,
+        )
+
+    stand_in_server.run()
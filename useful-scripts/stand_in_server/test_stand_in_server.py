@@ -0,0 +1,132 @@
+import asyncio
+import contextlib
+import http.server
+import io
+import json
+import tempfile
+import threading
+import unittest
+
+import requests
+from stand_in_server import RecordingServer, ReplayServer, StandInServer
+
+PAGE = "<!DOCTYPE html><html><body><h1>Permalink</h1><p>Pupils – 10,000</p></body></html>".encode("utf-8")
+
+
+class TargetHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._send("text/html; charset=utf-8", PAGE)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send("application/json", json.dumps({"received": json.loads(body)}).encode("utf-8"))
+
+    def _send(self, content_type: str, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerThread:
+    """
+    A stand-in server handling connections in an event loop of its own, on a free port.
+    """
+
+    def __init__(self, server: StandInServer):
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(server._handle_connection, "127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    async def _close(self) -> None:
+        self.server.close()
+        # the connections kept alive by the clients
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+
+class StandInServerTest(unittest.TestCase):
+    def setUp(self):
+        self.cassette_dir = tempfile.TemporaryDirectory()
+        self.target = http.server.ThreadingHTTPServer(("127.0.0.1", 0), TargetHandler)
+        threading.Thread(target=self.target.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.target.shutdown()
+        self.target.server_close()
+        self.cassette_dir.cleanup()
+
+    def _send_requests(self, url: str) -> list[requests.Response]:
+        with requests.Session() as session:
+            return [
+                session.get(f"{url}/permalink/abc"),
+                # a body of unknown length, sent with Transfer-Encoding: chunked rather than a Content-Length
+                session.post(f"{url}/api/tablebuilder", data=iter([b'{"subjectId": "subject-1", ', b'"filters": []}'])),
+                session.head(f"{url}/permalink/abc"),
+            ]
+
+    def _record(self) -> list[requests.Response]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            recorder = RecordingServer(
+                "127.0.0.1", 0, f"http://127.0.0.1:{self.target.server_port}", self.cassette_dir.name, timeout=5
+            )
+            recorder_thread = ServerThread(recorder)
+            try:
+                return self._send_requests(recorder_thread.url)
+            finally:
+                recorder_thread.stop()
+                recorder.close()
+
+    def _replay_thread(self) -> ServerThread:
+        with contextlib.redirect_stdout(io.StringIO()):
+            replay_thread = ServerThread(ReplayServer("127.0.0.1", 0, self.cassette_dir.name, latency_scale=0))
+
+        self.addCleanup(replay_thread.stop)
+        return replay_thread
+
+    def test_replayed_responses_match_the_recorded_responses(self):
+        recorded = self._record()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            replayed = self._send_requests(self._replay_thread().url)
+
+        for recorded_response, replayed_response in zip(recorded, replayed):
+            self.assertEqual(replayed_response.status_code, recorded_response.status_code)
+            self.assertEqual(replayed_response.content, recorded_response.content)
+            self.assertEqual(replayed_response.headers["Content-Type"], recorded_response.headers["Content-Type"])
+
+        get_response, post_response, head_response = replayed
+        self.assertEqual(get_response.content, PAGE)
+        self.assertEqual(post_response.json(), {"received": {"subjectId": "subject-1", "filters": []}})
+        self.assertEqual(head_response.content, b"")
+        self.assertEqual(head_response.headers["Content-Length"], str(len(PAGE)))
+
+    def test_head_request_which_was_not_recorded_has_no_body(self):
+        self._record()
+
+        with contextlib.redirect_stdout(io.StringIO()), requests.Session() as session:
+            url = self._replay_thread().url
+            head_response = session.head(f"{url}/permalink/not-recorded")
+            # a body sent after the headers would be read as the start of the next response on the connection
+            get_response = session.get(f"{url}/permalink/abc")
+
+        self.assertEqual(head_response.status_code, 404)
+        self.assertEqual(get_response.status_code, 200)
+        self.assertEqual(get_response.content, PAGE)
+
+
+if __name__ == "__main__":
+    unittest.main()
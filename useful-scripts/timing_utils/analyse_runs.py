@@ -0,0 +1,162 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# allow the timing utilities to be imported when running this script directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.columnar_results import load_columns, load_schema  # noqa: E402
+
+"""
+Analysis of the columnar results written by the timing scripts' columnar option, e.g. `fetch_permalinks.py --columnar`
+or `get_data_block_responses.py --columnar`. Only the columns needed to answer each question are loaded.
+
+Usage, from the useful-scripts directory:
+
+List the slowest responses of a run:
+`python timing_utils/analyse_runs.py slowest responses_prod_20240101_090000 [--limit 100]`
+
+List the responses which have got slower since an earlier run, by at least a ratio and a number of seconds:
+`python timing_utils/analyse_runs.py regressions responses_prod_20240201_090000 --since responses_prod_20240101_090000 [--ratio 1.5] [--min-increase 1]`
+
+Summarise response times grouped by a column, e.g. the publication of each permalink or the release of each data block:
+`python timing_utils/analyse_runs.py by responses_prod_20240101_090000 publication_title`
+"""
+
+PERCENTILES = [50, 95, 99]
+
+
+def _print_table(headers: list[str], rows: list[list]) -> None:
+    widths = [max(len(str(value)) for value in [header] + [row[i] for row in rows]) for i, header in enumerate(headers)]
+
+    print("  ".join(header.ljust(width) for header, width in zip(headers, widths)).rstrip())
+    for row in rows:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip())
+
+
+def slowest(args: argparse.Namespace) -> None:
+    key = load_schema(args.results_dir)["key"]
+    columns = load_columns(args.results_dir, [key, args.column])
+    values = columns[args.column]
+
+    # NaN response times, i.e. failed requests, sort last
+    order = np.argsort(-np.nan_to_num(values, nan=-np.inf))[: args.limit]
+
+    _print_table([key, args.column], [[columns[key][i], f"{values[i]:.2f}"] for i in order])
+
+
+def regressions(args: argparse.Namespace) -> None:
+    key = load_schema(args.results_dir)["key"]
+    current = load_columns(args.results_dir, [key, args.column])
+    baseline = load_columns(args.since, [key, args.column])
+
+    # join the runs on their key by looking up each current key in the sorted baseline keys
+    baseline_order = np.argsort(baseline[key])
+    baseline_keys = baseline[key][baseline_order]
+    positions = np.clip(np.searchsorted(baseline_keys, current[key]), 0, max(len(baseline_keys) - 1, 0))
+    matched = (
+        baseline_keys[positions] == current[key] if len(baseline_keys) else np.zeros(len(current[key]), dtype=bool)
+    )
+
+    current_values = current[args.column][matched]
+    baseline_values = baseline[args.column][baseline_order][positions[matched]]
+    keys = current[key][matched]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = current_values / baseline_values
+    increases = current_values - baseline_values
+
+    regressed = (ratios >= args.ratio) & (increases >= args.min_increase)
+    order = np.argsort(-increases[regressed])
+
+    print(f"{np.count_nonzero(regressed)} of {len(keys)} responses in both runs regressed since {args.since}")
+    _print_table(
+        [key, f"{args.column}_before", f"{args.column}_after", "ratio"],
+        [
+            [
+                keys[regressed][i],
+                f"{baseline_values[regressed][i]:.2f}",
+                f"{current_values[regressed][i]:.2f}",
+                f"{ratios[regressed][i]:.2f}",
+            ]
+            for i in order[: args.limit]
+        ],
+    )
+
+
+def by(args: argparse.Namespace) -> None:
+    columns = load_columns(args.results_dir, [args.group_column, args.column])
+    values = columns[args.column]
+    measured = ~np.isnan(values)
+
+    groups, group_indices = np.unique(columns[args.group_column][measured], return_inverse=True)
+    values = values[measured]
+
+    # sort by group then value, so that each group's values are a contiguous, sorted slice
+    order = np.lexsort((values, group_indices))
+    group_counts = np.bincount(group_indices, minlength=len(groups))
+    group_values = np.split(values[order], np.cumsum(group_counts)[:-1])
+
+    rows = []
+    for group, group_value in zip(groups, group_values):
+        percentiles = np.percentile(group_value, PERCENTILES)
+        rows.append(
+            [group, len(group_value), f"{group_value.mean():.2f}"]
+            + [f"{percentile:.2f}" for percentile in percentiles]
+            + [f"{group_value[-1]:.2f}"]
+        )
+
+    # slowest groups first
+    rows.sort(key=lambda row: float(row[-2]), reverse=True)
+
+    _print_table(
+        [args.group_column, "count", "mean"] + [f"p{percentile}" for percentile in PERCENTILES] + ["max"],
+        rows[: args.limit],
+    )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        prog=f"python timing_utils/{os.path.basename(__file__)}",
+        description="Analyse the columnar results of one or more timing runs.",
+    )
+    subparsers = ap.add_subparsers(dest="command", required=True)
+
+    slowest_parser = subparsers.add_parser("slowest", help="List the slowest responses of a run")
+    slowest_parser.add_argument("results_dir", help="The results directory of the run", type=str)
+    slowest_parser.set_defaults(func=slowest)
+
+    regressions_parser = subparsers.add_parser("regressions", help="List the responses which have got slower")
+    regressions_parser.add_argument("results_dir", help="The results directory of the run", type=str)
+    regressions_parser.add_argument(
+        "--since", dest="since", help="The results directory of the earlier run", type=str, required=True
+    )
+    regressions_parser.add_argument(
+        "--ratio", dest="ratio", default=1.5, help="Minimum ratio of the new to the old response time", type=float
+    )
+    regressions_parser.add_argument(
+        "--min-increase",
+        dest="min_increase",
+        default=1.0,
+        help="Minimum increase in response time in number of seconds",
+        type=float,
+    )
+    regressions_parser.set_defaults(func=regressions)
+
+    by_parser = subparsers.add_parser("by", help="Summarise response times grouped by a column")
+    by_parser.add_argument("results_dir", help="The results directory of the run", type=str)
+    by_parser.add_argument("group_column", help="The column to group by, e.g. publication_title", type=str)
+    by_parser.set_defaults(func=by)
+
+    for subparser in [slowest_parser, regressions_parser, by_parser]:
+        subparser.add_argument(
+            "--column", dest="column", default="response_time", help="The timing column to analyse", type=str
+        )
+        subparser.add_argument(
+            "--limit", dest="limit", default=100, help="Maximum number of rows to list", type=int, required=False
+        )
+
+    args = ap.parse_args()
+    args.func(args)
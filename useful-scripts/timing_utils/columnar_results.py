@@ -0,0 +1,183 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+"""
+Columnar storage of timing run results, for analysing runs without re-parsing their CSV and text output.
+
+`ColumnarResultWriter` buffers rows in memory and flushes them as row groups to a 'columns' directory in the results
+directory. Each row group is a compressed numpy `.npz` file holding one typed array per column, and 'schema.json'
+records the column types and which column identifies a row (e.g. the permalink Id). Missing values are stored as NaN
+in float columns, -1 in int columns, False in bool columns and "" in str columns.
+
+So that the rows buffered in memory survive a run being killed, e.g. once the run's journal has recorded them as
+done, each row is also appended to a pending file of JSON lines beside the row group it will be flushed to. The
+pending file is removed once its row group has been written, and a writer resuming a run reloads the rows of any
+pending file whose row group was never written.
+
+`load_columns` reads the row groups of a run back as one array per column. Only the requested columns are read from
+each row group. `merge_row_groups` combines the row groups of several runs, e.g. the shards of a sweep, into one.
+
+See `analyse_runs.py` for answering questions about one or more runs from their columns.
+"""
+
+COLUMNS_DIRNAME = "columns"
+SCHEMA_FILENAME = "schema.json"
+PENDING_SUFFIX = ".pending.jsonl"
+
+_MISSING_VALUES = {"str": "", "float": np.nan, "int": -1, "bool": False}
+_DTYPES = {"str": np.str_, "float": np.float64, "int": np.int64, "bool": np.bool_}
+
+
+class ColumnarResultWriter:
+    def __init__(self, results_dir: str, key: str, schema: dict[str, str], row_group_size: int = 10_000):
+        self.columns_dir = os.path.join(results_dir, COLUMNS_DIRNAME)
+        self.key = key
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self._rows: list[dict] = []
+
+        if not os.path.exists(self.columns_dir):
+            os.makedirs(self.columns_dir)
+
+        with open(os.path.join(self.columns_dir, SCHEMA_FILENAME), "w") as schema_file:
+            json.dump({"key": key, "columns": schema}, schema_file, indent=2)
+
+        # carry on numbering row groups after those already written, e.g. when resuming a run
+        self._row_group_count = len(_row_group_files(self.columns_dir))
+        pending_rows = self._read_pending_rows()
+        self._pending_file = open(self._pending_file_path(), "a")
+
+        for row in pending_rows:
+            self.append(row)
+
+    def _pending_file_path(self) -> str:
+        return os.path.join(self.columns_dir, f"part-{self._row_group_count:05d}{PENDING_SUFFIX}")
+
+    def _read_pending_rows(self) -> list[dict]:
+        rows = []
+
+        for filename in sorted(os.listdir(self.columns_dir)):
+            if not filename.endswith(PENDING_SUFFIX):
+                continue
+
+            pending_file_path = os.path.join(self.columns_dir, filename)
+
+            # a run killed after writing a row group but before removing its pending file has already saved its rows
+            if not os.path.exists(pending_file_path.removesuffix(PENDING_SUFFIX) + ".npz"):
+                with open(pending_file_path, "r") as pending_file:
+                    # a row being written as the run was killed may be incomplete, and was never journalled
+                    for line in pending_file:
+                        if line.endswith("\n"):
+                            rows.append(json.loads(line))
+
+            os.remove(pending_file_path)
+
+        return rows
+
+    def append(self, row: dict) -> None:
+        row = {column: row.get(column) for column in self.schema}
+        self._rows.append(row)
+        self._pending_file.write(json.dumps(row) + "\n")
+        self._pending_file.flush()
+
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+
+        pending_file_path = self._pending_file_path()
+
+        columns = {}
+        for column, column_type in self.schema.items():
+            missing = _MISSING_VALUES[column_type]
+            values = [row[column] for row in self._rows]
+            columns[column] = np.array([missing if value is None else value for value in values], _DTYPES[column_type])
+
+        row_group_file = os.path.join(self.columns_dir, f"part-{self._row_group_count:05d}.npz")
+
+        # write to a temporary file first, so that an interrupted run never leaves a partial row group behind
+        temporary_file = f"{row_group_file}.tmp"
+        with open(temporary_file, "wb") as output_file:
+            np.savez_compressed(output_file, **columns)
+        os.replace(temporary_file, row_group_file)
+
+        self._pending_file.close()
+        os.remove(pending_file_path)
+
+        self._row_group_count += 1
+        self._rows = []
+        self._pending_file = open(self._pending_file_path(), "a")
+
+    def close(self) -> None:
+        self.flush()
+        self._pending_file.close()
+        os.remove(self._pending_file_path())
+
+    def __enter__(self) -> "ColumnarResultWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def _row_group_files(columns_dir: str) -> list[str]:
+    return sorted(
+        os.path.join(columns_dir, filename)
+        for filename in os.listdir(columns_dir)
+        if filename.startswith("part-") and filename.endswith(".npz")
+    )
+
+
+def load_schema(results_dir: str) -> dict:
+    with open(os.path.join(results_dir, COLUMNS_DIRNAME, SCHEMA_FILENAME), "r") as schema_file:
+        return json.load(schema_file)
+
+
+def load_columns(results_dir: str, columns: list[str] | None = None) -> dict[str, np.ndarray]:
+    schema = load_schema(results_dir)
+    columns = columns or list(schema["columns"])
+
+    unknown_columns = [column for column in columns if column not in schema["columns"]]
+    if unknown_columns:
+        raise ValueError(f"{results_dir} has no columns named {', '.join(unknown_columns)}")
+
+    row_groups: dict[str, list[np.ndarray]] = {column: [] for column in columns}
+
+    for row_group_file in _row_group_files(os.path.join(results_dir, COLUMNS_DIRNAME)):
+        # arrays in an npz file are only read when accessed, so other columns are skipped
+        with np.load(row_group_file) as row_group:
+            for column in columns:
+                row_groups[column].append(row_group[column])
+
+    return {
+        column: (np.concatenate(arrays) if arrays else np.array([], _DTYPES[schema["columns"][column]]))
+        for column, arrays in row_groups.items()
+    }
+
+
+def merge_row_groups(results_dir: str, source_results_dirs: list[str]) -> int:
+    """
+    Copy the row groups of the source runs into a results directory, returning the number of row groups copied.
+    """
+    columns_dir = os.path.join(results_dir, COLUMNS_DIRNAME)
+    row_group_count = 0
+
+    for source_results_dir in source_results_dirs:
+        source_columns_dir = os.path.join(source_results_dir, COLUMNS_DIRNAME)
+        if not os.path.exists(source_columns_dir):
+            continue
+
+        if not os.path.exists(columns_dir):
+            os.makedirs(columns_dir)
+            shutil.copy2(os.path.join(source_columns_dir, SCHEMA_FILENAME), columns_dir)
+
+        for row_group_file in _row_group_files(source_columns_dir):
+            shutil.copy2(row_group_file, os.path.join(columns_dir, f"part-{row_group_count:05d}.npz"))
+            row_group_count += 1
+
+    return row_group_count
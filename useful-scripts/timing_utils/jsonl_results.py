@@ -0,0 +1,264 @@
+import argparse
+import gzip
+import itertools
+import json
+import os
+import threading
+import zlib
+
+"""
+Append-only JSON lines storage of timing run results, as an alternative to writing text files for every request.
+
+`JsonlResultWriter` appends each result as one JSON record to 'results.jsonl' in the results directory, and appends
+the record's key (e.g. the data block Id), byte offset and length to 'results.index', so that any one result can be
+read back without reading the others. With compression each record is written as its own gzip member, which keeps the
+file readable with `zcat` as well as by offset. Response bodies can be stored in a separate compressed 'bodies.gz'
+file instead of in the records, so that scanning the records for slow or failed responses stays quick.
+
+A body which has been streamed to a file, e.g. a large response, can be appended from that file a chunk at a time
+with `append(record, body_path=...)`, rather than being loaded into memory. A streamed body isn't necessarily JSON,
+e.g. the html page of a 502 from a load balancer, so it is always stored exactly as it was received in 'bodies.gz',
+keeping every record valid JSON. `JsonlResultReader.body` returns a stored body which isn't JSON as text.
+
+Usage, from the useful-scripts directory:
+
+List the results which took more than 10 seconds to respond:
+`python timing_utils/jsonl_results.py slower-than results_dev_table_20240101_090000 10`
+
+List the results which didn't respond with a 200 status:
+`python timing_utils/jsonl_results.py non-200 results_dev_table_20240101_090000`
+
+Show one result by its key, along with its response body:
+`python timing_utils/jsonl_results.py show results_dev_table_20240101_090000 0a1b2c3d-... --body`
+"""
+
+STORE_FILENAME = "store.json"
+RESULTS_FILENAME = "results.jsonl"
+COMPRESSED_RESULTS_FILENAME = "results.jsonl.gz"
+INDEX_FILENAME = "results.index"
+BODIES_FILENAME = "bodies.gz"
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _decompress(data: bytes) -> bytes:
+    # each record is a complete gzip member, so concatenated records can be read as one gzip file or one at a time
+    return zlib.decompress(data, wbits=zlib.MAX_WBITS | 16)
+
+
+class JsonlResultWriter:
+    def __init__(
+        self,
+        results_dir: str,
+        key: str,
+        body_field: str,
+        compress: bool = False,
+        separate_bodies: bool = False,
+    ):
+        self.key = key
+        self.body_field = body_field
+        self.compress = compress
+        self.separate_bodies = separate_bodies
+
+        # results are written from several threads at once, so each record and its index entry are written together
+        self._lock = threading.Lock()
+
+        if not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+
+        with open(os.path.join(results_dir, STORE_FILENAME), "w") as store_file:
+            json.dump(
+                {"key": key, "body_field": body_field, "compress": compress, "separate_bodies": separate_bodies},
+                store_file,
+                indent=2,
+            )
+
+        results_filename = COMPRESSED_RESULTS_FILENAME if compress else RESULTS_FILENAME
+        self._results_file = open(os.path.join(results_dir, results_filename), "ab")
+        self._index_file = open(os.path.join(results_dir, INDEX_FILENAME), "a")
+        self._bodies_path = os.path.join(results_dir, BODIES_FILENAME)
+        # without separate bodies, only opened for the first streamed body
+        self._bodies_file = open(self._bodies_path, "ab") if separate_bodies else None
+
+    def append(self, record: dict, body_path: str | None = None) -> None:
+        record = dict(record)
+        body = record.pop(self.body_field, None)
+
+        with self._lock:
+            if body_path and self._bodies_file is None:
+                self._bodies_file = open(self._bodies_path, "ab")
+
+            if self.separate_bodies or body_path:
+                record["body_offset"] = self._bodies_file.tell()
+                self._write(self._bodies_file, self._body_chunks(body, body_path), compress=True)
+                record["body_length"] = self._bodies_file.tell() - record["body_offset"]
+                chunks = [(json.dumps(record) + "\n").encode("utf-8")]
+            else:
+                # the body is written as the last field of the record, so that it never has to be loaded to be written
+                prefix = json.dumps(record)[:-1] + (", " if record else "") + f"{json.dumps(self.body_field)}: "
+                chunks = itertools.chain([prefix.encode("utf-8")], self._body_chunks(body, body_path), [b"}\n"])
+
+            offset = self._results_file.tell()
+            self._write(self._results_file, chunks, compress=self.compress)
+            self._index_file.write(f"{record[self.key]}\t{offset}\t{self._results_file.tell() - offset}\n")
+
+            # flush as we go, so that an interrupted run keeps every result written before it stopped
+            for file in [self._bodies_file, self._results_file, self._index_file]:
+                if file:
+                    file.flush()
+
+    @staticmethod
+    def _body_chunks(body, body_path: str | None):
+        if not body_path:
+            yield json.dumps(body).encode("utf-8")
+            return
+
+        with open(body_path, "rb") as body_file:
+            while chunk := body_file.read(CHUNK_SIZE):
+                yield chunk
+
+    @staticmethod
+    def _write(file, chunks, compress: bool) -> None:
+        # a compressed record is written as one gzip member, however many chunks it was written in
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+
+        for chunk in chunks:
+            file.write(compressor.compress(chunk) if compressor else chunk)
+
+        if compressor:
+            file.write(compressor.flush())
+
+    def close(self) -> None:
+        for file in [self._results_file, self._index_file, self._bodies_file]:
+            if file:
+                file.close()
+
+    def __enter__(self) -> "JsonlResultWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class JsonlResultReader:
+    def __init__(self, results_dir: str):
+        self.results_dir = results_dir
+
+        with open(os.path.join(results_dir, STORE_FILENAME), "r") as store_file:
+            store = json.load(store_file)
+
+        self.key = store["key"]
+        self.body_field = store["body_field"]
+        self.compress = store["compress"]
+        self.separate_bodies = store["separate_bodies"]
+        self.results_path = os.path.join(
+            results_dir, COMPRESSED_RESULTS_FILENAME if self.compress else RESULTS_FILENAME
+        )
+        self._index: dict[str, tuple[int, int]] | None = None
+
+    def __iter__(self):
+        # the gzip members of a compressed file are read as one stream, a line at a time
+        with (gzip.open if self.compress else open)(self.results_path, "rb") as results_file:
+            for line in results_file:
+                yield json.loads(line)
+
+    def index(self) -> dict[str, tuple[int, int]]:
+        if self._index is None:
+            self._index = {}
+            with open(os.path.join(self.results_dir, INDEX_FILENAME), "r") as index_file:
+                for line in index_file:
+                    key, offset, length = line.rstrip("\n").split("\t")
+                    self._index[key] = (int(offset), int(length))
+
+        return self._index
+
+    def get(self, key: str) -> dict | None:
+        if key not in self.index():
+            return None
+
+        offset, length = self.index()[key]
+        with open(self.results_path, "rb") as results_file:
+            results_file.seek(offset)
+            return self._parse(results_file.read(length))
+
+    def body(self, record: dict):
+        if "body_offset" not in record:
+            return record.get(self.body_field)
+
+        with open(os.path.join(self.results_dir, BODIES_FILENAME), "rb") as bodies_file:
+            bodies_file.seek(record["body_offset"])
+            body = _decompress(bodies_file.read(record["body_length"]))
+
+        try:
+            return json.loads(body)
+        except ValueError:
+            # a streamed body which isn't JSON, e.g. an html error page, or which is empty
+            return body.decode("utf-8", errors="replace")
+
+    def _parse(self, data: bytes) -> dict:
+        return json.loads(_decompress(data) if self.compress else data)
+
+
+def slower_than(reader: JsonlResultReader, seconds: float) -> list[dict]:
+    records = [record for record in reader if (record.get("response_time") or -1) > seconds]
+    return sorted(records, key=lambda record: record["response_time"], reverse=True)
+
+
+def non_200(reader: JsonlResultReader) -> list[dict]:
+    return [record for record in reader if record.get("status_code") != 200]
+
+
+def _print_records(reader: JsonlResultReader, records: list[dict], limit: int) -> None:
+    for record in records[:limit]:
+        print(
+            f"{record[reader.key]}\t{record.get('status_code')}\t{record.get('response_time')}"
+            f"\t{record.get('failure') or ''}".rstrip()
+        )
+
+    print(f"{len(records)} results")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(
+        prog=f"python timing_utils/{os.path.basename(__file__)}",
+        description="Query the JSON lines results of a timing run.",
+    )
+    subparsers = ap.add_subparsers(dest="command", required=True)
+
+    slower_than_parser = subparsers.add_parser("slower-than", help="List the results slower than a number of seconds")
+    slower_than_parser.add_argument("results_dir", help="The results directory of the run", type=str)
+    slower_than_parser.add_argument("seconds", help="The response time in seconds", type=float)
+
+    non_200_parser = subparsers.add_parser("non-200", help="List the results which didn't respond with a 200 status")
+    non_200_parser.add_argument("results_dir", help="The results directory of the run", type=str)
+
+    for subparser in [slower_than_parser, non_200_parser]:
+        subparser.add_argument(
+            "--limit", dest="limit", default=100, help="Maximum number of results to list", type=int, required=False
+        )
+
+    show_parser = subparsers.add_parser("show", help="Show one result")
+    show_parser.add_argument("results_dir", help="The results directory of the run", type=str)
+    show_parser.add_argument("key", help="The key of the result, e.g. the data block Id", type=str)
+    show_parser.add_argument(
+        "--body", dest="body", default=False, help="Also show the response body", action="store_true"
+    )
+
+    args = ap.parse_args()
+    result_reader = JsonlResultReader(args.results_dir)
+
+    if args.command == "slower-than":
+        _print_records(result_reader, slower_than(result_reader, args.seconds), args.limit)
+    elif args.command == "non-200":
+        _print_records(result_reader, non_200(result_reader), args.limit)
+    else:
+        result = result_reader.get(args.key)
+        if result is None:
+            ap.exit(1, f"No result with key {args.key} in {args.results_dir}\n")
+
+        if args.body:
+            result[result_reader.body_field] = result_reader.body(result)
+        else:
+            result.pop(result_reader.body_field, None)
+
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,131 @@
+import json
+import math
+from collections import defaultdict
+
+"""
+Latency summaries shared by the permalink and data block timing scripts.
+
+`LatencyHistogram` is a small HDR-style histogram. Latencies are recorded in microseconds into log-linear buckets, so
+memory use depends only on the range of latencies recorded rather than the number of requests, and every value is
+reported to within the configured number of significant digits.
+
+`LatencyReport` keeps an overall histogram plus histograms grouped by any number of dimensions (e.g. HTTP status or
+content length), along with counts of requests that failed without a latency, and writes them as JSON.
+"""
+
+
+def content_length_bucket(length: int) -> str:
+    # the same size bands as the permalink fetcher uses to format content lengths
+    if length < 1024:
+        return "bytes"
+    elif length < 1024 * 1024:
+        return "Kb"
+    else:
+        return "Mb"
+
+
+class LatencyHistogram:
+    PERCENTILES = [50, 90, 95, 99]
+
+    def __init__(self, significant_digits: int = 2):
+        # the number of bits needed to count up to 2 * 10^significant_digits, so that the width of each bucket is
+        # never more than 1 / 10^significant_digits of the values in it
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10**significant_digits))
+        self.counts: dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+
+    def record(self, latency: float) -> None:
+        self.counts[self._bucket_key(round(latency * 1_000_000))] += 1
+        self.count += 1
+        self.total += latency
+        self.min = latency if self.min is None else min(self.min, latency)
+        self.max = latency if self.max is None else max(self.max, latency)
+
+    def percentile(self, percentile: float) -> float | None:
+        if self.count == 0:
+            return None
+
+        target = max(math.ceil(percentile / 100 * self.count), 1)
+        cumulative = 0
+
+        for key in sorted(self.counts):
+            cumulative += self.counts[key]
+            if cumulative >= target:
+                return min(self._bucket_upper_bound(key) / 1_000_000, self.max)
+
+        return self.max
+
+    def to_dict(self) -> dict:
+        summary = {
+            "count": self.count,
+            "min": self.min,
+            "mean": self.total / self.count if self.count else None,
+        }
+
+        for percentile in LatencyHistogram.PERCENTILES:
+            summary[f"p{percentile}"] = self.percentile(percentile)
+
+        summary["max"] = self.max
+
+        return summary
+
+    def _bucket_key(self, microseconds: int) -> int:
+        # values which fit in the sub-bucket bits are counted exactly, larger values are shifted down so that only
+        # their most significant bits are kept, with the shift stored above them so that keys sort in value order
+        shift = max(microseconds.bit_length() - self.sub_bucket_bits, 0)
+        return (shift << self.sub_bucket_bits) | (microseconds >> shift)
+
+    def _bucket_upper_bound(self, key: int) -> int:
+        shift = key >> self.sub_bucket_bits
+        sub_bucket = key & ((1 << self.sub_bucket_bits) - 1)
+        return ((sub_bucket + 1) << shift) - 1
+
+
+class LatencyReport:
+    def __init__(self):
+        self.overall = LatencyHistogram()
+        self.groups: dict[str, dict[str, LatencyHistogram]] = defaultdict(lambda: defaultdict(LatencyHistogram))
+        self.failures: dict[str, int] = defaultdict(int)
+
+    def record(self, latency: float, **groups: str) -> None:
+        """
+        Record a latency in seconds, e.g. `report.record(1.25, by_status="200", by_content_length="Kb")`.
+        """
+        self.overall.record(latency)
+
+        for group, value in groups.items():
+            self.groups[group][str(value)].record(latency)
+
+    def record_failure(self, reason: str) -> None:
+        """
+        Count a request which failed without a latency to record, e.g. because it timed out.
+        """
+        self.failures[reason] += 1
+
+    def to_dict(self) -> dict:
+        report = {"overall": self.overall.to_dict()}
+
+        for group, histograms in self.groups.items():
+            report[group] = {value: histograms[value].to_dict() for value in sorted(histograms)}
+
+        report["failures"] = dict(self.failures)
+
+        return report
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
+
+    def summary(self) -> str:
+        overall = self.overall.to_dict()
+
+        if overall["count"] == 0:
+            return "No response times recorded"
+
+        percentiles = ", ".join(
+            f"{name}: {overall[name]:.2f}s" for name in [f"p{p}" for p in LatencyHistogram.PERCENTILES] + ["max"]
+        )
+        return f"{overall['count']} response times recorded - {percentiles}"
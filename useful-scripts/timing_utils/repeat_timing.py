@@ -0,0 +1,85 @@
+import csv
+import statistics
+
+from timing_utils.latency_report import LatencyHistogram
+
+"""
+Cold versus warm response times, for runs which send each request several times (the repeat option of the timing
+scripts).
+
+The first attempt at a request is cold, as no cache in front of the backend has seen it yet. The second attempt is
+warm, and the median of the third and later attempts is the steady state. With only two attempts, the steady state is
+the warm attempt. A request's cache ratio is its cold response time over its steady state response time, i.e. how many
+times faster caching makes it, and the time warming saves is the difference between them.
+
+`RepeatTimings.write_csvs` writes every attempt to 'repeat_attempts.csv' and a row per request to
+'repeat_summary.csv', ordered by the time warming saves, so that the content most worth pre-warming comes first.
+"""
+
+SUMMARY_HEADERS = ["key", "attempts", "cold", "warm", "steady", "cache_ratio", "warming_saves"]
+
+
+class RepeatTimings:
+    def __init__(self):
+        # the response time of each attempt at each request, None where an attempt failed
+        self.attempts: dict[str, list[float | None]] = {}
+
+    def record(self, key: str, response_times: list[float | None]) -> None:
+        self.attempts[key] = response_times
+
+    def _summarise(self, response_times: list[float | None]) -> tuple[float | None, float | None, float | None]:
+        cold = response_times[0]
+        warm = response_times[1] if len(response_times) > 1 else None
+        steady_times = [response_time for response_time in response_times[2:] if response_time is not None]
+        steady = statistics.median(steady_times) if steady_times else warm
+
+        return cold, warm, steady
+
+    def summary_rows(self) -> list[list]:
+        rows = []
+        for key, response_times in self.attempts.items():
+            cold, warm, steady = self._summarise(response_times)
+            cache_ratio = cold / steady if cold is not None and steady else None
+            warming_saves = cold - steady if cold is not None and steady is not None else None
+            rows.append([key, len(response_times), cold, warm, steady, cache_ratio, warming_saves])
+
+        # the requests which warming speeds up the most first
+        return sorted(rows, key=lambda row: (row[-1] is not None, row[-1] or 0), reverse=True)
+
+    def histograms(self) -> dict[str, LatencyHistogram]:
+        histograms = {"cold": LatencyHistogram(), "warm": LatencyHistogram(), "steady": LatencyHistogram()}
+
+        for response_times in self.attempts.values():
+            for name, response_time in zip(histograms, self._summarise(response_times)):
+                if response_time is not None:
+                    histograms[name].record(response_time)
+
+        return histograms
+
+    def summary(self) -> str:
+        if not self.attempts:
+            return "No repeated requests recorded"
+
+        percentiles = []
+        for name, histogram in self.histograms().items():
+            if histogram.count:
+                percentiles.append(f"{name} p50: {histogram.percentile(50):.2f}s, p95: {histogram.percentile(95):.2f}s")
+
+        cache_ratios = [row[5] for row in self.summary_rows() if row[5] is not None]
+        cache_ratio = f", median cache ratio: {statistics.median(cache_ratios):.2f}" if cache_ratios else ""
+
+        return f"{len(self.attempts)} repeated requests - " + "; ".join(percentiles) + cache_ratio
+
+    def write_csvs(self, results_dir: str) -> None:
+        with open(f"{results_dir}/repeat_attempts.csv", "w", newline="") as attempts_file:
+            writer = csv.writer(attempts_file)
+            writer.writerow(["key", "attempt", "response_time"])
+            for key, response_times in self.attempts.items():
+                for attempt, response_time in enumerate(response_times, start=1):
+                    writer.writerow([key, attempt, "" if response_time is None else round(response_time, 3)])
+
+        with open(f"{results_dir}/repeat_summary.csv", "w", newline="") as summary_file:
+            writer = csv.writer(summary_file)
+            writer.writerow(SUMMARY_HEADERS)
+            for row in self.summary_rows():
+                writer.writerow(row[:2] + ["" if value is None else round(value, 3) for value in row[2:]])
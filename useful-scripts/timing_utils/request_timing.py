@@ -0,0 +1,66 @@
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+"""
+Timing of the connection phase of requests made with `requests`.
+
+`response.elapsed` covers everything from sending a request to parsing the response headers, including opening a new
+connection if there wasn't a keep-alive connection free. A session with `TimingHTTPAdapter` mounted times each
+connection as it is opened (DNS lookup, TCP connect and any TLS handshake), so that the connect time of a request can
+be told apart from the time the server took to respond.
+
+Connections are opened on the thread making the request, so the connect time is kept per thread:
+
+    reset_connect_time()
+    response = session.get(url)
+    connect_time()  # 0.0 if a keep-alive connection was reused
+"""
+
+_connect_timing = threading.local()
+
+
+def reset_connect_time() -> None:
+    _connect_timing.seconds = 0.0
+
+
+def connect_time() -> float:
+    return getattr(_connect_timing, "seconds", 0.0)
+
+
+def _record_connect_time(seconds: float) -> None:
+    _connect_timing.seconds = connect_time() + seconds
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        start = time.perf_counter()
+        super().connect()
+        _record_connect_time(time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        start = time.perf_counter()
+        super().connect()
+        _record_connect_time(time.perf_counter() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
@@ -0,0 +1,30 @@
+import argparse
+import hashlib
+
+"""
+Splitting a sweep of Ids between several machines, e.g. CI agents, each of which is given a shard in the form i/N.
+
+Ids are assigned to shards by a stable hash, so every machine can be given the same list of Ids and each Id is only in
+one shard. The hash ignores case, as the same GUID may be listed in lower case by one query and in upper case by
+another. Both fetch_permalinks.py and the permalink checker of the robot tests shard permalinks this way, so that the
+same shard of a sweep covers the same permalinks in each. The robot tests keep their own copy of this module in
+`tests/robot-tests/scripts/permalink_snapshots/sharding.py`, which needs to be kept in step with it.
+"""
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be in the form i/N, e.g. 0/4, got {value}")
+
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be from 0 to {count - 1}, got {value}")
+
+    return index, count
+
+
+def in_shard(key: str, shard: tuple[int, int]) -> bool:
+    # a stable hash rather than hash(), which is salted differently in each process
+    index, count = shard
+    return int(hashlib.sha256(key.lower().encode("utf-8")).hexdigest(), 16) % count == index
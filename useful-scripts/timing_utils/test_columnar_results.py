@@ -0,0 +1,85 @@
+import math
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# allow the tests to be run from this directory as well as from the useful scripts directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.columnar_results import COLUMNS_DIRNAME, ColumnarResultWriter, load_columns  # noqa: E402
+
+SCHEMA = {"id": "str", "response_time": "float", "status_code": "int"}
+
+
+class ColumnarResultsTest(unittest.TestCase):
+    def setUp(self):
+        self.results_dir = tempfile.TemporaryDirectory()
+        self.columns_dir = os.path.join(self.results_dir.name, COLUMNS_DIRNAME)
+
+    def tearDown(self):
+        self.results_dir.cleanup()
+
+    def _writer(self) -> ColumnarResultWriter:
+        return ColumnarResultWriter(self.results_dir.name, key="id", schema=SCHEMA, row_group_size=2)
+
+    def _append(self, writer: ColumnarResultWriter, row_ids: list[str]) -> None:
+        for row_id in row_ids:
+            writer.append({"id": row_id, "response_time": 1.5, "status_code": 200, "not_a_column": [row_id]})
+
+    @staticmethod
+    def _kill(writer: ColumnarResultWriter) -> None:
+        # a killed run never closes its writer, but its process exiting closes the pending file
+        writer._pending_file.close()
+
+    def test_buffered_rows_of_a_killed_run_are_kept_when_resuming(self):
+        # the last row of the killed run is only in its pending file
+        writer = self._writer()
+        self._append(writer, ["1", "2", "3"])
+        self._kill(writer)
+
+        # the resumed run is killed again before flushing the reloaded row
+        writer = self._writer()
+        self._append(writer, ["4"])
+        self._kill(writer)
+
+        with self._writer() as writer:
+            self._append(writer, ["5"])
+
+        self.assertEqual(load_columns(self.results_dir.name)["id"].tolist(), ["1", "2", "3", "4", "5"])
+        self.assertEqual(
+            sorted(os.listdir(self.columns_dir)), ["part-00000.npz", "part-00001.npz", "part-00002.npz", "schema.json"]
+        )
+
+    def test_rows_of_a_row_group_written_before_the_run_was_killed_are_not_repeated(self):
+        writer = self._writer()
+        self._append(writer, ["1"])
+        pending_rows = os.path.join(self.columns_dir, "part-00000.pending.jsonl")
+        shutil.copy(pending_rows, f"{pending_rows}.copy")
+        self._append(writer, ["2"])
+        self._kill(writer)
+
+        # killed after writing the row group but before removing its pending file, part way through another row
+        os.replace(f"{pending_rows}.copy", pending_rows)
+        with open(pending_rows, "a") as pending_file:
+            pending_file.write('{"id": "2", "resp')
+
+        self._writer().close()
+
+        self.assertEqual(load_columns(self.results_dir.name)["id"].tolist(), ["1", "2"])
+
+    def test_rows_are_read_back_as_typed_columns(self):
+        with self._writer() as writer:
+            self._append(writer, ["1", "2", "3"])
+            writer.append({"id": "4", "response_time": None, "status_code": None})
+
+        columns = load_columns(self.results_dir.name, ["response_time", "status_code"])
+
+        self.assertEqual(columns["status_code"].tolist(), [200, 200, 200, -1])
+        self.assertEqual(columns["response_time"][:3].tolist(), [1.5, 1.5, 1.5])
+        self.assertTrue(math.isnan(columns["response_time"][3]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# allow the tests to be run from this directory as well as from the useful scripts directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.jsonl_results import JsonlResultReader, JsonlResultWriter, non_200, slower_than  # noqa: E402
+
+
+class JsonlResultsTest(unittest.TestCase):
+    def _write_streamed_bodies(self, results_dir: str, compress: bool, separate_bodies: bool) -> JsonlResultReader:
+        streamed_bodies = {
+            "json": b'{"results": [\n{"value": "1"}\n]}',
+            "html": b"<html><body><h1>502 Bad Gateway</h1></body></html>\n",
+            "text": b'upstream request timeout "quoted"',
+            "empty": b"",
+        }
+
+        with JsonlResultWriter(
+            results_dir, key="id", body_field="body", compress=compress, separate_bodies=separate_bodies
+        ) as writer:
+            writer.append({"id": "in-memory", "status_code": 200, "response_time": 1.0, "body": {"results": []}})
+
+            for key, streamed_body in streamed_bodies.items():
+                body_path = os.path.join(results_dir, f"{key}.part")
+                with open(body_path, "wb") as body_file:
+                    body_file.write(streamed_body)
+
+                writer.append(
+                    {"id": key, "status_code": 200 if key == "json" else 502, "response_time": 2.0},
+                    body_path=body_path,
+                )
+
+        return JsonlResultReader(results_dir)
+
+    def test_streamed_bodies_which_are_not_json_keep_the_results_readable(self):
+        for compress in [False, True]:
+            for separate_bodies in [False, True]:
+                with self.subTest(
+                    compress=compress, separate_bodies=separate_bodies
+                ), tempfile.TemporaryDirectory() as d:
+                    reader = self._write_streamed_bodies(d, compress, separate_bodies)
+
+                    self.assertEqual(len(list(reader)), 5)
+                    self.assertEqual(len(slower_than(reader, 1.5)), 4)
+                    self.assertEqual([record["id"] for record in non_200(reader)], ["html", "text", "empty"])
+
+                    self.assertEqual(reader.body(reader.get("in-memory")), {"results": []})
+                    self.assertEqual(reader.body(reader.get("json")), {"results": [{"value": "1"}]})
+                    self.assertEqual(
+                        reader.body(reader.get("html")), "<html><body><h1>502 Bad Gateway</h1></body></html>\n"
+                    )
+                    self.assertEqual(reader.body(reader.get("text")), 'upstream request timeout "quoted"')
+                    self.assertEqual(reader.body(reader.get("empty")), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
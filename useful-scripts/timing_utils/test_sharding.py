@@ -0,0 +1,34 @@
+import argparse
+import os
+import sys
+import unittest
+import uuid
+
+# allow the tests to be run from this directory as well as from the useful scripts directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from timing_utils.sharding import in_shard, parse_shard  # noqa: E402
+
+
+class ShardingTest(unittest.TestCase):
+    def test_each_id_is_in_exactly_one_shard(self):
+        permalink_ids = [str(uuid.uuid4()) for _ in range(100)]
+
+        for permalink_id in permalink_ids:
+            self.assertEqual(sum(in_shard(permalink_id, (index, 4)) for index in range(4)), 1)
+
+    def test_ids_are_in_the_same_shard_whatever_their_case(self):
+        for permalink_id in [str(uuid.uuid4()) for _ in range(100)]:
+            for index in range(4):
+                self.assertEqual(in_shard(permalink_id, (index, 4)), in_shard(permalink_id.upper(), (index, 4)))
+
+    def test_invalid_shards_are_rejected(self):
+        self.assertEqual(parse_shard("3/4"), (3, 4))
+
+        for value in ["4/4", "-1/4", "0/0", "1", "a/b"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+
+if __name__ == "__main__":
+    unittest.main()